@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Асинхронный API для asyncio-сервисов
+Блокирующие вызовы BackgroundRemover выполняются в собственном пуле потоков
+фиксированного размера, количество одновременно выполняемой работы
+ограничено, отмена задачи освобождает место, а поток изображений
+обрабатывается с ограниченным окном в порядке поступления или по готовности
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncIterable, AsyncIterator, Iterable, Optional, Tuple, Union
+
+from background_remover import BackgroundRemover
+from metrics import inc
+from model_sessions import import_runtime
+from preflight import FileTimeoutError, deadline
+
+logger = logging.getLogger(__name__)
+
+# Потоков пула по умолчанию: инференс уже использует несколько ядер внутри
+# сессии, дополнительные потоки нужны в основном для декодирования и кодирования
+DEFAULT_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+
+async def _iterate(items: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """Обычный или асинхронный итератор как асинхронный"""
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+class AsyncBackgroundRemover:
+    """Асинхронная обертка над BackgroundRemover с ограничением одновременной работы"""
+
+    def __init__(self, model_name: str = "u2net", max_workers: Optional[int] = None,
+                 max_in_flight: Optional[int] = None, remover: Optional[BackgroundRemover] = None,
+                 **kwargs):
+        """
+        Инициализация
+
+        Args:
+            model_name: Название модели
+            max_workers: Количество потоков пула (по умолчанию не больше 4)
+            max_in_flight: Максимум вызовов, отправленных в пул и еще не
+                завершенных; остальные ждут места в цикле событий, не занимая
+                памяти пула (по умолчанию вдвое больше потоков)
+            remover: Готовый экземпляр BackgroundRemover (тогда model_name
+                и kwargs не используются)
+            **kwargs: Параметры BackgroundRemover (cache, session_config,
+                output_format, encode_options, ...)
+        """
+        # Модели загружаются в пуле, а rembg должен быть импортирован не в нем
+        import_runtime()
+        self.remover = remover or BackgroundRemover(model_name=model_name, **kwargs)
+        self.max_workers = max_workers or DEFAULT_MAX_WORKERS
+        self.max_in_flight = max_in_flight or self.max_workers * 2
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="async-remove")
+        self.in_flight = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncBackgroundRemover":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Остановка пула: ожидающие вызовы отменяются, выполняющиеся завершаются в фоне"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._slots.release()
+
+    @staticmethod
+    def _call(func, timeout: Optional[float], cancel: threading.Event) -> Any:
+        with deadline(timeout, cancel):
+            return func()
+
+    async def _run(self, func, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Вызов func в пуле с занятием места
+
+        Место освобождается, когда вызов действительно закончился: при отмене
+        ожидающей задачи вызов, еще не начатый пулом, снимается сразу, а уже
+        выполняющийся (прервать onnxruntime нельзя) - по его завершении. Так
+        отмененные задачи не накапливают работу сверх max_in_flight.
+
+        Args:
+            timeout: Ограничение времени вызова (None - без ограничения);
+                по его истечении ожидание прерывается с FileTimeoutError, а
+                вызов останавливается в ближайшей точке проверки срока
+                (см. preflight.check_deadline) и ничего не записывает
+        """
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        await self._slots.acquire()
+        cancel = threading.Event()
+        try:
+            future = self.executor.submit(self._call, partial(func, *args, **kwargs), timeout, cancel)
+        except BaseException:
+            self._slots.release()
+            raise
+        self.in_flight += 1
+
+        def on_done(_):
+            try:
+                loop.call_soon_threadsafe(self._release)
+            except RuntimeError:
+                # Цикл событий уже закрыт
+                pass
+
+        future.add_done_callback(on_done)
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            future.cancel()
+            cancel.set()
+            inc('async_timeouts')
+            raise FileTimeoutError(f"превышено время обработки ({timeout:g} с)")
+        except asyncio.CancelledError:
+            future.cancel()
+            cancel.set()
+            inc('async_cancelled')
+            raise
+
+    async def warmup(self) -> None:
+        """Загрузка модели в пуле, не блокируя цикл событий"""
+        await self._run(self.remover.warmup)
+
+    async def remove(self, data, output_type: Optional[str] = None, output_format: str = "PNG",
+                     **kwargs) -> Any:
+        """
+        Удаление фона с изображения в памяти (см. BackgroundRemover.remove)
+
+        Args:
+            data: bytes, bytearray, memoryview, файловый объект, PIL.Image
+                или массив numpy
+            output_type: Тип результата: 'pil', 'numpy' или 'bytes'
+            output_format: Формат кодирования для bytes
+            **kwargs: Параметры alpha matting и out
+
+        Returns:
+            Результат запрошенного типа
+        """
+        return await self._run(self.remover.remove, data, output_type=output_type,
+                               output_format=output_format, timeout=self.remover.file_timeout, **kwargs)
+
+    async def remove_file(self, input_path: str, output_path: str, **kwargs) -> bool:
+        """
+        Удаление фона с файла (см. BackgroundRemover.remove_background)
+
+        Файл, не уложившийся в file_timeout, считается неудачным (False), а
+        его результат не записывается.
+        """
+        return await self._run(self.remover.remove_background, input_path, output_path, **kwargs)
+
+    async def process_stream(self, items: Union[Iterable, AsyncIterable], ordered: bool = True,
+                             return_exceptions: bool = False, window: Optional[int] = None,
+                             output_type: Optional[str] = None, output_format: str = "PNG",
+                             **kwargs) -> AsyncIterator[Tuple[int, Any]]:
+        """
+        Обработка потока изображений
+
+        Следующие изображения берутся из items, только когда в окне есть
+        место, поэтому медленный потребитель результатов притормаживает и
+        чтение входного потока. При выходе из цикла (break, отмена, ошибка)
+        незавершенные задачи отменяются.
+
+        Args:
+            items: Обычный или асинхронный итератор изображений (как data у remove)
+            ordered: Результаты в порядке поступления (иначе по готовности)
+            return_exceptions: Отдавать исключение вместо результата
+                (иначе первая ошибка прерывает поток)
+            window: Максимум изображений в обработке и в ожидании выдачи
+                (по умолчанию max_in_flight)
+            output_type: Тип результата: 'pil', 'numpy' или 'bytes'
+            output_format: Формат кодирования для bytes
+            **kwargs: Параметры alpha matting
+
+        Returns:
+            AsyncIterator[Tuple[int, Any]]: Номер изображения во входном
+            потоке и результат (или исключение)
+        """
+        window = window or self.max_in_flight
+        source = _iterate(items).__aiter__()
+        tasks = deque()
+        exhausted = False
+        count = 0
+
+        async def fill():
+            nonlocal exhausted, count
+            while not exhausted and len(tasks) < window:
+                try:
+                    item = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                task = asyncio.ensure_future(self.remove(item, output_type=output_type,
+                                                         output_format=output_format, **kwargs))
+                tasks.append((count, task))
+                count += 1
+
+        def outcome(task: asyncio.Task) -> Any:
+            if return_exceptions and not task.cancelled() and task.exception() is not None:
+                return task.exception()
+            return task.result()
+
+        try:
+            await fill()
+            while tasks:
+                if ordered:
+                    await asyncio.wait([tasks[0][1]])
+                    ready = [tasks.popleft()]
+                else:
+                    done, _ = await asyncio.wait({task for _, task in tasks},
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                    ready = [entry for entry in tasks if entry[1] in done]
+                    for entry in ready:
+                        tasks.remove(entry)
+                # Освободившиеся места занимаются до выдачи результатов потребителю
+                await fill()
+                for index, task in ready:
+                    yield index, outcome(task)
+        finally:
+            for _, task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+            await source.aclose()
@@ -4,22 +4,39 @@ CLI инструмент для удаления фона с изображен
 Поддерживает форматы: PNG, JPG, JPEG, WEBP, TIFF, BMP
 """
 
+import io
 import os
 import sys
 import click
+import itertools
+import threading
 from pathlib import Path
-from typing import List, Optional
-from tqdm import tqdm
+from typing import Iterable, Iterator, List, Optional, Tuple
 import logging
 
 try:
-    from rembg import remove, new_session
-    from PIL import Image, ImageOps
+    from PIL import Image
 except ImportError as e:
     print(f"Ошибка импорта: {e}")
     print("Установите зависимости: pip install -r requirements.txt")
     sys.exit(1)
 
+from model_sessions import GRAPH_OPTIMIZATION_LEVELS, PROVIDER_NAMES, SessionConfig, get_session, warmup
+from batch_inference import convert_result, cutout, predict_masks, remove_batch, supports_batching, to_pil
+from result_cache import ResultCache, content_key
+from manifest import Manifest
+from file_scanner import ImageScanner
+from metrics import JsonLinesSink, inc, metrics, profiling, timer
+from large_image import LARGE_IMAGE_PIXELS, is_large, probe_size, remove_large
+from outputs import (COMPRESSION_LEVELS, EncodeOptions, OutputVariant, VariantWriter, atomic_output, encode_stats,
+                     parse_variant, write_file)
+from quantization import PRECISIONS
+from preflight import DEFAULT_MAX_PIXELS, Preflight, check_deadline, deadline
+from sequence import (DEFAULT_DIFF_THRESHOLD, DEFAULT_KEYFRAME_INTERVAL, VIDEO_FORMATS, SequenceOptions,
+                      SequenceProcessor, group_sequences, iter_video_frames, video_frame_count)
+from job_queue import DEFAULT_LEASE_SECONDS, DEFAULT_MAX_ATTEMPTS, make_job, open_queue, run_worker, summarize
+import model_cache
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -27,28 +44,267 @@ logger = logging.getLogger(__name__)
 # Поддерживаемые форматы
 SUPPORTED_FORMATS = {'.png', '.jpg', '.jpeg', '.webp', '.tiff', '.tif', '.bmp'}
 
+# Сколько заданий отправляется в очередь за одну транзакцию
+SUBMIT_CHUNK = 500
+
+# Доступные модели
+MODEL_CHOICES = ['u2net', 'u2netp', 'u2net_human_seg', 'u2net_cloth_seg', 'silueta', 'isnet-general-use', 'isnet-anime']
+
+class ModelNameType(click.ParamType):
+    """Название модели, в том числе вариант пониженной точности: u2net:int8"""
+    
+    name = 'model'
+    
+    def convert(self, value, param, ctx):
+        base, _, precision = value.partition(':')
+        if base not in MODEL_CHOICES:
+            self.fail(f"неизвестная модель {base} (доступны: {', '.join(MODEL_CHOICES)})", param, ctx)
+        if precision and precision not in PRECISIONS:
+            self.fail(f"неизвестная точность {precision} (доступны: {', '.join(PRECISIONS)})", param, ctx)
+        return value
+
+MODEL_TYPE = ModelNameType()
+
 class BackgroundRemover:
     """Класс для удаления фона с изображений"""
     
-    def __init__(self, model_name: str = "u2net"):
+    def __init__(self, model_name: str = "u2net", cache: Optional[ResultCache] = None,
+                 large_image_pixels: Optional[int] = LARGE_IMAGE_PIXELS,
+                 max_memory_mb: Optional[int] = None,
+                 outputs: Optional[List[OutputVariant]] = None,
+                 session_config: Optional[SessionConfig] = None,
+                 file_timeout: Optional[float] = None,
+                 output_format: str = 'png',
+                 encode_options: Optional[EncodeOptions] = None):
         """
         Инициализация с указанной моделью
         
         Args:
             model_name: Название модели для удаления фона
+            cache: Кэш результатов по содержимому файлов (None - без кэша)
+            large_image_pixels: Количество пикселей, начиная с которого файл
+                обрабатывается полосами с маской по уменьшенной копии (None - никогда)
+            max_memory_mb: Ограничение памяти на обработку большого изображения в МБ
+                (большие изображения обрабатываются по одному)
+            outputs: Дополнительные файлы (маска, другие форматы, уменьшенные
+                копии), которые строятся из того же результата
+            session_config: Параметры ONNX-сессии (потоки, оптимизация графа,
+                арена памяти, execution providers); None - по умолчанию onnxruntime
+            file_timeout: Ограничение времени обработки одного файла в секундах
+                (None - без ограничения)
+            output_format: Формат выходных файлов (png, webp)
+            encode_options: Параметры кодирования (уровень сжатия, WEBP
+                с потерями, палитра); None - по умолчанию
         """
         self.model_name = model_name
         self.session = None
+        self.cache = cache
+        self.large_image_pixels = large_image_pixels
+        self.max_memory_mb = max_memory_mb
+        self.variants = VariantWriter(outputs or [], output_format=output_format, options=encode_options)
+        self.session_config = session_config
+        self.file_timeout = file_timeout
+        # Большие изображения обрабатываются по одному, даже если их присылают
+        # несколько потоков (конвейер, асинхронный API), чтобы max_memory_mb
+        # ограничивал память процесса, а не каждого потока
+        self._large_lock = threading.Lock()
         
     def _get_session(self):
-        """Получение сессии для модели"""
-        if self.session is None:
-            self.session = new_session(self.model_name)
-        return self.session
+        """Получение сессии для модели из общего реестра процесса"""
+        if self.session is not None:
+            return self.session
+        with timer('session'):
+            return get_session(self.model_name, config=self.session_config)
+
+    def warmup(self):
+        """Загрузка модели до начала обработки"""
+        warmup([self.model_name], config=self.session_config)
+    
+    def worker_options(self, workers: int = 1) -> dict:
+        """
+        Параметры для создания такого же экземпляра в процессе-воркере
+        
+        Args:
+            workers: Количество воркеров, между которыми делятся ядра
+                при автоматическом выборе числа потоков
+        """
+        session_config = self.session_config.for_workers(workers) if self.session_config else None
+        return {
+            "large_image_pixels": self.large_image_pixels,
+            "max_memory_mb": self.max_memory_mb,
+            "outputs": self.variants.variants,
+            "session_config": session_config,
+            "file_timeout": self.file_timeout,
+            "output_format": self.variants.output_format,
+            "encode_options": self.variants.options,
+        }
+
+    def processing_params(self, alpha_matting: bool = False,
+                          alpha_matting_foreground_threshold: int = 240,
+                          alpha_matting_background_threshold: int = 10,
+                          alpha_matting_erode_size: int = 10,
+                          alpha_matting_fast: bool = False,
+                          alpha_matting_scale: float = 0.5) -> dict:
+        """
+        Параметры, от которых зависит результат обработки
+        
+        Returns:
+            dict: Модель, значимые параметры alpha matting и порог обработки
+            полосами, если он отличается от умолчания (большие изображения
+            обрабатываются по уменьшенной маске, и результат другой)
+        """
+        params = {"model": self.model_name, "alpha_matting": alpha_matting}
+        if self.large_image_pixels != LARGE_IMAGE_PIXELS:
+            # None - обработка полосами отключена
+            params["large_image_pixels"] = self.large_image_pixels
+        if alpha_matting:
+            params.update(
+                foreground_threshold=alpha_matting_foreground_threshold,
+                background_threshold=alpha_matting_background_threshold,
+                erode_size=alpha_matting_erode_size
+            )
+            if alpha_matting_fast:
+                params.update(fast=True, scale=alpha_matting_scale)
+        return params
+    
+    def cache_key(self, data: bytes, **kwargs) -> Optional[str]:
+        """
+        Ключ кэша для входного файла и параметров обработки
+        
+        Returns:
+            Optional[str]: Ключ или None, если кэш не используется
+        """
+        if self.cache is None:
+            return None
+        return content_key(data, **self.processing_params(**kwargs), **self.encoding_params())
+    
+    def encoding_params(self) -> dict:
+        """Параметры кодирования основного файла, отличные от умолчания (PNG без изменений)"""
+        params = self.variants.options.describe()
+        if self.variants.output_format != 'png':
+            params["format"] = self.variants.output_format
+        return params
+    
+    def _cached_result(self, key: Optional[str]) -> Optional[bytes]:
+        """Результат из кэша или None"""
+        if key is None:
+            return None
+        cached = self.cache.get(key)
+        inc('cache_hits' if cached is not None else 'cache_misses')
+        return cached
+    
+    def remove(self, data, output_type: Optional[str] = None, output_format: str = "PNG",
+               out=None, alpha_matting: bool = False,
+               alpha_matting_foreground_threshold: int = 240,
+               alpha_matting_background_threshold: int = 10,
+               alpha_matting_erode_size: int = 10,
+               alpha_matting_fast: bool = False,
+               alpha_matting_scale: float = 0.5):
+        """
+        Удаление фона с изображения в памяти, без промежуточных файлов
+        
+        Байты и буферы не копируются (декодер читает их напрямую), уже
+        декодированные PIL.Image и массивы numpy не проходят через
+        кодирование в PNG и обратно.
+        
+        Args:
+            data: bytes, bytearray, memoryview, файловый объект, PIL.Image
+                или массив numpy
+            output_type: Тип результата: 'pil', 'numpy' (HxWx4 uint8) или
+                'bytes'; по умолчанию тот же, что у data (для буферов и
+                файловых объектов - bytes)
+            output_format: Формат кодирования для bytes и out
+            out: Файловый объект, в который результат кодируется напрямую
+            alpha_matting: Использовать alpha matting для лучшего качества
+            alpha_matting_foreground_threshold: Порог для переднего плана
+            alpha_matting_background_threshold: Порог для фона
+            alpha_matting_erode_size: Размер эрозии
+            alpha_matting_fast: Быстрый alpha matting (по неизвестной полосе trimap, по тайлам)
+            alpha_matting_scale: Масштаб решения для быстрого alpha matting
+            
+        Returns:
+            Результат запрошенного типа (или out, если он передан)
+        """
+        # Тот же путь, что и у пакетной обработки: стадии замеряются по отдельности
+        result = remove_batch(
+            self._get_session(),
+            self.model_name,
+            [data],
+            output_type='pil' if out is not None else output_type,
+            output_format=output_format,
+            encode_options=self.variants.options,
+            alpha_matting=alpha_matting,
+            alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
+            alpha_matting_background_threshold=alpha_matting_background_threshold,
+            alpha_matting_erode_size=alpha_matting_erode_size,
+            alpha_matting_fast=alpha_matting_fast,
+            alpha_matting_scale=alpha_matting_scale
+        )[0]
+        if out is None:
+            return result
+        return convert_result(result, output_format=output_format, out=out,
+                              encode_options=self.variants.options)
+    
+    def remove_from_data(self, data, **kwargs):
+        """
+        Удаление фона с изображения, уже находящегося в памяти
+        
+        Оставлено для совместимости, см. remove
+        
+        Returns:
+            Результат того же типа, что и data (для байтов - PNG)
+        """
+        return self.remove(data, **kwargs)
+    
+    def _write_result(self, cutout: Image.Image, output_path: str, key: Optional[str]) -> None:
+        """Кодирование и запись результата вместе с дополнительными файлами, сохранение в кэш"""
+        if self.variants:
+            output_data = self.variants.write(cutout, output_path)
+        elif key is None:
+            # Без кэша результат кодируется сразу в файл, без промежуточных байтов
+            with atomic_output(output_path) as tmp_name:
+                self.variants.encode(cutout, tmp_name)
+            return
+        else:
+            output_data = self.variants.encode(cutout)
+            with timer('write'):
+                write_file(output_path, output_data)
+        if key is not None:
+            self.cache.put(key, output_data)
+    
+    def _write_cached(self, output_data: bytes, output_path: str) -> None:
+        """Запись результата из кэша; дополнительные файлы строятся из него же"""
+        with timer('write'):
+            write_file(output_path, output_data)
+        if self.variants:
+            with timer('decode'):
+                cutout = Image.open(io.BytesIO(output_data))
+                cutout.load()
+            self.variants.write(cutout, output_path, primary=False)
+    
+    def _is_large(self, data) -> bool:
+        """Нужно ли обрабатывать файл полосами (размер берется из заголовка)"""
+        return is_large(probe_size(data), self.large_image_pixels)
+    
+    def _remove_large(self, data: bytes, output_path: str, key: Optional[str], **kwargs) -> None:
+        """Обработка большого изображения полосами с записью результата сразу в файл"""
+        max_memory = self.max_memory_mb * 1024 * 1024 if self.max_memory_mb else None
+        with self._large_lock:
+            # Срок файла мог истечь, пока обрабатывалось другое большое изображение
+            check_deadline()
+            result = remove_large(self._get_session(), self.model_name, data, output_path,
+                                  max_memory=max_memory, encode=self.variants.encode,
+                                  encode_bytes_per_pixel=self.variants.encode_bytes_per_pixel(), **kwargs)
+            if self.variants:
+                self.variants.write(result, output_path, primary=False)
+            del result
+        if key is not None:
+            self.cache.put(key, Path(output_path).read_bytes())
     
     def remove_background(self, input_path: str, output_path: str, 
                          alpha_matting: bool = False, alpha_matting_foreground_threshold: int = 240,
-                         alpha_matting_background_threshold: int = 10, alpha_matting_erode_size: int = 10) -> bool:
+                         alpha_matting_background_threshold: int = 10, alpha_matting_erode_size: int = 10,
+                         alpha_matting_fast: bool = False, alpha_matting_scale: float = 0.5) -> bool:
         """
         Удаление фона с изображения
         
@@ -59,6 +315,8 @@ class BackgroundRemover:
             alpha_matting_foreground_threshold: Порог для переднего плана
             alpha_matting_background_threshold: Порог для фона
             alpha_matting_erode_size: Размер эрозии
+            alpha_matting_fast: Быстрый alpha matting (по неизвестной полосе trimap, по тайлам)
+            alpha_matting_scale: Масштаб решения для быстрого alpha matting
             
         Returns:
             bool: True если успешно, False в противном случае
@@ -66,23 +324,48 @@ class BackgroundRemover:
         try:
             logger.info(f"Обработка: {input_path}")
             
-            # Чтение входного изображения
-            with open(input_path, 'rb') as input_file:
-                input_data = input_file.read()
-            
-            # Удаление фона
-            output_data = remove(
-                input_data,
-                session=self._get_session(),
+            params = dict(
                 alpha_matting=alpha_matting,
                 alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
                 alpha_matting_background_threshold=alpha_matting_background_threshold,
-                alpha_matting_erode_size=alpha_matting_erode_size
+                alpha_matting_erode_size=alpha_matting_erode_size,
+                alpha_matting_fast=alpha_matting_fast,
+                alpha_matting_scale=alpha_matting_scale
             )
             
-            # Сохранение результата
-            with open(output_path, 'wb') as output_file:
-                output_file.write(output_data)
+            with deadline(self.file_timeout):
+                if self.cache is None:
+                    # Без кэша файл не читается в память целиком: декодер читает
+                    # его напрямую, а результат кодируется сразу в выходной файл
+                    with open(input_path, 'rb') as input_file:
+                        if self._is_large(input_file):
+                            input_file.seek(0)
+                            with timer('read'):
+                                input_data = input_file.read()
+                            self._remove_large(input_data, output_path, None, **params)
+                        else:
+                            input_file.seek(0)
+                            self._write_result(self.remove(input_file, output_type='pil', **params),
+                                               output_path, None)
+                    logger.info(f"Сохранено: {output_path}")
+                    return True
+            
+                # Чтение входного изображения
+                with timer('read'), open(input_path, 'rb') as input_file:
+                    input_data = input_file.read()
+            
+                # Удаление фона, если результата для этого содержимого еще нет в кэше
+                key = self.cache_key(input_data, **params)
+                output_data = self._cached_result(key)
+                if output_data is not None:
+                    logger.info(f"Результат взят из кэша: {input_path}")
+                    self._write_cached(output_data, output_path)
+                elif self._is_large(input_data):
+                    # PNG большого изображения не собирается в памяти, а пишется сразу в файл
+                    self._remove_large(input_data, output_path, key, **params)
+                else:
+                    # Все выходные файлы строятся из одного результата в памяти
+                    self._write_result(self.remove(input_data, output_type='pil', **params), output_path, key)
             
             logger.info(f"Сохранено: {output_path}")
             return True
@@ -91,8 +374,315 @@ class BackgroundRemover:
             logger.error(f"Ошибка при обработке {input_path}: {e}")
             return False
     
+    def remove_backgrounds(self, images: list, alpha_matting: bool = False,
+                           alpha_matting_foreground_threshold: int = 240,
+                           alpha_matting_background_threshold: int = 10,
+                           alpha_matting_erode_size: int = 10,
+                           alpha_matting_fast: bool = False,
+                           alpha_matting_scale: float = 0.5) -> list:
+        """
+        Удаление фона с нескольких изображений за один вызов модели
+        
+        Args:
+            images: Список байтов файлов, PIL.Image или массивов numpy
+            alpha_matting: Использовать alpha matting для лучшего качества
+            alpha_matting_foreground_threshold: Порог для переднего плана
+            alpha_matting_background_threshold: Порог для фона
+            alpha_matting_erode_size: Размер эрозии
+            alpha_matting_fast: Быстрый alpha matting (по неизвестной полосе trimap, по тайлам)
+            alpha_matting_scale: Масштаб решения для быстрого alpha matting
+            
+        Returns:
+            list: Результаты того же типа, что и входные данные (для байтов - PNG)
+        """
+        return remove_batch(
+            self._get_session(),
+            self.model_name,
+            images,
+            alpha_matting=alpha_matting,
+            alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
+            alpha_matting_background_threshold=alpha_matting_background_threshold,
+            alpha_matting_erode_size=alpha_matting_erode_size,
+            alpha_matting_fast=alpha_matting_fast,
+            alpha_matting_scale=alpha_matting_scale
+        )
+    
+    def remove_background_batch(self, tasks: List[Tuple[str, str]], **kwargs) -> List[bool]:
+        """
+        Удаление фона с пачки файлов за один вызов модели
+        
+        Args:
+            tasks: Пары (входной файл, выходной файл)
+            **kwargs: Дополнительные параметры для remove_backgrounds
+            
+        Returns:
+            List[bool]: Результат для каждого файла
+        """
+        results = [False] * len(tasks)
+        
+        # Файлы декодируются по одному, чтобы испорченный файл не ронял всю пачку
+        images = []
+        indices = []
+        keys = []
+        for i, (input_file, output_file) in enumerate(tasks):
+            try:
+                logger.info(f"Обработка: {input_file}")
+                with deadline(self.file_timeout):
+                    with timer('read'):
+                        input_data = Path(input_file).read_bytes()
+                    key = self.cache_key(input_data, **kwargs)
+                    cached = self._cached_result(key)
+                    if cached is not None:
+                        self._write_cached(cached, output_file)
+                        logger.info(f"Результат взят из кэша: {input_file}")
+                        results[i] = True
+                        continue
+                    if self._is_large(input_data):
+                        # Большие изображения не попадают в батч, чтобы не держать их в памяти целиком
+                        self._remove_large(input_data, output_file, key, **kwargs)
+                        logger.info(f"Сохранено: {output_file}")
+                        results[i] = True
+                        continue
+                    with timer('decode'):
+                        image = to_pil(input_data)
+                        image.load()
+                images.append(image)
+                indices.append(i)
+                keys.append(key)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке {input_file}: {e}")
+        
+        if not images:
+            return results
+        
+        try:
+            # Время батча - сумма времени на каждое изображение
+            with deadline(self.file_timeout and self.file_timeout * len(images)):
+                cutouts = self.remove_backgrounds(images, **kwargs)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке пачки из {len(images)} файлов: {e}")
+            return results
+        
+        def write(i: int, key: Optional[str], cutout: Image.Image) -> bool:
+            output_file = tasks[i][1]
+            try:
+                self._write_result(cutout, output_file, key)
+                logger.info(f"Сохранено: {output_file}")
+                return True
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении {output_file}: {e}")
+                return False
+        
+        # Результаты батча кодируются параллельно; с дополнительными файлами
+        # пул уже занят файлами одного результата
+        write_all = map if self.variants else self.variants.map
+        for i, success in zip(indices, write_all(write, indices, keys, cutouts)):
+            results[i] = success
+        
+        return results
+    
+    def process_files(self, tasks: Iterable[Tuple[str, str]], batch_size: int = 1,
+                      progress_bar=None, manifest: Optional[Manifest] = None,
+                      **kwargs) -> Tuple[int, int]:
+        """
+        Последовательная обработка списка файлов
+        
+        Args:
+            tasks: Пары (входной файл, выходной файл)
+            batch_size: Количество изображений в одном вызове модели
+            progress_bar: Прогресс-бар tqdm (None - без прогресса)
+            manifest: Манифест для записи обработанных файлов
+            **kwargs: Дополнительные параметры для remove_background
+            
+        Returns:
+            Tuple[int, int]: Количество обработанных и неудачных файлов
+        """
+        processed = 0
+        failed = 0
+        tasks = iter(tasks)
+        
+        while True:
+            batch = list(itertools.islice(tasks, batch_size))
+            if not batch:
+                break
+            if batch_size > 1:
+                results = self.remove_background_batch(batch, **kwargs)
+            else:
+                results = [self.remove_background(input_file, output_file, **kwargs)
+                           for input_file, output_file in batch]
+            
+            if manifest is not None:
+                for (input_file, output_file), success in zip(batch, results):
+                    if success:
+                        manifest.record(input_file, output_file)
+            
+            processed += sum(results)
+            failed += len(results) - sum(results)
+            inc('images_processed', sum(results))
+            inc('images_failed', len(results) - sum(results))
+            if progress_bar is not None:
+                progress_bar.update(len(batch))
+        
+        return processed, failed
+    
+    def _predict_frames(self, images: List[Image.Image]) -> List[Image.Image]:
+        """Маски ключевых кадров за один вызов модели"""
+        with deadline(self.file_timeout and self.file_timeout * len(images)):
+            with timer('inference'):
+                return predict_masks(self._get_session(), images, self.model_name)
+    
+    def _write_frame(self, image: Image.Image, mask: Image.Image, output_file: str, **kwargs) -> bool:
+        """Вырезание кадра по маске и запись без кэша: маска могла быть взята с другого кадра"""
+        try:
+            with timer('alpha_matting' if kwargs.get('alpha_matting') else 'cutout'):
+                result = cutout(image, mask, **kwargs)
+            self._write_result(result, output_file, None)
+            logger.debug(f"Сохранено: {output_file}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении {output_file}: {e}")
+            return False
+    
+    def _run_sequence(self, frames, processor: SequenceProcessor, batch_size: int,
+                      **kwargs) -> Iterator[Tuple[str, str, bool]]:
+        """Обработка одной последовательности кадров (см. SequenceProcessor.run)"""
+        write_all = map if self.variants else self.variants.map
+        return processor.run(frames, self._predict_frames,
+                             lambda image, mask, output_file: self._write_frame(image, mask, output_file, **kwargs),
+                             batch_size=batch_size, map_func=write_all)
+    
+    def _read_frames(self, tasks: Iterable[Tuple[str, str]]) -> Iterator[Tuple[str, str, Optional[Image.Image]]]:
+        """Чтение кадров из файлов по одному; нечитаемый кадр отдается как None"""
+        for input_file, output_file in tasks:
+            try:
+                with deadline(self.file_timeout):
+                    with timer('read'):
+                        input_data = Path(input_file).read_bytes()
+                    with timer('decode'):
+                        image = to_pil(input_data)
+                        image.load()
+            except Exception as e:
+                logger.error(f"Ошибка при обработке {input_file}: {e}")
+                image = None
+            yield input_file, output_file, image
+    
+    def process_sequences(self, tasks: Iterable[Tuple[str, str]], processor: SequenceProcessor,
+                          batch_size: int = 1, progress_bar=None, manifest: Optional[Manifest] = None,
+                          **kwargs) -> Tuple[int, int]:
+        """
+        Обработка файлов с распознаванием последовательностей кадров
+        
+        Кадры последовательностей обрабатываются по порядку с переиспользованием
+        масок (кэш результатов для них не используется), остальные файлы -
+        как в process_files.
+        
+        Args:
+            tasks: Пары (входной файл, выходной файл)
+            processor: Обработчик последовательностей (параметры и счетчики кадров)
+            batch_size: Количество изображений (ключевых кадров) в одном вызове модели
+            progress_bar: Прогресс-бар tqdm (None - без прогресса)
+            manifest: Манифест для записи обработанных файлов
+            **kwargs: Дополнительные параметры для remove_background
+            
+        Returns:
+            Tuple[int, int]: Количество обработанных и неудачных файлов
+        """
+        sequences, singles = group_sequences(tasks, processor.options.min_length)
+        if sequences and not supports_batching(self.model_name):
+            logger.warning(f"Модель {self.model_name} не отдает маски отдельно от результата, "
+                           f"кадры обрабатываются как отдельные изображения")
+            singles = [task for frames in sequences for task in frames] + singles
+            sequences = []
+        
+        processed, failed = self.process_files(singles, batch_size=batch_size, progress_bar=progress_bar,
+                                               manifest=manifest, **kwargs)
+        for frames in sequences:
+            logger.info(f"Последовательность из {len(frames)} кадров: {frames[0][0]}")
+            for input_file, output_file, success in self._run_sequence(self._read_frames(frames), processor,
+                                                                        batch_size, **kwargs):
+                if success:
+                    processed += 1
+                    if manifest is not None:
+                        manifest.record(input_file, output_file)
+                else:
+                    failed += 1
+                inc('images_processed' if success else 'images_failed')
+                if progress_bar is not None:
+                    progress_bar.update(1)
+        return processed, failed
+    
+    def process_video(self, input_file: str, output_dir: str, processor: Optional[SequenceProcessor] = None,
+                      batch_size: int = 1, **kwargs) -> dict:
+        """
+        Удаление фона с кадров видео
+        
+        Кадры читаются потоковым декодером по одному и записываются в
+        output_dir как <имя видео>_000001.png, ... (с прозрачностью).
+        
+        Args:
+            input_file: Видеофайл
+            output_dir: Директория для кадров
+            processor: Обработчик последовательностей (None - параметры по умолчанию)
+            batch_size: Количество ключевых кадров в одном вызове модели
+            **kwargs: Дополнительные параметры для remove_background
+            
+        Returns:
+            dict: Статистика обработки
+        """
+        if not supports_batching(self.model_name):
+            raise ValueError(f"Модель {self.model_name} не поддерживает обработку видео")
+        processor = processor or SequenceProcessor()
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        encode_stats.reset()
+        
+        stem = Path(input_file).stem
+        suffix = self.variants.suffix
+        frames = ((f"{input_file}#{number}", str(output_path / f"{stem}_{number:06d}{suffix}"), image)
+                  for number, image in enumerate(iter_video_frames(input_file), 1))
+        
+        from tqdm import tqdm
+        
+        # Заголовок читается до загрузки модели: без PyAV ошибка сразу
+        total = video_frame_count(input_file)
+        self.warmup()
+        processed = 0
+        failed = 0
+        with tqdm(total=total, desc="Удаление фона") as progress_bar:
+            for _, _, success in self._run_sequence(frames, processor, batch_size, **kwargs):
+                processed += success
+                failed += not success
+                inc('images_processed' if success else 'images_failed')
+                progress_bar.update(1)
+        
+        return {
+            "processed": processed,
+            "failed": failed,
+            "sequence": processor.report(),
+            "encoding": encode_stats.report(),
+            "total": processed + failed
+        }
+    
+    def _output_file_for(self, image_file: Path, input_path: Path, output_path: Path,
+                         recursive: bool) -> Path:
+        """Определение выходного файла для входного изображения"""
+        suffix = self.variants.suffix
+        # Определение относительного пути для сохранения структуры директорий
+        if recursive:
+            rel_path = image_file.relative_to(input_path)
+            output_file = output_path / rel_path.with_suffix(suffix)
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            output_file = output_path / f"{image_file.stem}_nobg{suffix}"
+        return output_file
+    
     def process_directory(self, input_dir: str, output_dir: str, 
-                         recursive: bool = False, **kwargs) -> dict:
+                         recursive: bool = False, workers: int = 1, pipeline: bool = False,
+                         io_threads: int = 4, batch_size: int = 1, incremental: bool = False,
+                         include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                         preflight: Optional[Preflight] = None,
+                         sequence: Optional[SequenceOptions] = None,
+                         count_files: bool = False, **kwargs) -> dict:
         """
         Обработка всех изображений в директории
         
@@ -100,6 +690,24 @@ class BackgroundRemover:
             input_dir: Входная директория
             output_dir: Выходная директория
             recursive: Рекурсивный обход поддиректорий
+            workers: Количество процессов для параллельной обработки
+            pipeline: Конвейерная обработка (декодирование и запись в
+                отдельных потоках, параллельно с инференсом)
+            io_threads: Количество потоков ввода-вывода в конвейерном режиме
+            batch_size: Количество изображений в одном вызове модели
+            incremental: Пропускать файлы, уже обработанные с теми же
+                параметрами (по манифесту в выходной директории)
+            include: Шаблоны файлов для обработки (относительно input_dir)
+            exclude: Шаблоны файлов и директорий, которые нужно пропустить
+            preflight: Проверка заголовков файлов перед обработкой; отклоненные
+                файлы не обрабатываются и считаются по причинам (None - без проверки)
+            sequence: Распознавать последовательности кадров и переиспользовать
+                маски почти не изменившихся кадров; обработка идет в этом
+                процессе, workers и pipeline не используются (None - каждый
+                файл обрабатывается отдельно)
+            count_files: Сразу подсчитывать файлы для прогресс-бара отдельным
+                обходом дерева в фоне (удваивает чтение директорий; без него
+                общее количество известно, когда поиск дойдет до конца)
             **kwargs: Дополнительные параметры для remove_background
             
         Returns:
@@ -113,139 +721,1001 @@ class BackgroundRemover:
         
         # Создание выходной директории
         output_path.mkdir(parents=True, exist_ok=True)
+        encode_stats.reset()
         
-        # Поиск всех изображений
-        image_files = []
-        if recursive:
-            pattern = "**/*"
-        else:
-            pattern = "*"
-            
-        for file_path in input_path.glob(pattern):
-            if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_FORMATS:
-                image_files.append(file_path)
+        # Изображения находятся по ходу обработки, список всех файлов не строится
+        scanner = ImageScanner(input_path, SUPPORTED_FORMATS, recursive=recursive,
+                               include=include, exclude=exclude)
+        found = 0
         
-        if not image_files:
-            logger.warning(f"Изображения не найдены в {input_dir}")
-            return {"processed": 0, "failed": 0, "total": 0}
+        from tqdm import tqdm
+        progress_bar = tqdm(total=None, desc="Удаление фона")
+        
+        def set_total(total):
+            progress_bar.total = total
+            progress_bar.refresh()
+        
+        def iter_tasks():
+            nonlocal found
+            for image_file in scanner:
+                found += 1
+                yield (str(image_file), str(self._output_file_for(image_file, input_path, output_path, recursive)))
+            # Общее количество известно по окончании поиска без отдельного обхода
+            set_total(found)
         
-        logger.info(f"Найдено {len(image_files)} изображений для обработки")
+        tasks = iter_tasks()
+        
+        manifest = None
+        if incremental:
+            params = self.processing_params(**kwargs)
+            params.update(self.encoding_params())
+            if self.variants:
+                params["outputs"] = [str(variant) for variant in self.variants.variants]
+            if sequence is not None:
+                params["sequence"] = sequence.describe()
+            manifest = Manifest(output_dir, params)
+            tasks = manifest.iter_pending(tasks, on_skip=lambda: progress_bar.update(1))
+        
+        if preflight is not None:
+            # Проверяются только файлы, которые действительно нужно обработать
+            tasks = preflight.filter(tasks, on_reject=lambda: progress_bar.update(1))
         
-        # Обработка изображений
         processed = 0
         failed = 0
+        processor = SequenceProcessor(sequence) if sequence is not None else None
         
-        for image_file in tqdm(image_files, desc="Удаление фона"):
-            # Определение относительного пути для сохранения структуры директорий
-            if recursive:
-                rel_path = image_file.relative_to(input_path)
-                output_file = output_path / rel_path.with_suffix('.png')
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-            else:
-                output_file = output_path / f"{image_file.stem}_nobg.png"
-            
-            if self.remove_background(str(image_file), str(output_file), **kwargs):
-                processed += 1
-            else:
-                failed += 1
+        try:
+            # Модель загружается только если есть что обрабатывать
+            first_task = next(tasks, None)
+            if first_task is not None:
+                tasks = itertools.chain([first_task], tasks)
+                if count_files:
+                    scanner.count_in_background(set_total)
+                
+                if processor is not None:
+                    self.warmup()
+                    processed, failed = self.process_sequences(tasks, processor, batch_size=batch_size,
+                                                               progress_bar=progress_bar,
+                                                               manifest=manifest, **kwargs)
+                elif workers > 1:
+                    from parallel_engine import run_parallel
+                    processed, failed = run_parallel(self.model_name, tasks, workers,
+                                                     batch_size=batch_size, cache=self.cache,
+                                                     remover_options=self.worker_options(workers),
+                                                     manifest=manifest, progress_bar=progress_bar,
+                                                     **kwargs)
+                elif pipeline:
+                    from pipeline import run_pipeline
+                    self.warmup()
+                    processed, failed = run_pipeline(self, tasks, io_threads=io_threads,
+                                                     batch_size=batch_size, progress_bar=progress_bar,
+                                                     manifest=manifest, **kwargs)
+                else:
+                    # Модель загружается один раз на весь проход
+                    self.warmup()
+                    
+                    # Обработка изображений
+                    processed, failed = self.process_files(tasks, batch_size=batch_size,
+                                                           progress_bar=progress_bar,
+                                                           manifest=manifest, **kwargs)
+        finally:
+            progress_bar.close()
+            if manifest is not None:
+                manifest.compact()
+        
+        skipped = manifest.skipped if manifest is not None else 0
+        
+        if not found:
+            logger.warning(f"Изображения не найдены в {input_dir}")
+        else:
+            logger.info(f"Найдено {found} изображений, пропущено без изменений: {skipped}")
         
         return {
             "processed": processed,
             "failed": failed,
-            "total": len(image_files)
+            "skipped": skipped,
+            "rejected": preflight.rejected if preflight is not None else 0,
+            "reject_reasons": dict(preflight.reasons) if preflight is not None else {},
+            "encoding": encode_stats.report(),
+            "sequence": processor.report() if processor is not None else None,
+            "total": found
+        }
+
+    def submit_directory(self, queue, input_dir: str, output_dir: str, recursive: bool = False,
+                         include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                         preflight: Optional[Preflight] = None, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                         resubmit: bool = False, **kwargs) -> dict:
+        """
+        Отправка изображений директории в очередь заданий вместо обработки
+
+        Выходные файлы определяются так же, как в process_directory, и
+        записываются в задания вместе с моделью, форматом, параметрами
+        кодирования и alpha matting: воркер воспроизводит ту же обработку.
+
+        Args:
+            queue: Очередь (job_queue.open_queue)
+            input_dir: Входная директория
+            output_dir: Выходная директория (должна быть доступна воркерам)
+            recursive: Рекурсивный обход поддиректорий
+            include: Шаблоны файлов для обработки
+            exclude: Шаблоны файлов и директорий, которые нужно пропустить
+            preflight: Проверка заголовков перед отправкой (None - без проверки)
+            max_attempts: Количество попыток обработки задания
+            resubmit: Вернуть в очередь уже выполненные и неудачные задания
+            **kwargs: Параметры alpha matting для remove_background
+
+        Returns:
+            dict: Количество найденных, отправленных и отклоненных файлов
+        """
+        input_path = Path(input_dir)
+        output_path = Path(output_dir)
+        if not input_path.exists():
+            raise FileNotFoundError(f"Директория не найдена: {input_dir}")
+        output_path.mkdir(parents=True, exist_ok=True)
+
+        options = self.variants.options
+        params = {
+            "model": self.model_name,
+            "format": self.variants.output_format,
+            "encoding": [options.compression, options.quality, options.palette],
+            "kwargs": kwargs,
         }
 
-@click.command()
+        scanner = ImageScanner(input_path, SUPPORTED_FORMATS, recursive=recursive,
+                               include=include, exclude=exclude)
+        found = 0
+
+        def iter_tasks():
+            nonlocal found
+            for image_file in scanner:
+                found += 1
+                yield (str(image_file), str(self._output_file_for(image_file, input_path, output_path, recursive)))
+
+        tasks = iter_tasks()
+        if preflight is not None:
+            tasks = preflight.filter(tasks)
+
+        # Задания отправляются порциями: транзакция sqlite не держится, пока идет обход директории
+        jobs = (make_job(input_file, output_file, params, max_attempts) for input_file, output_file in tasks)
+        submitted = 0
+        while True:
+            chunk = list(itertools.islice(jobs, SUBMIT_CHUNK))
+            if not chunk:
+                break
+            submitted += queue.submit(chunk, resubmit=resubmit)
+        logger.info(f"Найдено {found} изображений, отправлено в очередь: {submitted}")
+        return {
+            "submitted": submitted,
+            "rejected": preflight.rejected if preflight is not None else 0,
+            "reject_reasons": dict(preflight.reasons) if preflight is not None else {},
+            "total": found
+        }
+
+def _validate_threads(ctx, param, value):
+    """Количество потоков: неотрицательное число или auto"""
+    if value is None or value == 'auto':
+        return value
+    try:
+        threads = int(value)
+    except ValueError:
+        raise click.BadParameter(f"ожидается число или auto: {value}")
+    if threads < 0:
+        raise click.BadParameter(f"ожидается неотрицательное число: {value}")
+    return threads
+
+def session_options(func):
+    """Опции параметров ONNX-сессии, общие для команд remove и serve"""
+    options = [
+        click.option('--threads', default=None, callback=_validate_threads,
+                     help='Потоков внутри оператора на сессию: число или auto (ядра делятся между '
+                          'воркерами и моделями; по умолчанию все ядра на каждую сессию)'),
+        click.option('--inter-op-threads', default=0, type=click.IntRange(min=0),
+                     help='Потоков между операторами (0 - по умолчанию onnxruntime)'),
+        click.option('--graph-optimization', default='all', show_default=True,
+                     type=click.Choice(list(GRAPH_OPTIMIZATION_LEVELS)),
+                     help='Уровень оптимизации графа onnxruntime'),
+        click.option('--no-memory-arena', is_flag=True,
+                     help='Отключить арену памяти onnxruntime (меньше памяти, медленнее выделение)'),
+        click.option('--provider', 'providers', multiple=True, type=click.Choice(list(PROVIDER_NAMES)),
+                     help='Execution provider в порядке предпочтения (можно указать несколько, '
+                          'неустановленные пропускаются, CPU - запасной)'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+def matting_options(func):
+    """Опции alpha matting, общие для команд remove и submit"""
+    options = [
+        click.option('--alpha-matting', is_flag=True, help='Использовать alpha matting для лучшего качества'),
+        click.option('--foreground-threshold', default=240, type=int, help='Порог для переднего плана (0-255)'),
+        click.option('--background-threshold', default=10, type=int, help='Порог для фона (0-255)'),
+        click.option('--erode-size', default=10, type=int, help='Размер эрозии для alpha matting'),
+        click.option('--fast-matting', is_flag=True,
+                     help='Быстрый alpha matting: решение только в полосе неопределенности, по тайлам'),
+        click.option('--matting-scale', default=0.5, type=click.FloatRange(0.1, 1.0), show_default=True,
+                     help='Масштаб решения для --fast-matting (1.0 - полное разрешение)'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+def encoding_options(func):
+    """Опции формата и кодирования выходных файлов, общие для команд remove и submit"""
+    options = [
+        click.option('--format', '-f', default='png',
+                     type=click.Choice(['png', 'webp']), help='Формат выходного файла'),
+        click.option('--compression', default='default', show_default=True, type=click.Choice(list(COMPRESSION_LEVELS)),
+                     help='Уровень сжатия: fast - быстрое кодирование (PNG level 1), best - минимальный размер '
+                          '(оптимизированный PNG, WEBP method 6)'),
+        click.option('--quality', default=None, type=click.IntRange(1, 100),
+                     help='WEBP с потерями с этим качеством (альфа-канал без потерь); по умолчанию WEBP без потерь'),
+        click.option('--palette', default=None, type=click.IntRange(2, 256),
+                     help='Сократить цвета до палитры из N цветов с прозрачностью (меньше файлы, возможны полосы на градиентах)'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+def _configure_model_dir(ctx, param, value):
+    if value:
+        model_cache.configure(model_dir=value)
+
+def _configure_offline(ctx, param, value):
+    if value:
+        model_cache.configure(offline=True)
+
+def model_cache_options(func):
+    """Опции локального кэша моделей; значения передаются через окружение, в том числе воркерам"""
+    options = [
+        click.option('--model-dir', envvar=model_cache.HOME_ENV, type=click.Path(file_okay=False),
+                     callback=_configure_model_dir, expose_value=False, is_eager=True,
+                     help=f'Директория кэша моделей (по умолчанию {model_cache.DEFAULT_HOME}, '
+                          f'для моделей rembg - ~/.rembg; переменная {model_cache.HOME_ENV})'),
+        click.option('--offline', is_flag=True, envvar=model_cache.OFFLINE_ENV,
+                     callback=_configure_offline, expose_value=False, is_eager=True,
+                     help=f'Не скачивать модели: отсутствующая в кэше модель - ошибка '
+                          f'(переменная {model_cache.OFFLINE_ENV}=1)'),
+    ]
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+def make_session_config(threads=None, inter_op_threads: int = 0, graph_optimization: str = 'all',
+                        no_memory_arena: bool = False, providers=()) -> Optional[SessionConfig]:
+    """
+    Параметры сессии из опций командной строки
+    
+    Returns:
+        Optional[SessionConfig]: Параметры или None, если все опции по умолчанию
+    """
+    config = SessionConfig(
+        intra_op_threads=threads if isinstance(threads, int) else 0,
+        inter_op_threads=inter_op_threads,
+        graph_optimization=graph_optimization,
+        memory_arena=not no_memory_arena,
+        providers=tuple(providers),
+        auto_threads=threads == 'auto'
+    )
+    return None if config == SessionConfig() else config
+
+class DefaultCommandGroup(click.Group):
+    """Группа команд, в которой вызов без подкоманды передается команде по умолчанию"""
+    
+    def __init__(self, *args, default_command: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.default_command = default_command
+    
+    def parse_args(self, ctx, args):
+        # bg-remove INPUT_PATH OUTPUT_PATH работает как bg-remove remove INPUT_PATH OUTPUT_PATH
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args.insert(0, self.default_command)
+        return super().parse_args(ctx, args)
+
+@click.group(cls=DefaultCommandGroup, default_command='remove')
+def main():
+    """
+    CLI инструмент для удаления фона с изображений
+    
+    Без подкоманды выполняется remove: bg-remove INPUT_PATH OUTPUT_PATH
+    """
+
+@main.command('remove')
 @click.argument('input_path', type=click.Path(exists=True))
 @click.argument('output_path', type=click.Path())
 @click.option('--recursive', '-r', is_flag=True, help='Рекурсивный обход поддиректорий')
-@click.option('--model', '-m', default='u2net', 
-              type=click.Choice(['u2net', 'u2netp', 'u2net_human_seg', 'u2net_cloth_seg', 'silueta', 'isnet-general-use', 'isnet-anime']),
-              help='Модель для удаления фона')
-@click.option('--alpha-matting', is_flag=True, help='Использовать alpha matting для лучшего качества')
-@click.option('--foreground-threshold', default=240, type=int, help='Порог для переднего плана (0-255)')
-@click.option('--background-threshold', default=10, type=int, help='Порог для фона (0-255)')
-@click.option('--erode-size', default=10, type=int, help='Размер эрозии для alpha matting')
-@click.option('--format', '-f', default='png', 
-              type=click.Choice(['png', 'webp']), help='Формат выходного файла')
+@click.option('--model', '-m', default='u2net', type=MODEL_TYPE,
+              help='Модель для удаления фона; вариант пониженной точности после bg-remove quantize: u2net:int8, '
+                   'u2net:int8-static, u2net:fp16')
+@matting_options
+@click.option('--large-image-mp', default=LARGE_IMAGE_PIXELS / 1_000_000, type=click.FloatRange(min=0),
+              show_default=True,
+              help='Размер в мегапикселях, начиная с которого изображение обрабатывается полосами (0 - отключить)')
+@click.option('--max-memory', default=None, type=click.IntRange(min=1),
+              help='Ограничение памяти на обработку большого изображения в МБ')
+@click.option('--output-variant', '-O', 'output_variants', multiple=True,
+              help='Дополнительный файл из того же результата: вид (cutout, mask), формат (png, webp, jpg) '
+                   'и размер через двоеточие, например -O mask -O webp -O cutout:png:256x256')
+@encoding_options
+@click.option('--workers', '-w', default=1, type=click.IntRange(min=1),
+              help='Количество процессов для обработки директории')
+@click.option('--pipeline', is_flag=True,
+              help='Конвейерная обработка директории: чтение и запись параллельно с инференсом')
+@click.option('--io-threads', default=4, type=click.IntRange(min=1),
+              help='Количество потоков ввода-вывода для --pipeline')
+@click.option('--batch-size', '-b', default=1, type=click.IntRange(min=1),
+              help='Количество изображений в одном вызове модели')
+@click.option('--cache-dir', type=click.Path(file_okay=False),
+              help='Директория кэша результатов: неизменившиеся изображения не обрабатываются повторно')
+@click.option('--cache-size', default=None, type=click.IntRange(min=1),
+              help='Максимальный размер кэша в МБ (по умолчанию без ограничения)')
+@click.option('--cache-index', is_flag=True,
+              help='Вести индекс кэша в sqlite (быстрое вытеснение для больших кэшей)')
+@click.option('--incremental', '-i', is_flag=True,
+              help='Обрабатывать только новые и изменившиеся файлы (манифест в выходной директории)')
+@click.option('--include', multiple=True,
+              help='Шаблон файлов для обработки, например "products/*.jpg" (можно указать несколько)')
+@click.option('--exclude', multiple=True,
+              help='Шаблон файлов и директорий, которые нужно пропустить (можно указать несколько)')
+@click.option('--count-files', is_flag=True,
+              help='Сразу подсчитать файлы для прогресс-бара отдельным обходом директории в фоне '
+                   '(на сетевых ФС удваивает чтение директорий)')
+@click.option('--no-preflight', is_flag=True,
+              help='Не проверять заголовки файлов директории перед обработкой')
+@click.option('--max-megapixels', default=DEFAULT_MAX_PIXELS / 1_000_000, show_default=True,
+              type=click.FloatRange(min=0, max=DEFAULT_MAX_PIXELS / 1_000_000, min_open=True),
+              help='Файлы больше этого размера отклоняются при проверке (защита от decompression bomb)')
+@click.option('--sort-by-size', is_flag=True,
+              help='Обрабатывать файлы от больших к меньшим (равномернее загрузка воркеров и батчи '
+                   'из близких по размеру изображений; все файлы проверяются до начала обработки)')
+@click.option('--file-timeout', default=None, type=click.FloatRange(min=0, min_open=True),
+              help='Ограничение времени обработки одного файла в секундах; файл, превысивший его, считается ошибкой')
+@click.option('--sequence', is_flag=True,
+              help='Обрабатывать нумерованные кадры (frame_0001.png, ...) как последовательность: для почти '
+                   'не изменившегося кадра маска берется с ключевого кадра без инференса')
+@click.option('--frame-threshold', default=DEFAULT_DIFF_THRESHOLD, show_default=True, type=click.FloatRange(min=0),
+              help='Порог различия кадров для --sequence и видео: средняя разница яркости (0-255) в самом '
+                   'изменившемся участке кадра (0 - переиспользовать маску только для одинаковых кадров)')
+@click.option('--keyframe-interval', default=DEFAULT_KEYFRAME_INTERVAL, show_default=True,
+              type=click.IntRange(min=1),
+              help='Максимум кадров подряд с маской ключевого кадра (1 - инференс на каждом кадре)')
+@session_options
+@click.option('--metrics-file', type=click.Path(dir_okay=False),
+              help='Файл JSON Lines для длительностей стадий и счетчиков')
+@click.option('--profile', type=click.Path(dir_okay=False),
+              help='Сохранить профиль cProfile в файл (просмотр: python -m pstats FILE)')
+@model_cache_options
 @click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
-def main(input_path, output_path, recursive, model, alpha_matting, 
-         foreground_threshold, background_threshold, erode_size, format, verbose):
+def remove_command(input_path, output_path, recursive, model, alpha_matting, 
+         foreground_threshold, background_threshold, erode_size, fast_matting, matting_scale,
+         large_image_mp, max_memory, output_variants, format, compression, quality, palette, workers,
+         pipeline, io_threads, batch_size, cache_dir, cache_size, cache_index,
+         incremental, include, exclude, count_files, no_preflight, max_megapixels, sort_by_size, file_timeout,
+         sequence, frame_threshold, keyframe_interval, threads, inter_op_threads, graph_optimization,
+         no_memory_arena, providers, metrics_file, profile, verbose):
     """
-    CLI инструмент для удаления фона с изображений
+    Удаление фона с файла или директории
     
-    INPUT_PATH: Путь к файлу или директории с изображениями
+    INPUT_PATH: Путь к файлу или директории с изображениями, или видеофайл
+    (кадры с прозрачностью сохраняются в директорию OUTPUT_PATH)
     OUTPUT_PATH: Путь для сохранения результата
     """
     if verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
+    if pipeline and workers > 1:
+        raise click.UsageError("--pipeline нельзя использовать вместе с --workers")
+    if sort_by_size and no_preflight:
+        raise click.UsageError("--sort-by-size нельзя использовать вместе с --no-preflight")
+    if sequence and (pipeline or workers > 1):
+        raise click.UsageError("--sequence нельзя использовать вместе с --pipeline и --workers")
+    
+    try:
+        outputs = [parse_variant(value) for value in output_variants]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--output-variant')
+    
     # Инициализация инструмента
-    remover = BackgroundRemover(model_name=model)
+    cache = None
+    if cache_dir:
+        cache = ResultCache(
+            cache_dir,
+            max_bytes=cache_size * 1024 * 1024 if cache_size else None,
+            use_sqlite=cache_index
+        )
+    remover = BackgroundRemover(
+        model_name=model,
+        cache=cache,
+        large_image_pixels=int(large_image_mp * 1_000_000) if large_image_mp else None,
+        max_memory_mb=max_memory,
+        outputs=outputs,
+        session_config=make_session_config(threads, inter_op_threads, graph_optimization,
+                                           no_memory_arena, providers),
+        file_timeout=file_timeout,
+        output_format=format,
+        encode_options=EncodeOptions(compression, quality, palette)
+    )
+    
+    if metrics_file:
+        metrics.add_sink(JsonLinesSink(metrics_file))
     
     input_path = Path(input_path)
     output_path = Path(output_path)
+    sequence_options = SequenceOptions(frame_threshold, keyframe_interval)
     
     try:
-        if input_path.is_file():
-            # Обработка одного файла
-            if not input_path.suffix.lower() in SUPPORTED_FORMATS:
-                click.echo(f"Неподдерживаемый формат: {input_path.suffix}")
-                sys.exit(1)
+        with profiling(profile):
+            if input_path.is_file() and input_path.suffix.lower() in VIDEO_FORMATS:
+                # Кадры видео сохраняются в директорию
+                stats = remover.process_video(
+                    str(input_path),
+                    str(output_path),
+                    SequenceProcessor(sequence_options),
+                    batch_size=batch_size,
+                    alpha_matting=alpha_matting,
+                    alpha_matting_foreground_threshold=foreground_threshold,
+                    alpha_matting_background_threshold=background_threshold,
+                    alpha_matting_erode_size=erode_size,
+                    alpha_matting_fast=fast_matting,
+                    alpha_matting_scale=matting_scale
+                )
+                
+                click.echo(f"\n📊 Статистика обработки:")
+                click.echo(f"   Всего кадров: {stats['total']}")
+                click.echo(f"   Обработано: {stats['processed']}")
+                _echo_sequence_stats(stats['sequence'])
+                click.echo(f"   Ошибок: {stats['failed']}")
+                
+                if stats['failed'] > 0:
+                    sys.exit(1)
             
-            # Определение выходного файла
-            if output_path.is_dir():
-                output_file = output_path / f"{input_path.stem}_nobg.{format}"
-            else:
-                output_file = output_path.with_suffix(f'.{format}')
+            elif input_path.is_file():
+                # Обработка одного файла
+                if not input_path.suffix.lower() in SUPPORTED_FORMATS:
+                    click.echo(f"Неподдерживаемый формат: {input_path.suffix}")
+                    sys.exit(1)
             
-            # Создание директории если нужно
-            output_file.parent.mkdir(parents=True, exist_ok=True)
+                # Определение выходного файла
+                if output_path.is_dir():
+                    output_file = output_path / f"{input_path.stem}_nobg.{format}"
+                else:
+                    output_file = output_path.with_suffix(f'.{format}')
             
-            success = remover.remove_background(
-                str(input_path),
-                str(output_file),
-                alpha_matting=alpha_matting,
-                alpha_matting_foreground_threshold=foreground_threshold,
-                alpha_matting_background_threshold=background_threshold,
-                alpha_matting_erode_size=erode_size
-            )
+                # Создание директории если нужно
+                output_file.parent.mkdir(parents=True, exist_ok=True)
             
-            if success:
-                click.echo(f"✅ Фон успешно удален: {output_file}")
-            else:
-                click.echo(f"❌ Ошибка при обработке: {input_path}")
-                sys.exit(1)
+                success = remover.remove_background(
+                    str(input_path),
+                    str(output_file),
+                    alpha_matting=alpha_matting,
+                    alpha_matting_foreground_threshold=foreground_threshold,
+                    alpha_matting_background_threshold=background_threshold,
+                    alpha_matting_erode_size=erode_size,
+                    alpha_matting_fast=fast_matting,
+                    alpha_matting_scale=matting_scale
+                )
+            
+                if success:
+                    click.echo(f"✅ Фон успешно удален: {output_file}")
+                else:
+                    click.echo(f"❌ Ошибка при обработке: {input_path}")
+                    sys.exit(1)
                 
-        elif input_path.is_dir():
-            # Обработка директории
-            if not output_path.exists():
-                output_path.mkdir(parents=True, exist_ok=True)
-            
-            stats = remover.process_directory(
-                str(input_path),
-                str(output_path),
-                recursive=recursive,
-                alpha_matting=alpha_matting,
-                alpha_matting_foreground_threshold=foreground_threshold,
-                alpha_matting_background_threshold=background_threshold,
-                alpha_matting_erode_size=erode_size
-            )
+            elif input_path.is_dir():
+                # Обработка директории
+                if not output_path.exists():
+                    output_path.mkdir(parents=True, exist_ok=True)
+            
+                stats = remover.process_directory(
+                    str(input_path),
+                    str(output_path),
+                    recursive=recursive,
+                    workers=workers,
+                    pipeline=pipeline,
+                    io_threads=io_threads,
+                    batch_size=batch_size,
+                    incremental=incremental,
+                    include=list(include),
+                    exclude=list(exclude),
+                    count_files=count_files,
+                    preflight=None if no_preflight else Preflight(
+                        threads=io_threads,
+                        max_pixels=int(max_megapixels * 1_000_000),
+                        sort_by_size=sort_by_size
+                    ),
+                    sequence=sequence_options if sequence else None,
+                    alpha_matting=alpha_matting,
+                    alpha_matting_foreground_threshold=foreground_threshold,
+                    alpha_matting_background_threshold=background_threshold,
+                    alpha_matting_erode_size=erode_size,
+                    alpha_matting_fast=fast_matting,
+                    alpha_matting_scale=matting_scale
+                )
             
-            click.echo(f"\n📊 Статистика обработки:")
-            click.echo(f"   Всего файлов: {stats['total']}")
-            click.echo(f"   Обработано: {stats['processed']}")
-            click.echo(f"   Ошибок: {stats['failed']}")
+                click.echo(f"\n📊 Статистика обработки:")
+                click.echo(f"   Всего файлов: {stats['total']}")
+                click.echo(f"   Обработано: {stats['processed']}")
+                if incremental:
+                    click.echo(f"   Пропущено (без изменений): {stats['skipped']}")
+                if stats['rejected']:
+                    reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(stats['reject_reasons'].items()))
+                    click.echo(f"   Отклонено при проверке: {stats['rejected']} ({reasons})")
+                if stats['sequence'] and stats['sequence']['frames']:
+                    _echo_sequence_stats(stats['sequence'])
+                click.echo(f"   Ошибок: {stats['failed']}")
+                for encoded_format, entry in stats['encoding'].items():
+                    click.echo(f"   Кодирование {encoded_format.upper()}: {entry['files']} файлов, "
+                               f"{entry['mean_ms']} мс и {entry['mean_kb']} КБ в среднем, "
+                               f"всего {entry['bytes'] / 2**20:.1f} МБ")
             
-            if stats['failed'] > 0:
+                if stats['failed'] > 0 or stats['rejected'] > 0:
+                    sys.exit(1)
+            else:
+                click.echo(f"❌ Путь не существует: {input_path}")
                 sys.exit(1)
-        else:
-            click.echo(f"❌ Путь не существует: {input_path}")
-            sys.exit(1)
             
     except Exception as e:
         click.echo(f"❌ Ошибка: {e}")
         sys.exit(1)
+    finally:
+        metrics.close_sinks()
+
+def _echo_sequence_stats(report: dict):
+    """Статистика переиспользования масок в последовательностях кадров"""
+    click.echo(f"   Кадров в последовательностях: {report['frames']} (инференс на {report['keyframes']} "
+               f"ключевых, маска переиспользована для {report['reused']})")
+
+def _echo_queue_summary(queue, failures: int = 0):
+    """Сводка очереди в формате статистики remove"""
+    summary = summarize(queue.counts())
+    click.echo(f"\n📊 Очередь:")
+    click.echo(f"   Всего заданий: {summary['total']}")
+    click.echo(f"   Обработано: {summary['processed']}")
+    click.echo(f"   В очереди: {summary['pending']}, в работе: {summary['leased']}")
+    click.echo(f"   Ошибок: {summary['failed']}")
+    for input_file, error in queue.failures(failures) if failures else ():
+        click.echo(f"   ❌ {input_file}: {error}")
+    return summary
+
+@main.command('submit')
+@click.argument('queue_location', metavar='QUEUE')
+@click.argument('input_path', type=click.Path(exists=True, file_okay=False))
+@click.argument('output_path', type=click.Path(file_okay=False))
+@click.option('--recursive', '-r', is_flag=True, help='Рекурсивный обход поддиректорий')
+@click.option('--model', '-m', default='u2net', type=MODEL_TYPE, help='Модель для удаления фона')
+@matting_options
+@encoding_options
+@click.option('--include', multiple=True,
+              help='Шаблон файлов для обработки, например "products/*.jpg" (можно указать несколько)')
+@click.option('--exclude', multiple=True,
+              help='Шаблон файлов и директорий, которые нужно пропустить (можно указать несколько)')
+@click.option('--max-attempts', default=DEFAULT_MAX_ATTEMPTS, show_default=True, type=click.IntRange(min=1),
+              help='Количество попыток обработки файла до признания его ошибкой')
+@click.option('--resubmit', is_flag=True,
+              help='Вернуть в очередь уже выполненные и неудачные файлы (например, с новыми параметрами)')
+@click.option('--no-preflight', is_flag=True, help='Не проверять заголовки файлов перед отправкой')
+@click.option('--max-megapixels', default=DEFAULT_MAX_PIXELS / 1_000_000, show_default=True,
+              type=click.FloatRange(min=0, max=DEFAULT_MAX_PIXELS / 1_000_000, min_open=True),
+              help='Файлы больше этого размера отклоняются при проверке')
+@click.option('--wait', is_flag=True, help='Дождаться выполнения всех заданий очереди и вывести статистику')
+@click.option('--poll-interval', default=2.0, type=click.FloatRange(min=0.1), show_default=True,
+              help='Интервал опроса очереди для --wait в секундах')
+@click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
+def submit_command(queue_location, input_path, output_path, recursive, model, alpha_matting,
+                   foreground_threshold, background_threshold, erode_size, fast_matting, matting_scale,
+                   format, compression, quality, palette, include, exclude, max_attempts, resubmit,
+                   no_preflight, max_megapixels, wait, poll_interval, verbose):
+    """
+    Отправка изображений директории в очередь заданий
+    
+    QUEUE: База sqlite (queue.db, sqlite:///путь) или директория-спул
+    (spool:///путь, любой другой путь) на общей для воркеров файловой системе.
+    Файлы обрабатывают воркеры: bg-remove worker QUEUE. Повторная отправка
+    той же директории не создает дубликатов.
+    """
+    if verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    
+    import time
+    
+    remover = BackgroundRemover(
+        model_name=model,
+        output_format=format,
+        encode_options=EncodeOptions(compression, quality, palette)
+    )
+    queue = open_queue(queue_location)
+    try:
+        stats = remover.submit_directory(
+            queue,
+            input_path,
+            output_path,
+            recursive=recursive,
+            include=list(include),
+            exclude=list(exclude),
+            preflight=None if no_preflight else Preflight(max_pixels=int(max_megapixels * 1_000_000)),
+            max_attempts=max_attempts,
+            resubmit=resubmit,
+            alpha_matting=alpha_matting,
+            alpha_matting_foreground_threshold=foreground_threshold,
+            alpha_matting_background_threshold=background_threshold,
+            alpha_matting_erode_size=erode_size,
+            alpha_matting_fast=fast_matting,
+            alpha_matting_scale=matting_scale
+        )
+        
+        click.echo(f"📤 Найдено файлов: {stats['total']}, отправлено в очередь: {stats['submitted']}")
+        if stats['rejected']:
+            reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(stats['reject_reasons'].items()))
+            click.echo(f"   Отклонено при проверке: {stats['rejected']} ({reasons})")
+        
+        if wait:
+            while True:
+                pending = summarize(queue.counts())
+                if not pending['pending'] and not pending['leased']:
+                    break
+                time.sleep(poll_interval)
+            summary = _echo_queue_summary(queue, failures=20)
+            if summary['failed'] > 0 or stats['rejected'] > 0:
+                sys.exit(1)
+        elif stats['rejected']:
+            sys.exit(1)
+    except Exception as e:
+        click.echo(f"❌ Ошибка: {e}")
+        sys.exit(1)
+    finally:
+        queue.close()
+
+@main.command('worker')
+@click.argument('queue_location', metavar='QUEUE')
+@click.option('--batch-size', '-b', default=1, type=click.IntRange(min=1),
+              help='Количество заданий в одной аренде и одном вызове модели')
+@click.option('--lease', 'lease_seconds', default=DEFAULT_LEASE_SECONDS, show_default=True,
+              type=click.FloatRange(min=1),
+              help='Время аренды задания в секундах: задания упавшего воркера выдаются снова после него')
+@click.option('--poll-interval', default=2.0, type=click.FloatRange(min=0.1), show_default=True,
+              help='Пауза перед повторным опросом пустой очереди в секундах')
+@click.option('--exit-when-empty', is_flag=True,
+              help='Завершиться, когда в очереди не осталось заданий (по умолчанию ждать новые)')
+@click.option('--max-jobs', default=None, type=click.IntRange(min=1),
+              help='Завершиться после стольких заданий')
+@click.option('--worker-id', default=None, help='Имя воркера в очереди (по умолчанию узел:процесс)')
+@click.option('--large-image-mp', default=LARGE_IMAGE_PIXELS / 1_000_000, type=click.FloatRange(min=0),
+              show_default=True,
+              help='Размер в мегапикселях, начиная с которого изображение обрабатывается полосами (0 - отключить)')
+@click.option('--max-memory', default=None, type=click.IntRange(min=1),
+              help='Ограничение памяти на обработку большого изображения в МБ')
+@click.option('--file-timeout', default=None, type=click.FloatRange(min=0, min_open=True),
+              help='Ограничение времени обработки одного файла в секундах; файл, превысивший его, считается ошибкой')
+@session_options
+@click.option('--metrics-file', type=click.Path(dir_okay=False),
+              help='Файл JSON Lines для длительностей стадий и счетчиков')
+@model_cache_options
+@click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
+def worker_command(queue_location, batch_size, lease_seconds, poll_interval, exit_when_empty, max_jobs,
+                   worker_id, large_image_mp, max_memory, file_timeout, threads, inter_op_threads,
+                   graph_optimization, no_memory_arena, providers, metrics_file, verbose):
+    """
+    Воркер очереди заданий
+    
+    Берет в аренду файлы, отправленные bg-remove submit, и обрабатывает их
+    с моделью и параметрами из задания. Воркеров можно запускать сколько
+    угодно на разных машинах с доступом к очереди и файлам. SIGTERM
+    завершает воркер после текущей пачки.
+    """
+    if verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    
+    import signal
+    
+    session_config = make_session_config(threads, inter_op_threads, graph_optimization,
+                                         no_memory_arena, providers)
+    
+    def make_remover(model_name, output_format, encoding):
+        return BackgroundRemover(
+            model_name=model_name,
+            large_image_pixels=int(large_image_mp * 1_000_000) if large_image_mp else None,
+            max_memory_mb=max_memory,
+            session_config=session_config,
+            file_timeout=file_timeout,
+            output_format=output_format,
+            encode_options=EncodeOptions(*encoding)
+        )
+    
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    
+    if metrics_file:
+        metrics.add_sink(JsonLinesSink(metrics_file))
+    
+    queue = open_queue(queue_location)
+    try:
+        stats = run_worker(queue, make_remover, worker=worker_id, batch_size=batch_size,
+                           lease_seconds=lease_seconds, poll_interval=poll_interval,
+                           exit_when_empty=exit_when_empty, max_jobs=max_jobs, stop=stop)
+        click.echo(f"\n📊 Статистика воркера:")
+        click.echo(f"   Всего заданий: {stats['total']}")
+        click.echo(f"   Обработано: {stats['processed']}")
+        click.echo(f"   Неудачных попыток: {stats['failed']}")
+        _echo_queue_summary(queue)
+    except Exception as e:
+        click.echo(f"❌ Ошибка: {e}")
+        sys.exit(1)
+    finally:
+        queue.close()
+        metrics.close_sinks()
+
+@main.command('status')
+@click.argument('queue_location', metavar='QUEUE')
+@click.option('--failures', default=20, show_default=True, type=click.IntRange(min=0),
+              help='Сколько неудачных файлов показать')
+@click.option('--json', 'as_json', is_flag=True,
+              help='Вывести сводку в JSON: processed, failed, pending, leased, total')
+def status_command(queue_location, failures, as_json):
+    """Состояние очереди заданий: сколько файлов обработано, ждет, в работе и с ошибкой"""
+    queue = open_queue(queue_location)
+    try:
+        if as_json:
+            import json
+            
+            click.echo(json.dumps(summarize(queue.counts()), ensure_ascii=False, indent=2))
+        else:
+            _echo_queue_summary(queue, failures=failures)
+    finally:
+        queue.close()
+
+@main.command('serve')
+@click.option('--host', default='127.0.0.1', help='Адрес для входящих соединений')
+@click.option('--port', '-p', default=8765, type=int, help='Порт сервера')
+@click.option('--model', '-m', 'models', multiple=True, default=['u2net'],
+              type=MODEL_TYPE,
+              help='Модель, загружаемая при старте (можно указать несколько, первая - по умолчанию)')
+@click.option('--max-concurrency', default=8, type=click.IntRange(min=1),
+              help='Максимум запросов, обрабатываемых одновременно')
+@click.option('--batch-size', '-b', default=8, type=click.IntRange(min=1),
+              help='Максимальный размер батча из одновременных запросов')
+@click.option('--batch-wait-ms', default=10, type=click.FloatRange(min=0),
+              help='Сколько ждать одновременных запросов для батча (мс)')
+@click.option('--max-body-mb', default=50, type=click.IntRange(min=1),
+              help='Максимальный размер загружаемого файла в МБ')
+@click.option('--request-timeout', type=click.FloatRange(min=0, min_open=True),
+              help='Ограничение времени обработки запроса в секундах (по истечении - ответ 504)')
+@session_options
+@model_cache_options
+@click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
+def serve_command(host, port, models, max_concurrency, batch_size, batch_wait_ms,
+                  max_body_mb, request_timeout, threads, inter_op_threads, graph_optimization, no_memory_arena,
+                  providers, verbose):
+    """
+    HTTP-сервер удаления фона с прогретыми моделями
+    
+    POST /remove?model=u2net&format=png|webp - изображение в теле запроса
+    или в поле file формы multipart/form-data. GET /health - состояние сервера.
+    """
+    if verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
+    
+    from inference_server import run_server
+    run_server(
+        host,
+        port,
+        models,
+        MODEL_CHOICES,
+        max_concurrency=max_concurrency,
+        batch_size=batch_size,
+        batch_wait_ms=batch_wait_ms,
+        max_body_bytes=max_body_mb * 1024 * 1024,
+        request_timeout=request_timeout,
+        session_config=make_session_config(threads, inter_op_threads, graph_optimization,
+                                           no_memory_arena, providers)
+    )
+
+@main.command('bench')
+@click.option('--model', '-m', 'models', multiple=True, type=MODEL_TYPE,
+              help='Модель для замера (можно указать несколько, по умолчанию все)')
+@click.option('--resolution', 'resolutions', multiple=True, default=['640x480', '1920x1080'],
+              show_default=True, help='Разрешение синтетических изображений (можно указать несколько)')
+@click.option('--images', '-n', default=16, type=click.IntRange(min=1), show_default=True,
+              help='Количество изображений на каждое разрешение')
+@click.option('--mode', 'modes', multiple=True, type=click.Choice(['serial', 'batched', 'parallel']),
+              help='Режим обработки (можно указать несколько, по умолчанию все)')
+@click.option('--batch-size', '-b', default=4, type=click.IntRange(min=1), show_default=True,
+              help='Размер батча для режимов batched и parallel')
+@click.option('--workers', '-w', default=None, type=click.IntRange(min=1),
+              help='Количество процессов для режима parallel (по умолчанию по числу ядер)')
+@click.option('--alpha-matting', is_flag=True, help='Включить alpha matting')
+@click.option('--threads', 'thread_settings', multiple=True,
+              help='Потоков внутри оператора на сессию: число или auto (можно указать несколько, '
+                   'каждое значение замеряется отдельно)')
+@click.option('--graph-optimization', 'graph_optimizations', multiple=True,
+              type=click.Choice(list(GRAPH_OPTIMIZATION_LEVELS)),
+              help='Уровень оптимизации графа (можно указать несколько, каждый замеряется отдельно)')
+@click.option('--no-memory-arena', is_flag=True, help='Отключить арену памяти onnxruntime')
+@click.option('--provider', 'providers', multiple=True, type=click.Choice(list(PROVIDER_NAMES)),
+              help='Execution provider в порядке предпочтения (можно указать несколько)')
+@click.option('--no-cold-start', is_flag=True,
+              help='Не замерять холодный старт (импорт, загрузка модели, первый инференс в новом процессе)')
+@click.option('--encode-report', is_flag=True,
+              help='Вместо замера моделей сравнить настройки кодирования результата (время и размер файла)')
+@click.option('--matting-report', is_flag=True,
+              help='Вместо замера моделей сравнить быстрый alpha matting с обычным (скорость и точность)')
+@click.option('--output', '-o', type=click.Path(), help='Файл для результатов в JSON (по умолчанию stdout)')
+@model_cache_options
+@click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
+def bench_command(models, resolutions, images, modes, batch_size, workers, alpha_matting,
+                  thread_settings, graph_optimizations, no_memory_arena, providers,
+                  no_cold_start, encode_report, matting_report, output, verbose):
+    """
+    Бенчмарк на синтетических изображениях
+    
+    Выводит задержки по стадиям (перцентили), пропускную способность
+    и пиковое потребление памяти в формате JSON. Для каждого сочетания
+    --threads и --graph-optimization замер выполняется отдельно.
+    """
+    import json
+    from benchmark import (BENCH_MODES, parse_resolution, run_benchmark, run_encode_report,
+                           run_matting_report, system_info)
+    
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.WARNING)
+    
+    try:
+        parsed_resolutions = [parse_resolution(value) for value in resolutions]
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--resolution')
+    
+    thread_settings = [_validate_threads(None, None, value) for value in thread_settings] or [None]
+    session_configs = [
+        make_session_config(threads, 0, graph_optimization, no_memory_arena, providers)
+        for threads in thread_settings
+        for graph_optimization in (graph_optimizations or ['all'])
+    ]
+    
+    if encode_report:
+        report = {"system": system_info(), "encoding": run_encode_report(parsed_resolutions)}
+    elif matting_report:
+        report = {"system": system_info(), "matting": run_matting_report(parsed_resolutions)}
+    else:
+        report = run_benchmark(
+            list(models) or MODEL_CHOICES,
+            resolutions=parsed_resolutions,
+            images=images,
+            modes=list(modes) or BENCH_MODES,
+            batch_size=batch_size,
+            workers=workers,
+            alpha_matting=alpha_matting,
+            session_configs=session_configs,
+            cold_start=not no_cold_start
+        )
+    
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        Path(output).write_text(text + "\n", encoding='utf-8')
+        click.echo(f"Результаты сохранены: {output}")
+    else:
+        click.echo(text)
+
+def _load_images(directory: Optional[str], limit: int) -> List[Image.Image]:
+    """Изображения из директории (рекурсивно) или синтетические, если директория не задана"""
+    if directory is None:
+        from benchmark import make_synthetic_image
+        return [to_pil(make_synthetic_image(640, 480, seed)) for seed in range(limit)]
+    
+    images = []
+    for path in itertools.islice(ImageScanner(directory, SUPPORTED_FORMATS, recursive=True), limit):
+        try:
+            image = to_pil(path.read_bytes())
+            image.load()
+            images.append(image)
+        except Exception as e:
+            logger.warning(f"Пропущен файл {path}: {e}")
+    if not images:
+        raise click.UsageError(f"В {directory} нет изображений")
+    return images
+
+@main.command('quantize')
+@click.option('--model', '-m', 'models', multiple=True, required=True, type=click.Choice(MODEL_CHOICES),
+              help='Исходная модель (можно указать несколько)')
+@click.option('--precision', '-p', 'precisions', multiple=True, type=click.Choice(PRECISIONS),
+              help='Точность варианта: int8 (динамическое квантование), int8-static (с калибровкой), '
+                   'fp16 (можно указать несколько, по умолчанию int8 и fp16)')
+@click.option('--calibration-dir', type=click.Path(exists=True, file_okay=False),
+              help='Изображения для калибровки int8-static (по умолчанию синтетические)')
+@click.option('--eval-dir', type=click.Path(exists=True, file_okay=False),
+              help='Изображения для проверки точности (по умолчанию --calibration-dir или синтетические)')
+@click.option('--max-images', default=32, type=click.IntRange(min=1), show_default=True,
+              help='Максимум изображений для калибровки и проверки')
+@click.option('--no-check', is_flag=True, help='Не сравнивать маски варианта с FP32-моделью')
+@click.option('--force', is_flag=True, help='Пересоздать уже существующие варианты')
+@click.option('--output', '-o', type=click.Path(), help='Файл для отчета в JSON (по умолчанию stdout)')
+@model_cache_options
+@click.option('--verbose', '-v', is_flag=True, help='Подробный вывод')
+def quantize_command(models, precisions, calibration_dir, eval_dir, max_images, no_check, force,
+                     output, verbose):
+    """
+    Создание вариантов моделей пониженной точности в локальном кэше
+    
+    Варианты выбираются при обработке по имени вида u2net:int8. Для каждого
+    варианта маски сравниваются с FP32-моделью (IoU и MAE) и замеряется
+    ускорение инференса; отчет выводится в формате JSON.
+    """
+    import json
+    from quantization import compare_accuracy, quantize_model
+    
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.INFO)
+    precisions = list(precisions) or ['int8', 'fp16']
+    
+    calibration = _load_images(calibration_dir, max_images) if 'int8-static' in precisions else []
+    evaluation = None
+    if not no_check:
+        evaluation = _load_images(eval_dir or calibration_dir, max_images)
+    
+    report = []
+    failed = False
+    for model_name in models:
+        for precision in precisions:
+            entry = {"model": f"{model_name}:{precision}"}
+            try:
+                entry["path"] = str(quantize_model(model_name, precision, calibration, force=force))
+                if evaluation is not None:
+                    entry.update(compare_accuracy(entry["model"], evaluation))
+            except Exception as e:
+                logger.error(f"Не удалось создать {entry['model']}: {e}")
+                entry["error"] = str(e)
+                failed = True
+            report.append(entry)
+    
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if output:
+        Path(output).write_text(text + "\n", encoding='utf-8')
+        click.echo(f"Отчет сохранен: {output}")
+    else:
+        click.echo(text)
+    if failed:
+        sys.exit(1)
+
+@main.group('models')
+def models_group():
+    """Локальный кэш моделей: заранее скачать и проверить модели для работы без сети"""
+
+@models_group.command('prefetch')
+@click.option('--model', '-m', 'models', multiple=True, type=MODEL_TYPE,
+              help='Модель (можно указать несколько, по умолчанию u2net)')
+@click.option('--all', 'all_models', is_flag=True, help='Все модели')
+@model_cache_options
+def models_prefetch_command(models, all_models):
+    """
+    Скачивание моделей в кэш и запись контрольных сумм
+    
+    Варианты пониженной точности (u2net:int8) создаются командой quantize,
+    здесь для них записывается контрольная сумма.
+    """
+    names = MODEL_CHOICES if all_models else (list(models) or ['u2net'])
+    report = model_cache.prefetch(names)
+    for entry in report:
+        if 'error' in entry:
+            click.echo(f"❌ {entry['model']}: {entry['error']}")
+        else:
+            click.echo(f"✅ {entry['model']}: {entry['path']} ({entry['size_mb']} МБ)")
+    if any('error' in entry for entry in report):
+        sys.exit(1)
+
+@models_group.command('verify')
+@click.option('--model', '-m', 'models', multiple=True, type=MODEL_TYPE,
+              help='Модель (можно указать несколько, по умолчанию все записанные при prefetch)')
+@model_cache_options
+def models_verify_command(models):
+    """Проверка моделей в кэше: файл на месте, контрольная сумма совпадает, модель загружается"""
+    names = list(models) or model_cache.recorded_models()
+    if not names:
+        click.echo("Кэш пуст: выполните bg-remove models prefetch")
+        sys.exit(1)
+    report = model_cache.verify(names)
+    for entry in report:
+        if entry['ok']:
+            click.echo(f"✅ {entry['model']}: {entry['path']} (контрольная сумма: {entry['checksum']})")
+        else:
+            click.echo(f"❌ {entry['model']}: {entry.get('error')}")
+    if not all(entry['ok'] for entry in report):
+        sys.exit(1)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Пакетный инференс: несколько изображений за один вызов ONNX-сессии
+Изображения приводятся к входному размеру модели, собираются в батч NCHW,
+после инференса маски разделяются и масштабируются обратно к исходным размерам
+"""
+
+import io
+import logging
+from typing import BinaryIO, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from PIL import ExifTags, Image, ImageOps
+
+from metrics import timer
+from preflight import check_deadline
+
+logger = logging.getLogger(__name__)
+
+
+class ModelInputSpec(NamedTuple):
+    """Параметры предобработки входа модели"""
+    mean: Tuple[float, float, float]
+    std: Tuple[float, float, float]
+    size: Tuple[int, int]
+    clip: bool = False
+
+
+# Параметры совпадают с предобработкой сессий rembg для этих моделей.
+# u2net_cloth_seg возвращает несколько масок и обрабатывается поштучно
+MODEL_INPUT_SPECS = {
+    'u2net': ModelInputSpec((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320), clip=True),
+    'u2netp': ModelInputSpec((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2net_human_seg': ModelInputSpec((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ModelInputSpec((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'isnet-general-use': ModelInputSpec((0.5, 0.5, 0.5), (1.0, 1.0, 1.0), (1024, 1024)),
+    'isnet-anime': ModelInputSpec((0.485, 0.456, 0.406), (1.0, 1.0, 1.0), (1024, 1024)),
+}
+
+ImageData = Union[bytes, bytearray, memoryview, Image.Image, np.ndarray, BinaryIO]
+
+# Типы результата: PIL.Image, массив numpy HxWx4 или закодированный файл
+OUTPUT_TYPES = ('pil', 'numpy', 'bytes')
+
+
+def base_model(model_name: str) -> str:
+    """Исходная модель для варианта пониженной точности (u2net:int8 -> u2net)"""
+    return model_name.partition(':')[0]
+
+
+def supports_batching(model_name: str) -> bool:
+    """Поддерживает ли модель пакетный инференс"""
+    return base_model(model_name) in MODEL_INPUT_SPECS
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Файловый объект поверх буфера (bytearray, memoryview, mmap)
+
+    io.BytesIO копирует такие буферы целиком, а здесь декодер читает
+    данные из исходной памяти небольшими порциями
+    """
+
+    def __init__(self, buffer):
+        self._view = memoryview(buffer).cast('B')
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        size = min(len(target), len(self._view) - self._position)
+        target[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: len(self._view)}[whence]
+        self._position = max(base + offset, 0)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def open_source(data: ImageData):
+    """
+    Файловый объект для байтов, буфера или уже открытого файла без копирования данных
+
+    bytes передаются в io.BytesIO, который разделяет с ними память,
+    остальные буферы читаются через BufferReader
+    """
+    if isinstance(data, bytes):
+        return io.BytesIO(data)
+    if isinstance(data, (bytearray, memoryview)):
+        return BufferReader(data)
+    if hasattr(data, 'read'):
+        return data
+    raise ValueError(f"Неподдерживаемый тип данных: {type(data)}")
+
+
+def to_pil(data: ImageData) -> Image.Image:
+    """
+    Приведение входных данных к PIL.Image с учетом EXIF-ориентации
+
+    Копия создается только при повороте переданного извне PIL.Image:
+    декодированное здесь изображение поворачивается на месте, массив
+    numpy оборачивается без копирования, где PIL это позволяет
+    """
+    if isinstance(data, Image.Image):
+        orientation = data.getexif().get(ExifTags.Base.Orientation, 1)
+        # Изображение вызывающего кода не меняется
+        return ImageOps.exif_transpose(data) if orientation != 1 else data
+    if isinstance(data, np.ndarray):
+        return Image.fromarray(data)
+
+    image = Image.open(open_source(data))
+    # Без in_place exif_transpose копирует даже неповернутое изображение
+    ImageOps.exif_transpose(image, in_place=True)
+    return image
+
+
+def output_type_of(data: ImageData) -> str:
+    """Тип результата по умолчанию - тот же, что у входных данных, как в rembg.remove"""
+    if isinstance(data, Image.Image):
+        return 'pil'
+    if isinstance(data, np.ndarray):
+        return 'numpy'
+    return 'bytes'
+
+
+def convert_result(result: Image.Image, output_type: str = 'bytes', output_format: str = 'PNG',
+                   out: Optional[BinaryIO] = None, encode_options=None):
+    """
+    Приведение результата к запрошенному типу
+
+    Args:
+        result: Результат удаления фона (RGBA)
+        output_type: 'pil', 'numpy' или 'bytes'
+        output_format: Формат PIL для 'bytes' и out
+        out: Файловый объект, в который результат кодируется напрямую,
+            без промежуточных байтов (тогда он и возвращается)
+        encode_options: Параметры кодирования (outputs.EncodeOptions)
+
+    Returns:
+        PIL.Image, массив numpy, bytes или out
+    """
+    from outputs import encode_image
+
+    if out is not None:
+        encode_image(result, output_format, encode_options, fp=out)
+        return out
+    if output_type == 'pil':
+        return result
+    if output_type == 'numpy':
+        return np.asarray(result)
+    if output_type != 'bytes':
+        raise ValueError(f"Неизвестный тип результата: {output_type}")
+    return encode_image(result, output_format, encode_options)
+
+
+def preprocess(image: Image.Image, spec: ModelInputSpec) -> np.ndarray:
+    """Подготовка одного изображения: тензор CHW float32"""
+    resized = image.convert("RGB").resize(spec.size, Image.Resampling.LANCZOS)
+    array = np.asarray(resized)
+    array = array / max(np.max(array), 1e-6)
+    array = (array - np.asarray(spec.mean)) / np.asarray(spec.std)
+    return array.transpose((2, 0, 1)).astype(np.float32)
+
+
+def postprocess(pred: np.ndarray, size: Tuple[int, int], spec: ModelInputSpec) -> Image.Image:
+    """Нормализация предсказания одной маски и масштабирование к исходному размеру"""
+    ma = pred.max()
+    mi = pred.min()
+    pred = (pred - mi) / (ma - mi)
+    if spec.clip:
+        pred = pred.clip(0, 1)
+    mask = Image.fromarray((pred * 255).astype("uint8"), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+def _fixed_batch_size(session) -> Optional[int]:
+    """Фиксированный размер батча модели (None, если размер динамический)"""
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return batch_dim if isinstance(batch_dim, int) else None
+
+
+def predict_masks(session, images: Sequence[Image.Image], model_name: str) -> List[Image.Image]:
+    """
+    Предсказание масок для списка изображений
+
+    Args:
+        session: Сессия rembg
+        images: Изображения (уже с учетом EXIF-ориентации)
+        model_name: Название модели
+
+    Returns:
+        List[Image.Image]: Маски в режиме L, по одной на изображение
+    """
+    spec = MODEL_INPUT_SPECS[base_model(model_name)]
+    inner = session.inner_session
+    input_name = inner.get_inputs()[0].name
+
+    batch = np.stack([preprocess(image, spec) for image in images])
+
+    # Модели, экспортированные с фиксированным батчем, запускаются частями
+    step = _fixed_batch_size(session) or len(images)
+    preds = []
+    for start in range(0, len(images), step):
+        outputs = inner.run(None, {input_name: batch[start:start + step]})
+        preds.append(outputs[0][:, 0, :, :])
+    preds = np.concatenate(preds)
+
+    return [postprocess(pred, image.size, spec) for pred, image in zip(preds, images)]
+
+
+def cutout(image: Image.Image, mask: Image.Image, alpha_matting: bool = False,
+           alpha_matting_foreground_threshold: int = 240,
+           alpha_matting_background_threshold: int = 10,
+           alpha_matting_erode_size: int = 10,
+           alpha_matting_fast: bool = False,
+           alpha_matting_scale: float = 0.5) -> Image.Image:
+    """
+    Вырезание объекта по маске, как это делает rembg.remove
+
+    Логика после маски повторяет rembg.remove закрепленной в requirements.txt
+    версии: если alpha matting невозможен (в trimap нет переднего плана или
+    фона), объект вырезается с оценкой цвета по маске (decontaminate_cutout),
+    без alpha matting - простым наложением маски (naive_cutout).
+    """
+    from rembg.bg import alpha_matting_cutout, decontaminate_cutout, naive_cutout
+
+    if not alpha_matting:
+        return naive_cutout(image, mask)
+    try:
+        if alpha_matting_fast:
+            from fast_matting import fast_alpha_matting_cutout
+            return fast_alpha_matting_cutout(
+                image,
+                mask,
+                alpha_matting_foreground_threshold,
+                alpha_matting_background_threshold,
+                alpha_matting_erode_size,
+                scale=alpha_matting_scale
+            )
+        return alpha_matting_cutout(
+            image,
+            mask,
+            alpha_matting_foreground_threshold,
+            alpha_matting_background_threshold,
+            alpha_matting_erode_size
+        )
+    except ValueError:
+        return decontaminate_cutout(image, mask)
+
+
+def remove_batch(session, model_name: str, data: Sequence[ImageData],
+                 output_type: Optional[str] = None, output_format: str = 'PNG',
+                 encode_options=None, **kwargs) -> List:
+    """
+    Удаление фона с нескольких изображений за один вызов сессии
+
+    Args:
+        session: Сессия rembg
+        model_name: Название модели
+        data: Байты или буферы файлов, файловые объекты, PIL.Image или массивы numpy
+        output_type: Тип результатов ('pil', 'numpy', 'bytes'); по умолчанию
+            тот же, что у входных данных (для байтов и файлов - bytes)
+        output_format: Формат кодирования для bytes
+        encode_options: Параметры кодирования для bytes (outputs.EncodeOptions)
+        **kwargs: Параметры alpha matting (как у rembg.remove)
+
+    Returns:
+        List: Результаты запрошенного типа
+    """
+    if not data:
+        return []
+
+    images = [_decode(item) for item in data]
+    if not supports_batching(model_name):
+        from rembg import remove
+        # Быстрый alpha matting доступен только для моделей с описанием входа
+        kwargs = {name: value for name, value in kwargs.items()
+                  if name not in ('alpha_matting_fast', 'alpha_matting_scale')}
+        with timer('inference'):
+            cutouts = [remove(image, session=session, **kwargs) for image in images]
+    else:
+        with timer('inference'):
+            masks = predict_masks(session, images, model_name)
+        # Вне главного потока срок файла проверяется между стадиями
+        check_deadline()
+        with timer('alpha_matting' if kwargs.get('alpha_matting') else 'cutout'):
+            cutouts = [cutout(image, mask, **kwargs) for image, mask in zip(images, masks)]
+    return [convert_result(result, output_type or output_type_of(item), output_format,
+                           encode_options=encode_options)
+            for result, item in zip(cutouts, data)]
+
+
+def _decode(item: ImageData) -> Image.Image:
+    """Декодирование входных данных; уже декодированные изображения не замеряются"""
+    if isinstance(item, (Image.Image, np.ndarray)):
+        return to_pil(item)
+    with timer('decode'):
+        image = to_pil(item)
+        image.load()
+    return image
+
+
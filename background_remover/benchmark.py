@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк удаления фона на синтетических изображениях
+Измеряет задержку по стадиям (декодирование, предобработка, инференс,
+постобработка, наложение маски или alpha matting, кодирование), пропускную
+способность и пиковое потребление памяти для разных моделей, разрешений
+и режимов обработки
+"""
+
+import io
+import os
+import sys
+import time
+import platform
+import tempfile
+import logging
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+
+logger = logging.getLogger(__name__)
+
+BENCH_MODES = ['serial', 'batched', 'parallel']
+
+# cutout - наложение маски без alpha matting, alpha_matting - с ним
+STAGES = ['decode', 'preprocess', 'inference', 'postprocess', 'cutout', 'alpha_matting', 'encode']
+
+DEFAULT_RESOLUTIONS = [(640, 480), (1920, 1080)]
+
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """Разбор разрешения вида 1920x1080"""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise ValueError(f"Неверное разрешение: {value} (ожидается ШИРИНАxВЫСОТА)")
+    if width <= 0 or height <= 0:
+        raise ValueError(f"Неверное разрешение: {value}")
+    return width, height
+
+
+def make_synthetic_image(width: int, height: int, seed: int = 0) -> bytes:
+    """
+    Синтетическое изображение: шумный градиентный фон и размытый объект в центре
+
+    Returns:
+        bytes: JPEG-файл
+    """
+    rng = np.random.default_rng(seed)
+
+    x = np.linspace(0, 1, width, dtype=np.float32)
+    y = np.linspace(0, 1, height, dtype=np.float32)[:, None]
+    background = np.stack([x * 200 + y * 0, y * 180 + x * 20, (1 - x) * 160 + y * 40], axis=-1)
+    background = background + rng.normal(0, 12, (height, width, 3))
+    image = Image.fromarray(np.clip(background, 0, 255).astype(np.uint8), "RGB")
+
+    # Объект с неровным краем, чтобы маска и alpha matting имели работу
+    _draw_object(image, tuple(int(c) for c in rng.integers(0, 255, 3)))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def _draw_object(image: Image.Image, fill) -> None:
+    """Объект синтетического изображения: эллипс с прямоугольником снизу"""
+    width, height = image.size
+    draw = ImageDraw.Draw(image)
+    cx, cy = width / 2, height / 2
+    rx, ry = width * 0.25, height * 0.3
+    draw.ellipse((cx - rx, cy - ry, cx + rx, cy + ry), fill=fill)
+    draw.rectangle((cx - rx / 3, cy + ry * 0.6, cx + rx / 3, cy + ry * 1.4), fill=fill)
+
+
+def make_synthetic_mask(width: int, height: int) -> Image.Image:
+    """Маска объекта синтетического изображения с размытым, как у модели, краем"""
+    mask = Image.new("L", (width, height), 0)
+    _draw_object(mask, 255)
+    # Маска модели считается в 320x320 и растягивается, край размыт пропорционально
+    return mask.filter(ImageFilter.GaussianBlur(max(width, height) / 320))
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый объем резидентной памяти процесса и его дочерних процессов (МБ)"""
+    try:
+        import resource
+    except ImportError:
+        # Windows
+        return None
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux возвращает килобайты, macOS - байты
+    if sys.platform == 'darwin':
+        return round(peak / 1024 / 1024, 1)
+    return round(peak / 1024, 1)
+
+
+def summarize(samples: Sequence[float]) -> dict:
+    """Сводка по задержкам: среднее и перцентили в миллисекундах"""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        "count": len(values),
+        "mean_ms": round(float(values.mean()), 3),
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p90_ms": round(float(np.percentile(values, 90)), 3),
+        "p99_ms": round(float(np.percentile(values, 99)), 3),
+        "max_ms": round(float(values.max()), 3),
+    }
+
+
+class StageTimer:
+    """Накопитель длительностей по стадиям"""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+
+    def measure(self, stage: str, func, *args, per: int = 1, **kwargs):
+        """
+        Выполнение func с записью длительности в стадию stage
+
+        Args:
+            per: Количество изображений, на которое делится длительность
+                (для стадий, обрабатывающих батч целиком)
+        """
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        elapsed = (time.perf_counter() - start) / per
+        self.samples[stage].extend([elapsed] * per)
+        return result
+
+    def report(self) -> dict:
+        return {stage: summarize(self.samples[stage]) for stage in STAGES if self.samples.get(stage)}
+
+
+def _encode_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def _run_staged(session, model_name: str, images: List[bytes], batch_size: int,
+                timer: StageTimer, alpha_kwargs: dict) -> None:
+    """Последовательный или пакетный проход с замером каждой стадии"""
+    from batch_inference import (MODEL_INPUT_SPECS, _fixed_batch_size, base_model, cutout,
+                                 postprocess, preprocess, supports_batching, to_pil)
+
+    def load(data):
+        image = to_pil(data)
+        image.load()
+        return image
+
+    def matting(image, mask):
+        return cutout(image, mask, **alpha_kwargs)
+
+    stage_cutout = 'alpha_matting' if alpha_kwargs.get('alpha_matting') else 'cutout'
+
+    if not supports_batching(model_name):
+        # Модели без описания входа (u2net_cloth_seg) запускаются через rembg целиком,
+        # предобработка и постобработка входят в стадию инференса
+        for data in images:
+            image = timer.measure('decode', load, data)
+            masks = timer.measure('inference', session.predict, image)
+            result = timer.measure(stage_cutout, matting, image, masks[0])
+            timer.measure('encode', _encode_png, result)
+        return
+
+    spec = MODEL_INPUT_SPECS[base_model(model_name)]
+    inner = session.inner_session
+    input_name = inner.get_inputs()[0].name
+    fixed = _fixed_batch_size(session)
+    if fixed is not None and fixed != batch_size:
+        batch_size = fixed
+
+    for start in range(0, len(images), batch_size):
+        chunk = images[start:start + batch_size]
+        if len(chunk) < batch_size and fixed is not None:
+            break
+        decoded = [timer.measure('decode', load, data) for data in chunk]
+        batch = timer.measure('preprocess', lambda: np.stack([preprocess(image, spec) for image in decoded]),
+                              per=len(decoded))
+        outputs = timer.measure('inference', inner.run, None, {input_name: batch}, per=len(decoded))
+        for pred, image in zip(outputs[0][:, 0, :, :], decoded):
+            mask = timer.measure('postprocess', postprocess, pred, image.size, spec)
+            result = timer.measure(stage_cutout, matting, image, mask)
+            timer.measure('encode', _encode_png, result)
+
+
+def _run_parallel(model_name: str, images: List[bytes], workers: int, batch_size: int,
+                  alpha_kwargs: dict, session_config=None) -> Tuple[int, int]:
+    """Проход через пул процессов; файлы пишутся во временную директорию"""
+    from tqdm import tqdm
+    from parallel_engine import run_parallel
+
+    with tempfile.TemporaryDirectory(prefix="bg-remove-bench-") as tmp:
+        tasks = []
+        for index, data in enumerate(images):
+            input_file = os.path.join(tmp, f"{index}.jpg")
+            with open(input_file, 'wb') as f:
+                f.write(data)
+            tasks.append((input_file, os.path.join(tmp, f"{index}_nobg.png")))
+
+        with tqdm(disable=True) as progress_bar:
+            return run_parallel(model_name, tasks, workers, batch_size=batch_size,
+                                progress_bar=progress_bar,
+                                remover_options={"session_config": session_config},
+                                **alpha_kwargs)
+
+
+# Скрипт замера холодного старта: выполняется в отдельном процессе,
+# чтобы модули и модель не были уже загружены бенчмарком
+_COLD_START_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+stages = {}
+def mark(stage):
+    global started
+    now = time.perf_counter()
+    stages[stage] = round(now - started, 4)
+    started = now
+import background_remover
+mark("import_cli")
+import rembg
+mark("import_rembg")
+from model_sessions import get_session
+session = get_session(sys.argv[1])
+mark("session")
+from batch_inference import remove_batch
+remove_batch(session, sys.argv[1], [sys.stdin.buffer.read()], output_type="pil")
+mark("first_inference")
+print(json.dumps(stages))
+"""
+
+
+def measure_cold_start(model_name: str, resolution: Tuple[int, int] = (640, 480)) -> dict:
+    """
+    Замер холодного старта в новом процессе: импорт CLI, импорт rembg,
+    создание сессии, первый инференс и время bg-remove --help
+
+    Returns:
+        dict: Время стадий в секундах или ошибка
+    """
+    import json
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    entry = {}
+    try:
+        start = time.perf_counter()
+        subprocess.run([sys.executable, os.path.join(here, "background_remover.py"), "--help"],
+                       check=True, capture_output=True, cwd=here)
+        entry["cli_help"] = round(time.perf_counter() - start, 4)
+
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, "-c", _COLD_START_SCRIPT, model_name],
+                                   input=make_synthetic_image(*resolution), check=True,
+                                   capture_output=True, cwd=here)
+        entry["total"] = round(time.perf_counter() - start, 4)
+        entry.update(json.loads(completed.stdout.decode().strip().splitlines()[-1]))
+    except subprocess.CalledProcessError as e:
+        stderr = e.stderr.decode(errors='replace').strip().splitlines()
+        entry["error"] = stderr[-1] if stderr else str(e)
+    except Exception as e:
+        entry["error"] = str(e)
+    return entry
+
+
+def run_benchmark(models: Sequence[str], resolutions: Sequence[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                  images: int = 16, modes: Sequence[str] = ('serial', 'batched'),
+                  batch_size: int = 4, workers: Optional[int] = None,
+                  alpha_matting: bool = False, warmup_runs: int = 1,
+                  session_configs: Sequence = (None,), cold_start: bool = True) -> dict:
+    """
+    Запуск бенчмарка
+
+    Args:
+        models: Модели для замера
+        resolutions: Разрешения синтетических изображений (ширина, высота)
+        images: Количество изображений на каждое разрешение
+        modes: Режимы обработки (serial, batched, parallel)
+        batch_size: Размер батча для режимов batched и parallel
+        workers: Количество процессов для режима parallel (None - по числу ядер)
+        alpha_matting: Включить alpha matting
+        warmup_runs: Количество прогревочных изображений, не входящих в замер
+        session_configs: Варианты параметров ONNX-сессии (SessionConfig,
+            None - по умолчанию onnxruntime); каждый замеряется отдельно
+        cold_start: Замерить холодный старт каждой модели в новом процессе
+
+    Returns:
+        dict: Результаты в виде, пригодном для сохранения в JSON
+    """
+    from model_sessions import get_session
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    alpha_kwargs = {"alpha_matting": alpha_matting}
+
+    results = []
+    cold_starts = {}
+    for model_name in models:
+        if cold_start:
+            logger.info(f"Холодный старт: {model_name}")
+            cold_starts[model_name] = measure_cold_start(model_name)
+
+        for session_config in session_configs:
+            # Последовательные режимы работают с одной сессией, parallel - с сессией в каждом воркере
+            serial_config = session_config.for_workers(1) if session_config else None
+            parallel_config = session_config.for_workers(workers) if session_config else None
+            try:
+                session = get_session(model_name, config=serial_config)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить модель {model_name}: {e}")
+                results.append({"model": model_name, "error": str(e)})
+                break
+
+            for width, height in resolutions:
+                dataset = [make_synthetic_image(width, height, seed) for seed in range(images)]
+
+                for mode in modes:
+                    logger.info(f"Бенчмарк: {model_name}, {width}x{height}, режим {mode}")
+                    config = parallel_config if mode == 'parallel' else serial_config
+                    entry = {
+                        "model": model_name,
+                        "mode": mode,
+                        "resolution": f"{width}x{height}",
+                        "images": images,
+                        "batch_size": 1 if mode == 'serial' else batch_size,
+                        "session": config.describe() if config else "default",
+                    }
+                    try:
+                        if mode == 'parallel':
+                            entry["workers"] = workers
+                            start = time.perf_counter()
+                            processed, failed = _run_parallel(model_name, dataset, workers, batch_size,
+                                                              alpha_kwargs, parallel_config)
+                            wall = time.perf_counter() - start
+                            entry["failed"] = failed
+                        else:
+                            run_batch = 1 if mode == 'serial' else batch_size
+                            if warmup_runs:
+                                _run_staged(session, model_name, dataset[:warmup_runs] * run_batch, run_batch,
+                                            StageTimer(), alpha_kwargs)
+                            timer = StageTimer()
+                            start = time.perf_counter()
+                            _run_staged(session, model_name, dataset, run_batch, timer, alpha_kwargs)
+                            wall = time.perf_counter() - start
+                            processed = len(timer.samples['encode'])
+                            entry["stages"] = timer.report()
+                    except Exception as e:
+                        logger.error(f"Ошибка бенчмарка {model_name} ({mode}): {e}")
+                        entry["error"] = str(e)
+                        results.append(entry)
+                        continue
+
+                    entry["wall_seconds"] = round(wall, 3)
+                    entry["throughput_ips"] = round(processed / wall, 3) if wall > 0 else None
+                    entry["peak_rss_mb"] = peak_rss_mb()
+                    results.append(entry)
+
+    return {
+        "system": system_info(),
+        "config": {
+            "models": list(models),
+            "resolutions": [f"{w}x{h}" for w, h in resolutions],
+            "images": images,
+            "modes": list(modes),
+            "batch_size": batch_size,
+            "workers": workers,
+            "alpha_matting": alpha_matting,
+            "session_configs": [config._asdict() if config else "default" for config in session_configs],
+        },
+        "cold_start": cold_starts,
+        "results": results,
+    }
+
+
+def run_matting_report(resolutions: Sequence[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                       scales: Sequence[float] = (1.0, 0.5, 0.25)) -> List[dict]:
+    """
+    Сравнение быстрого alpha matting с rembg по скорости и качеству
+    на синтетических изображениях
+
+    Returns:
+        List[dict]: Отчет compare_with_reference для каждого разрешения
+    """
+    from fast_matting import compare_with_reference
+
+    report = []
+    for width, height in resolutions:
+        logger.info(f"Сравнение alpha matting: {width}x{height}")
+        image = Image.open(io.BytesIO(make_synthetic_image(width, height))).convert("RGB")
+        entry = compare_with_reference(image, make_synthetic_mask(width, height), scales=scales)
+        report.append({"resolution": f"{width}x{height}", **entry})
+    return report
+
+
+# Сравниваемые настройки кодирования: (формат PIL, уровень сжатия, качество, палитра)
+ENCODE_SETTINGS = (
+    ('PNG', 'fast', None, None),
+    ('PNG', 'default', None, None),
+    ('PNG', 'best', None, None),
+    ('PNG', 'default', None, 256),
+    ('WEBP', 'fast', None, None),
+    ('WEBP', 'default', None, None),
+    ('WEBP', 'best', None, None),
+    ('WEBP', 'default', 90, None),
+    ('WEBP', 'default', 80, None),
+)
+
+
+def run_encode_report(resolutions: Sequence[Tuple[int, int]] = DEFAULT_RESOLUTIONS,
+                      repeats: int = 3) -> List[dict]:
+    """
+    Сравнение настроек кодирования результата по времени и размеру
+    на синтетическом вырезанном объекте
+
+    Returns:
+        List[dict]: Для каждого разрешения и настройки - медиана времени
+        кодирования и размер файла
+    """
+    from outputs import EncodeOptions, encode_image
+
+    report = []
+    for width, height in resolutions:
+        image = Image.open(io.BytesIO(make_synthetic_image(width, height))).convert("RGB")
+        cutout = image.convert("RGBA")
+        cutout.putalpha(make_synthetic_mask(width, height))
+        for pil_format, compression, quality, palette in ENCODE_SETTINGS:
+            logger.info(f"Кодирование: {width}x{height}, {pil_format} {compression}")
+            options = EncodeOptions(compression, quality, palette)
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                data = encode_image(cutout, pil_format, options)
+                samples.append(time.perf_counter() - start)
+            report.append({
+                "resolution": f"{width}x{height}",
+                "format": pil_format.lower(),
+                **options._asdict(),
+                "encode_ms": round(float(np.median(samples)) * 1000, 2),
+                "size_kb": round(len(data) / 1024, 1),
+            })
+    return report
+
+
+def system_info() -> dict:
+    """Сведения об окружении для сравнения результатов между машинами"""
+    from model_sessions import available_cores
+
+    info = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "available_cores": available_cores(),
+    }
+    try:
+        import onnxruntime
+        info["onnxruntime"] = onnxruntime.__version__
+        info["providers"] = onnxruntime.get_available_providers()
+    except ImportError:
+        pass
+    return info
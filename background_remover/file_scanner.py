@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Потоковый поиск изображений на основе os.scandir
+Файлы отдаются генератором по мере обхода, поэтому обработка начинается
+сразу, а память не зависит от количества файлов в дереве
+"""
+
+import os
+import time
+import fnmatch
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+def _matches(rel_path: str, name: str, patterns: Sequence[str]) -> bool:
+    """Совпадение относительного пути или имени файла с одним из шаблонов"""
+    return any(fnmatch.fnmatch(rel_path, pattern) or fnmatch.fnmatch(name, pattern)
+               for pattern in patterns)
+
+
+class ImageScanner:
+    """Генератор путей к изображениям в директории"""
+
+    def __init__(self, root: str, extensions: Iterable[str], recursive: bool = False,
+                 include: Optional[Sequence[str]] = None, exclude: Optional[Sequence[str]] = None):
+        """
+        Инициализация
+
+        Args:
+            root: Директория поиска
+            extensions: Допустимые расширения в нижнем регистре (с точкой)
+            recursive: Рекурсивный обход поддиректорий
+            include: Шаблоны (fnmatch) путей относительно root или имен файлов,
+                которые нужно обработать (None - все файлы)
+            exclude: Шаблоны файлов и директорий, которые нужно пропустить
+        """
+        self.root = Path(root)
+        self.extensions = frozenset(extensions)
+        self.recursive = recursive
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+
+    def __iter__(self) -> Iterator[Path]:
+        stack = [(str(self.root), "")]
+        while stack:
+            directory, rel_dir = stack.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        rel_path = f"{rel_dir}{entry.name}"
+
+                        # Тип берется из записи каталога, без отдельного stat на файл.
+                        # Ссылки на директории не обходятся, чтобы не уйти в цикл
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive and not _matches(rel_path, entry.name, self.exclude):
+                                stack.append((entry.path, f"{rel_path}/"))
+                            continue
+
+                        if os.path.splitext(entry.name)[1].lower() not in self.extensions:
+                            continue
+                        if self.include and not _matches(rel_path, entry.name, self.include):
+                            continue
+                        if self.exclude and _matches(rel_path, entry.name, self.exclude):
+                            continue
+                        if entry.is_file():
+                            yield Path(entry.path)
+            except OSError as e:
+                logger.warning(f"Не удалось прочитать директорию {directory}: {e}")
+
+    def count_in_background(self, callback: Callable[[int], None],
+                            interval: float = 0.5) -> threading.Thread:
+        """
+        Подсчет файлов в отдельном потоке для прогресс-бара
+
+        Args:
+            callback: Вызывается с текущим количеством найденных файлов
+                (периодически и по окончании подсчета)
+            interval: Интервал между вызовами callback (секунды)
+
+        Returns:
+            threading.Thread: Запущенный поток подсчета
+        """
+        def count():
+            total = 0
+            last_report = time.monotonic()
+            for _ in self:
+                total += 1
+                now = time.monotonic()
+                if now - last_report >= interval:
+                    callback(total)
+                    last_report = now
+            callback(total)
+
+        thread = threading.Thread(target=count, name="scan-count", daemon=True)
+        thread.start()
+        return thread
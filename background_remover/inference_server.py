@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+HTTP-сервер удаления фона с прогретыми моделями
+Принимает изображение в теле POST-запроса (или в поле multipart/form-data)
+и возвращает PNG/WEBP с прозрачным фоном. Одновременные запросы к одной
+модели собираются в небольшие батчи и проходят через сеть за один вызов
+"""
+
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+from functools import partial
+from typing import Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+from batch_inference import to_pil
+from outputs import COMPRESSION_LEVELS, EncodeOptions, encode_image
+from quantization import split_model_name, variant_path
+from metrics import inc, metrics, timer
+from model_sessions import import_runtime
+
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+HTTP_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    500: 'Internal Server Error',
+    504: 'Gateway Timeout',
+}
+
+
+class HTTPError(Exception):
+    """Ошибка запроса с кодом ответа"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _decode_image(data: bytes) -> Image.Image:
+    """Декодирование загруженного изображения"""
+    with timer('decode'):
+        image = to_pil(data)
+        image.load()
+    return image
+
+
+def _encode_image(image: Image.Image, output_format: str, options: EncodeOptions) -> bytes:
+    """Кодирование результата в выбранный формат"""
+    pil_format, _ = OUTPUT_FORMATS[output_format]
+    return encode_image(image, pil_format, options)
+
+
+class MicroBatcher:
+    """Сбор одновременных запросов к одной модели в батчи"""
+
+    def __init__(self, remover, executor: ThreadPoolExecutor, params: dict,
+                 max_batch: int = 8, max_wait: float = 0.01):
+        """
+        Инициализация
+
+        Args:
+            remover: Экземпляр BackgroundRemover с прогретой моделью
+            executor: Пул потоков для инференса
+            params: Параметры alpha matting, общие для батча
+            max_batch: Максимальный размер батча
+            max_wait: Сколько ждать новых запросов после первого (секунды)
+        """
+        self.remover = remover
+        self.executor = executor
+        self.params = params
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue: "asyncio.Queue" = asyncio.Queue()
+        # Запросы, ожидающие результата: батчер с ними нельзя остановить
+        self.pending = 0
+        self._task = asyncio.ensure_future(self._run())
+
+    async def submit(self, image: Image.Image) -> Image.Image:
+        """Постановка изображения в очередь и ожидание результата"""
+        future = asyncio.get_running_loop().create_future()
+        self.pending += 1
+        try:
+            await self.queue.put((image, future))
+            return await future
+        finally:
+            self.pending -= 1
+
+    async def _collect(self) -> List[Tuple[Image.Image, asyncio.Future]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Отмененные клиентом запросы не занимают место в батче
+        return [(image, future) for image, future in batch if not future.cancelled()]
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            if not batch:
+                continue
+
+            images = [image for image, _ in batch]
+            try:
+                if len(images) > 1:
+                    call = partial(self.remover.remove_backgrounds, images, **self.params)
+                    results = await loop.run_in_executor(self.executor, call)
+                else:
+                    call = partial(self.remover.remove, images[0], **self.params)
+                    results = [await loop.run_in_executor(self.executor, call)]
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            logger.debug(f"Батч из {len(batch)} изображений обработан")
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def close(self):
+        """Остановка цикла сбора батчей"""
+        self._task.cancel()
+
+
+class InferenceServer:
+    """Асинхронный HTTP-сервер с пулом прогретых моделей"""
+
+    def __init__(self, models: Iterable[str], allowed_models: Iterable[str],
+                 max_concurrency: int = 8, batch_size: int = 8, batch_wait_ms: float = 10,
+                 max_body_bytes: int = 50 * 1024 * 1024, cache=None, session_config=None,
+                 request_timeout: Optional[float] = None, max_batchers: int = 16):
+        """
+        Инициализация сервера
+
+        Args:
+            models: Модели, загружаемые при старте (первая - модель по умолчанию)
+            allowed_models: Модели, которые можно запросить параметром model
+            max_concurrency: Максимум запросов, обрабатываемых одновременно
+            batch_size: Максимальный размер батча для одной модели
+            batch_wait_ms: Сколько ждать одновременных запросов для батча
+            max_body_bytes: Максимальный размер тела запроса
+            cache: Кэш результатов (ResultCache) для BackgroundRemover
+            session_config: Параметры ONNX-сессий (SessionConfig); при
+                автоматическом выборе потоков ядра делятся между моделями
+            request_timeout: Ограничение времени обработки запроса в секундах
+                (None - без ограничения); по его истечении клиент получает 504
+            max_batchers: Сколько сборщиков батчей (по одному на модель и
+                набор параметров alpha matting) держать одновременно; давно
+                не использованные сборщики без ожидающих запросов
+                останавливаются
+        """
+        self.models = list(models)
+        self.default_model = self.models[0]
+        self.allowed_models = set(allowed_models)
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait_ms / 1000
+        self.max_body_bytes = max_body_bytes
+        self.request_timeout = request_timeout
+        self.cache = cache
+        self.session_config = session_config.for_workers(sessions=len(self.models)) if session_config else None
+        self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="infer")
+        # Модели загружаются в пуле, а rembg должен быть импортирован не в нем
+        import_runtime()
+        self._removers: Dict[str, object] = {}
+        self.max_batchers = max_batchers
+        self._batchers: "OrderedDict[Tuple, MicroBatcher]" = OrderedDict()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._models_lock: Optional[asyncio.Lock] = None
+
+    async def _get_remover(self, model_name: str):
+        """Экземпляр BackgroundRemover с прогретой моделью"""
+        remover = self._removers.get(model_name)
+        if remover is not None:
+            return remover
+
+        # Модель загружается один раз, даже если ее одновременно запросили несколько клиентов
+        async with self._models_lock:
+            remover = self._removers.get(model_name)
+            if remover is None:
+                from background_remover import BackgroundRemover
+                remover = BackgroundRemover(model_name=model_name, cache=self.cache,
+                                            session_config=self.session_config)
+                await asyncio.get_running_loop().run_in_executor(self.executor, remover.warmup)
+                self._removers[model_name] = remover
+        return remover
+
+    async def _get_batcher(self, model_name: str, params: dict) -> MicroBatcher:
+        key = (model_name, tuple(sorted(params.items())))
+        batcher = self._batchers.get(key)
+        if batcher is None:
+            remover = await self._get_remover(model_name)
+            batcher = self._batchers.get(key)
+            if batcher is None:
+                batcher = MicroBatcher(remover, self.executor, params,
+                                       max_batch=self.batch_size, max_wait=self.batch_wait)
+                self._batchers[key] = batcher
+        self._batchers.move_to_end(key)
+        self._evict_batchers()
+        return batcher
+
+    def _evict_batchers(self) -> None:
+        """Остановка давно не использованных сборщиков сверх max_batchers"""
+        # Параметры запроса задает клиент, и без ограничения каждый новый
+        # набор оставлял бы работающую задачу сборщика
+        for key, batcher in list(self._batchers.items())[:-1]:
+            if len(self._batchers) <= self.max_batchers:
+                break
+            if batcher.pending:
+                continue
+            batcher.close()
+            del self._batchers[key]
+
+    @staticmethod
+    def _parse_params(query: Dict[str, List[str]]) -> dict:
+        """Параметры alpha matting из строки запроса"""
+        def value(name, default):
+            return query.get(name, [default])[0]
+
+        try:
+            alpha_matting = value('alpha_matting', '0').lower() in ('1', 'true', 'yes')
+            params = {'alpha_matting': alpha_matting}
+            if alpha_matting:
+                params.update(
+                    alpha_matting_foreground_threshold=int(value('foreground_threshold', 240)),
+                    alpha_matting_background_threshold=int(value('background_threshold', 10)),
+                    alpha_matting_erode_size=int(value('erode_size', 10))
+                )
+                if value('fast_matting', '0').lower() in ('1', 'true', 'yes'):
+                    scale = float(value('matting_scale', 0.5))
+                    if not 0.1 <= scale <= 1.0:
+                        raise ValueError(f"matting_scale={scale} вне диапазона 0.1-1.0")
+                    params.update(alpha_matting_fast=True, alpha_matting_scale=scale)
+        except ValueError as e:
+            raise HTTPError(400, f"Неверный параметр: {e}")
+        return params
+
+    @staticmethod
+    def _parse_encode_options(query: Dict[str, List[str]]) -> EncodeOptions:
+        """Параметры кодирования из строки запроса: compression, quality, palette"""
+        compression = query.get('compression', ['default'])[0].lower()
+        if compression not in COMPRESSION_LEVELS:
+            raise HTTPError(400, f"Неизвестный уровень сжатия: {compression}")
+        try:
+            quality = int(query['quality'][0]) if 'quality' in query else None
+            palette = int(query['palette'][0]) if 'palette' in query else None
+        except ValueError as e:
+            raise HTTPError(400, f"Неверный параметр: {e}")
+        if quality is not None and not 1 <= quality <= 100:
+            raise HTTPError(400, f"quality={quality} вне диапазона 1-100")
+        if palette is not None and not 2 <= palette <= 256:
+            raise HTTPError(400, f"palette={palette} вне диапазона 2-256")
+        return EncodeOptions(compression, quality, palette)
+
+    @staticmethod
+    def _extract_image(headers: Dict[str, str], body: bytes) -> bytes:
+        """Байты изображения из тела запроса (сырое тело или multipart/form-data)"""
+        content_type = headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return body
+
+        message = BytesParser(policy=HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body
+        )
+        for part in message.iter_parts():
+            if part.get_param('name', header='content-disposition') in ('file', 'image'):
+                return part.get_payload(decode=True)
+        raise HTTPError(400, "В multipart-запросе нет поля file или image")
+
+    def _check_model(self, model_name: str) -> None:
+        """Проверка модели из запроса; варианты пониженной точности должны быть уже созданы"""
+        try:
+            base, precision = split_model_name(model_name)
+        except ValueError as e:
+            raise HTTPError(400, str(e))
+        if base not in self.allowed_models:
+            raise HTTPError(400, f"Неизвестная модель: {model_name}")
+        if precision is not None and not variant_path(base, precision).exists():
+            raise HTTPError(400, f"Вариант {model_name} не создан (bg-remove quantize)")
+
+    async def _handle_remove(self, query: Dict[str, List[str]], headers: Dict[str, str],
+                             body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        model_name = query.get('model', [self.default_model])[0]
+        self._check_model(model_name)
+
+        output_format = query.get('format', ['png'])[0].lower()
+        if output_format not in OUTPUT_FORMATS:
+            raise HTTPError(400, f"Неподдерживаемый формат: {output_format}")
+
+        params = self._parse_params(query)
+        encode_options = self._parse_encode_options(query)
+        data = self._extract_image(headers, body)
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+
+        async def process() -> Tuple[Image.Image, bytes]:
+            try:
+                image = await loop.run_in_executor(self.executor, _decode_image, data)
+            except Exception as e:
+                raise HTTPError(400, f"Не удалось декодировать изображение: {e}")
+
+            batcher = await self._get_batcher(model_name, params)
+            result = await batcher.submit(image)
+            output = await loop.run_in_executor(self.executor, _encode_image, result, output_format,
+                                                encode_options)
+            return image, output
+
+        async with self._semaphore:
+            try:
+                # Отмена снимает запрос с батча, если он еще не ушел в модель;
+                # уже начатый вызов onnxruntime завершается в фоне
+                image, output = await asyncio.wait_for(process(), self.request_timeout)
+            except asyncio.TimeoutError:
+                inc('request_timeouts')
+                raise HTTPError(504, f"Превышено время обработки ({self.request_timeout:g} с)")
+
+        elapsed = time.perf_counter() - started
+        metrics.observe('request', elapsed)
+        logger.info(f"Обработано: {model_name}, {image.size[0]}x{image.size[1]}, {elapsed:.3f} с")
+        return 200, {
+            'Content-Type': OUTPUT_FORMATS[output_format][1],
+            'X-Processing-Time': f"{elapsed:.3f}",
+        }, output
+
+    async def _dispatch(self, method: str, target: str, headers: Dict[str, str],
+                        body: bytes) -> Tuple[int, Dict[str, str], bytes]:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+
+        if url.path == '/health':
+            payload = {'status': 'ok', 'models': sorted(self._removers)}
+            return 200, {'Content-Type': 'application/json'}, json.dumps(payload).encode('utf-8')
+
+        if url.path == '/metrics':
+            return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, \
+                metrics.render_prometheus().encode('utf-8')
+
+        if url.path == '/remove':
+            if method != 'POST':
+                raise HTTPError(405, "Используйте POST")
+            return await self._handle_remove(query, headers, body)
+
+        raise HTTPError(404, f"Не найдено: {url.path}")
+
+    async def _read_request(self, reader: asyncio.StreamReader):
+        """Чтение одного HTTP-запроса; None, если клиент закрыл соединение"""
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        try:
+            method, target, version = request_line.decode('latin-1').split()
+        except ValueError:
+            raise HTTPError(400, "Неверная строка запроса")
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        # Тело читается только по Content-Length; после ошибки соединение
+        # закрывается, так как непрочитанное тело сбило бы следующий запрос
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            raise HTTPError(411, "Передача chunked не поддерживается, укажите Content-Length")
+        raw_length = headers.get('content-length', '0') or '0'
+        if not (raw_length.isascii() and raw_length.isdigit()):
+            raise HTTPError(400, f"Неверный Content-Length: {raw_length}")
+        length = int(raw_length)
+        if length > self.max_body_bytes:
+            raise HTTPError(413, "Слишком большой файл")
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, version, headers, body
+
+    @staticmethod
+    async def _write_response(writer: asyncio.StreamWriter, status: int,
+                              headers: Dict[str, str], body: bytes, keep_alive: bool):
+        lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}"]
+        headers = dict(headers, **{
+            'Content-Length': str(len(body)),
+            'Connection': 'keep-alive' if keep_alive else 'close',
+        })
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+        await writer.drain()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self._read_request(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers, body = request
+                    keep_alive = (version == 'HTTP/1.1'
+                                  and headers.get('connection', '').lower() != 'close')
+                    status, response_headers, payload = await self._dispatch(method, target, headers, body)
+                except HTTPError as e:
+                    inc('request_errors')
+                    status, response_headers = e.status, {'Content-Type': 'application/json'}
+                    payload = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except Exception as e:
+                    inc('request_errors')
+                    logger.error(f"Ошибка при обработке запроса: {e}")
+                    status, response_headers = 500, {'Content-Type': 'application/json'}
+                    payload = json.dumps({'error': str(e)}, ensure_ascii=False).encode('utf-8')
+
+                await self._write_response(writer, status, response_headers, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8765):
+        """Загрузка моделей и запуск сервера"""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._models_lock = asyncio.Lock()
+        for model_name in self.models:
+            await self._get_remover(model_name)
+
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        logger.info(f"Сервер запущен: http://{host}:{port} (модели: {', '.join(self.models)})")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for batcher in self._batchers.values():
+                batcher.close()
+            self.executor.shutdown(wait=False)
+
+
+def run_server(host: str, port: int, models: Iterable[str], allowed_models: Iterable[str], **kwargs):
+    """Запуск сервера до прерывания (Ctrl+C)"""
+    server = InferenceServer(models, allowed_models, **kwargs)
+    try:
+        asyncio.run(server.serve(host, port))
+    except KeyboardInterrupt:
+        logger.info("Сервер остановлен")
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+"""
+Очередь заданий для обработки на нескольких машинах
+bg-remove submit кладет файлы в очередь, bg-remove worker на любом узле
+берет их в аренду пачками, обрабатывает и отмечает результат. Задание,
+аренда которого истекла (воркер упал или завис), снова выдается другому
+воркеру, неудачные задания повторяются до max_attempts раз. Хранилище
+очереди подключаемое: база sqlite или директория-спул на общей файловой системе
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Время аренды задания по умолчанию (секунды)
+DEFAULT_LEASE_SECONDS = 300
+
+# Количество попыток обработки задания по умолчанию
+DEFAULT_MAX_ATTEMPTS = 3
+
+# Состояния задания
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (PENDING, LEASED, DONE, FAILED)
+
+
+class Job(NamedTuple):
+    """Задание: один входной файл и параметры его обработки"""
+    id: str
+    input_file: str
+    output_file: str
+    params: dict
+    attempts: int = 0
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS
+
+
+def job_id(input_file: str, output_file: str) -> str:
+    """Идентификатор задания: повторная отправка того же файла не создает дубликат"""
+    return hashlib.blake2b(f"{input_file}\0{output_file}".encode('utf-8'), digest_size=12).hexdigest()
+
+
+def make_job(input_file: str, output_file: str, params: dict,
+             max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> Job:
+    """Задание с абсолютными путями: воркеры на других узлах видят ту же файловую систему"""
+    input_file = os.path.abspath(input_file)
+    output_file = os.path.abspath(output_file)
+    return Job(job_id(input_file, output_file), input_file, output_file, params, 0, max_attempts)
+
+
+def default_worker_id() -> str:
+    """Имя воркера: узел и процесс"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def summarize(counts: Dict[str, int]) -> dict:
+    """Сводка очереди в том же виде, что и статистика process_directory"""
+    return {
+        "processed": counts.get(DONE, 0),
+        "failed": counts.get(FAILED, 0),
+        "pending": counts.get(PENDING, 0),
+        "leased": counts.get(LEASED, 0),
+        "total": sum(counts.get(state, 0) for state in STATES),
+    }
+
+
+class SqliteQueue:
+    """Очередь в базе sqlite: для одной машины или общего диска с поддержкой блокировок"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Файл базы (создается при первом обращении)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_lock', '_conn'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # isolation_level=None: транзакции открываются явно через BEGIN IMMEDIATE
+            self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, input TEXT NOT NULL, output TEXT NOT NULL, params TEXT NOT NULL, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, max_attempts INTEGER NOT NULL, "
+                "worker TEXT, lease_until REAL, error TEXT, updated REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until)")
+        return self._conn
+
+    def submit(self, jobs: Iterable[Job], resubmit: bool = False) -> int:
+        """
+        Добавление заданий
+
+        Args:
+            jobs: Задания
+            resubmit: Вернуть в очередь уже известные задания (в том числе
+                выполненные) с новыми параметрами и обнуленными попытками
+
+        Returns:
+            int: Количество добавленных (или возвращенных) заданий
+        """
+        conflict = ("DO UPDATE SET params = excluded.params, status = excluded.status, attempts = 0, "
+                    "max_attempts = excluded.max_attempts, worker = NULL, lease_until = NULL, error = NULL, "
+                    "updated = excluded.updated") if resubmit else "DO NOTHING"
+        added = 0
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                for job in jobs:
+                    cursor = db.execute(
+                        "INSERT INTO jobs (id, input, output, params, status, max_attempts, updated) "
+                        f"VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) {conflict}",
+                        (job.id, job.input_file, job.output_file, json.dumps(job.params, sort_keys=True),
+                         PENDING, job.max_attempts, time.time())
+                    )
+                    added += cursor.rowcount
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return added
+
+    def lease(self, worker: str, count: int, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[Job]:
+        """
+        Аренда заданий: свободных и тех, аренда которых истекла
+
+        Returns:
+            List[Job]: Задания (attempts уже учитывает текущую попытку)
+        """
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                # Задание, исчерпавшее попытки на зависаниях воркеров, больше не выдается
+                db.execute(
+                    "UPDATE jobs SET status = ?, error = 'аренда истекла', updated = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= max_attempts",
+                    (FAILED, now, LEASED, now)
+                )
+                rows = db.execute(
+                    "SELECT id, input, output, params, attempts, max_attempts FROM jobs "
+                    "WHERE status = ? OR (status = ? AND lease_until < ?) ORDER BY rowid LIMIT ?",
+                    (PENDING, LEASED, now, count)
+                ).fetchall()
+                db.executemany(
+                    "UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated = ? WHERE id = ?",
+                    [(LEASED, worker, now + lease_seconds, now, row[0]) for row in rows]
+                )
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return [Job(row[0], row[1], row[2], json.loads(row[3]), row[4] + 1, row[5]) for row in rows]
+
+    def renew(self, jobs: Iterable[Job], worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> None:
+        """Продление аренды заданий, которые воркер еще обрабатывает"""
+        now = time.time()
+        with self._lock:
+            self._db().executemany(
+                "UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND status = ? AND worker = ?",
+                [(now + lease_seconds, now, job.id, LEASED, worker) for job in jobs]
+            )
+
+    def complete(self, job: Job, worker: str) -> None:
+        """Отметка об успешной обработке (повторная отметка ничего не меняет)"""
+        with self._lock:
+            self._db().execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_until = NULL, error = NULL, updated = ? "
+                "WHERE id = ?",
+                (DONE, worker, time.time(), job.id)
+            )
+
+    def fail(self, job: Job, worker: str, error: str) -> None:
+        """Неудачная попытка: задание возвращается в очередь или, если попытки исчерпаны, считается неудачным"""
+        with self._lock:
+            self._db().execute(
+                "UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN ? ELSE ? END, "
+                "lease_until = NULL, error = ?, updated = ? WHERE id = ? AND status = ? AND worker = ?",
+                (FAILED, PENDING, error, time.time(), job.id, LEASED, worker)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        """Количество заданий по состояниям"""
+        with self._lock:
+            return dict(self._db().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def failures(self, limit: int = 20) -> List[Tuple[str, str]]:
+        """Неудачные задания: (входной файл, последняя ошибка)"""
+        with self._lock:
+            return self._db().execute(
+                "SELECT input, COALESCE(error, '') FROM jobs WHERE status = ? ORDER BY updated LIMIT ?",
+                (FAILED, limit)
+            ).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class SpoolQueue:
+    """
+    Очередь в директории: по файлу JSON на задание в поддиректориях
+    pending, leased, done и failed
+
+    Аренда - атомарное переименование файла из pending в leased, поэтому
+    спул работает на общей файловой системе (NFS, SMB), где блокировки
+    sqlite ненадежны.
+    """
+
+    # Файл, только что взятый в аренду, не считается просроченным, пока
+    # воркер не записал в него срок аренды
+    _RECLAIM_GRACE = 5.0
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Директория спула (создается при первом обращении)
+        """
+        self.directory = Path(directory)
+        for state in STATES:
+            (self.directory / state).mkdir(parents=True, exist_ok=True)
+
+    def _path(self, state: str, job_id_: str) -> Path:
+        return self.directory / state / f"{job_id_}.json"
+
+    def _write(self, path: Path, record: dict) -> None:
+        # Запись через временный файл, чтобы другие воркеры не прочитали частично записанное задание
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(record, f, ensure_ascii=False)
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    @staticmethod
+    def _read(path: Path) -> Optional[dict]:
+        try:
+            return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            # Файл забрал другой воркер
+            return None
+
+    @staticmethod
+    def _job(record: dict) -> Job:
+        return Job(record['id'], record['input'], record['output'], record['params'],
+                   record.get('attempts', 0), record.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+
+    def _unlink(self, state: str, job_id_: str) -> None:
+        try:
+            self._path(state, job_id_).unlink()
+        except FileNotFoundError:
+            pass
+
+    def submit(self, jobs: Iterable[Job], resubmit: bool = False) -> int:
+        """Добавление заданий (см. SqliteQueue.submit)"""
+        added = 0
+        for job in jobs:
+            if not resubmit and any(self._path(state, job.id).exists() for state in STATES):
+                continue
+            # Как и в SqliteQueue, задание остается в единственном экземпляре:
+            # арендованное возвращается в очередь, а отметки прежнего
+            # воркера о нем больше не действуют
+            for state in (LEASED, DONE, FAILED):
+                self._unlink(state, job.id)
+            self._write(self._path(PENDING, job.id), {
+                "id": job.id, "input": job.input_file, "output": job.output_file, "params": job.params,
+                "attempts": 0, "max_attempts": job.max_attempts,
+            })
+            added += 1
+        return added
+
+    def _reclaim_expired(self, now: float) -> None:
+        """Возврат в очередь заданий с истекшей арендой"""
+        for path in (self.directory / LEASED).glob("*.json"):
+            try:
+                if path.stat().st_ctime > now - self._RECLAIM_GRACE:
+                    continue
+            except FileNotFoundError:
+                continue
+            record = self._read(path)
+            if record is None or record.get('lease_until', 0) >= now:
+                continue
+            if record.get('attempts', 0) >= record.get('max_attempts', DEFAULT_MAX_ATTEMPTS):
+                record.update(error='аренда истекла', lease_until=None)
+                target = self._path(FAILED, record['id'])
+            else:
+                target = self._path(PENDING, record['id'])
+            try:
+                os.rename(path, target)
+            except FileNotFoundError:
+                continue
+            if target.parent.name == FAILED:
+                self._write(target, record)
+
+    def lease(self, worker: str, count: int, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> List[Job]:
+        """Аренда заданий (см. SqliteQueue.lease)"""
+        now = time.time()
+        self._reclaim_expired(now)
+
+        jobs = []
+        for path in sorted((self.directory / PENDING).glob("*.json")):
+            if len(jobs) >= count:
+                break
+            leased = self._path(LEASED, path.stem)
+            try:
+                # Переименование атомарно: задание достается только одному воркеру
+                os.rename(path, leased)
+            except FileNotFoundError:
+                continue
+            record = self._read(leased)
+            if record is None:
+                continue
+            if self._path(DONE, path.stem).exists():
+                # Задание уже выполнено другим воркером после возврата в очередь
+                self._unlink(LEASED, path.stem)
+                continue
+            record.update(worker=worker, lease_until=now + lease_seconds,
+                          attempts=record.get('attempts', 0) + 1)
+            self._write(leased, record)
+            jobs.append(self._job(record))
+        return jobs
+
+    def renew(self, jobs: Iterable[Job], worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> None:
+        """Продление аренды (см. SqliteQueue.renew)"""
+        for job in jobs:
+            path = self._path(LEASED, job.id)
+            record = self._read(path)
+            if record is not None and record.get('worker') == worker:
+                record['lease_until'] = time.time() + lease_seconds
+                self._write(path, record)
+
+    def complete(self, job: Job, worker: str) -> None:
+        """Отметка об успешной обработке (см. SqliteQueue.complete)"""
+        self._write(self._path(DONE, job.id), {
+            "id": job.id, "input": job.input_file, "output": job.output_file, "params": job.params,
+            "attempts": job.attempts, "max_attempts": job.max_attempts, "worker": worker,
+        })
+        for state in (LEASED, PENDING, FAILED):
+            self._unlink(state, job.id)
+
+    def fail(self, job: Job, worker: str, error: str) -> None:
+        """Неудачная попытка (см. SqliteQueue.fail)"""
+        path = self._path(LEASED, job.id)
+        record = self._read(path)
+        if record is None or record.get('worker') != worker:
+            # Аренду уже забрали: судьбу задания решит другой воркер
+            return
+        record.update(error=error, lease_until=None)
+        state = FAILED if record.get('attempts', 0) >= record.get('max_attempts', DEFAULT_MAX_ATTEMPTS) else PENDING
+        self._write(path, record)
+        try:
+            os.rename(path, self._path(state, job.id))
+        except FileNotFoundError:
+            pass
+
+    def counts(self) -> Dict[str, int]:
+        """Количество заданий по состояниям"""
+        return {state: sum(1 for _ in (self.directory / state).glob("*.json")) for state in STATES}
+
+    def failures(self, limit: int = 20) -> List[Tuple[str, str]]:
+        """Неудачные задания: (входной файл, последняя ошибка)"""
+        result = []
+        for path in sorted((self.directory / FAILED).glob("*.json"))[:limit]:
+            record = self._read(path)
+            if record is not None:
+                result.append((record['input'], record.get('error') or ''))
+        return result
+
+    def close(self) -> None:
+        pass
+
+
+def open_queue(location: str):
+    """
+    Очередь по адресу
+
+    Args:
+        location: sqlite:///путь/к/базе, spool:///путь/к/директории или
+            просто путь: файл .db/.sqlite - sqlite, иначе директория-спул
+
+    Returns:
+        SqliteQueue или SpoolQueue
+    """
+    if location.startswith('sqlite://'):
+        return SqliteQueue(location[len('sqlite://'):])
+    if location.startswith('spool://'):
+        return SpoolQueue(location[len('spool://'):])
+    if Path(location).suffix.lower() in ('.db', '.sqlite', '.sqlite3'):
+        return SqliteQueue(location)
+    return SpoolQueue(location)
+
+
+class LeaseHeartbeat:
+    """
+    Фоновое продление аренды заданий, которые воркер еще обрабатывает
+
+    Аренда продлевается каждую треть срока независимо от того, сколько
+    длится обработка пачки. Отметка результата проходит под той же
+    блокировкой, что и продление, поэтому продление не возвращает
+    в leased уже завершенное задание.
+    """
+
+    def __init__(self, queue, worker: str, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        """
+        Args:
+            queue: Очередь (SqliteQueue, SpoolQueue)
+            worker: Имя воркера, на которого оформлена аренда
+            lease_seconds: Срок, на который продлевается аренда
+        """
+        self.queue = queue
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"lease-heartbeat-{worker}", daemon=True)
+
+    def __enter__(self) -> 'LeaseHeartbeat':
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def track(self, jobs: Iterable[Job]) -> None:
+        """Задания, аренду которых нужно продлевать"""
+        with self._lock:
+            self._jobs.update((job.id, job) for job in jobs)
+
+    def complete(self, job: Job) -> None:
+        """Отметка об успешной обработке и прекращение продления"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            self.queue.complete(job, self.worker)
+
+    def fail(self, job: Job, error: str) -> None:
+        """Отметка о неудачной попытке и прекращение продления"""
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            self.queue.fail(job, self.worker, error)
+
+    def _run(self) -> None:
+        while not self._stop.wait(max(self.lease_seconds / 3, 0.01)):
+            with self._lock:
+                jobs = list(self._jobs.values())
+                if not jobs:
+                    continue
+                try:
+                    self.queue.renew(jobs, self.worker, self.lease_seconds)
+                except Exception as e:
+                    # Следующая попытка через треть срока; аренда еще не истекла
+                    logger.warning(f"Не удалось продлить аренду: {e}")
+
+
+def run_worker(queue, make_remover, worker: Optional[str] = None, batch_size: int = 1,
+               lease_seconds: float = DEFAULT_LEASE_SECONDS, poll_interval: float = 2.0,
+               exit_when_empty: bool = False, max_jobs: Optional[int] = None,
+               stop: Optional[threading.Event] = None) -> dict:
+    """
+    Цикл воркера: аренда пачки заданий, обработка, отметка результата
+
+    Результат задания записывается по пути, заданному при отправке, через
+    временный файл и атомарную замену, поэтому повторная обработка (после
+    истечения аренды) заменяет тот же файл тем же содержимым и не оставляет
+    недописанный файл, даже если два воркера пишут его одновременно.
+
+    Args:
+        queue: Очередь (SqliteQueue, SpoolQueue)
+        make_remover: Функция (модель, формат, параметры кодирования) ->
+            BackgroundRemover; экземпляры переиспользуются
+        worker: Имя воркера (None - узел и процесс)
+        batch_size: Количество заданий в одной аренде и одном вызове модели
+        lease_seconds: Время аренды; пока задание обрабатывается, аренда
+            продлевается в фоне (LeaseHeartbeat)
+        poll_interval: Пауза перед повторным опросом пустой очереди
+        exit_when_empty: Завершиться, когда в очереди не осталось свободных
+            и арендованных заданий
+        max_jobs: Завершиться после стольких заданий (None - без ограничения)
+        stop: Событие для остановки из другого потока
+
+    Returns:
+        dict: Статистика этого воркера: processed, failed (неудачные попытки), total
+    """
+    from metrics import inc
+
+    worker = worker or default_worker_id()
+    removers: Dict[tuple, object] = {}
+    processed = 0
+    failed = 0
+
+    logger.info(f"Воркер {worker} запущен")
+    with LeaseHeartbeat(queue, worker, lease_seconds) as heartbeat:
+        while not (stop is not None and stop.is_set()):
+            limit = batch_size if max_jobs is None else min(batch_size, max_jobs - processed - failed)
+            if limit <= 0:
+                break
+            jobs = queue.lease(worker, limit, lease_seconds)
+            if not jobs:
+                counts = queue.counts()
+                if exit_when_empty and not counts.get(PENDING) and not counts.get(LEASED):
+                    break
+                if stop is not None:
+                    stop.wait(poll_interval)
+                else:
+                    time.sleep(poll_interval)
+                continue
+            heartbeat.track(jobs)
+
+            # Задания одной пачки группируются по параметрам обработки
+            groups: Dict[str, List[Job]] = {}
+            for job in jobs:
+                groups.setdefault(json.dumps(job.params, sort_keys=True), []).append(job)
+
+            for group in groups.values():
+                params = group[0].params
+                remover_key = (params['model'], params.get('format', 'png'), tuple(params.get('encoding', ())))
+                if remover_key not in removers:
+                    removers[remover_key] = make_remover(*remover_key)
+                remover = removers[remover_key]
+                kwargs = params.get('kwargs', {})
+
+                tasks = [(job.input_file, job.output_file) for job in group]
+                for job in group:
+                    Path(job.output_file).parent.mkdir(parents=True, exist_ok=True)
+                if len(group) > 1:
+                    results = remover.remove_background_batch(tasks, **kwargs)
+                else:
+                    results = [remover.remove_background(*tasks[0], **kwargs)]
+
+                for job, success in zip(group, results):
+                    if success:
+                        heartbeat.complete(job)
+                        processed += 1
+                    else:
+                        heartbeat.fail(job, "ошибка обработки (см. журнал воркера)")
+                        failed += 1
+                inc('images_processed', sum(results))
+                inc('images_failed', len(results) - sum(results))
+
+    logger.info(f"Воркер {worker} завершен: обработано {processed}, ошибок {failed}")
+    return {"processed": processed, "failed": failed, "total": processed + failed}
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+Обработка очень больших изображений с ограниченным потреблением памяти
+Маска считается по уменьшенной копии (для JPEG - черновое декодирование
+через Image.draft), затем масштабируется и накладывается на исходное
+изображение полосами, поэтому полноразмерные промежуточные массивы
+(float-копии, маска полного размера, матрицы alpha matting) не создаются
+"""
+
+import io
+import math
+import logging
+from typing import Callable, NamedTuple, Optional, Tuple
+
+from PIL import ExifTags, Image, ImageOps
+
+from preflight import check_deadline
+
+logger = logging.getLogger(__name__)
+
+# Порог, начиная с которого изображение обрабатывается полосами (пикселей)
+LARGE_IMAGE_PIXELS = 24_000_000
+
+# Максимальная сторона уменьшенной копии для маски и alpha matting
+DRAFT_MAX_SIDE = 2048
+
+# Байт на пиксель полосы сверх вырезки исходного изображения: вырезка RGBA,
+# пустой RGBA, результат наложения и маска
+_STRIP_BYTES_PER_PIXEL = 4 + 4 + 4 + 1
+
+# Оценка памяти на уменьшенную копию с предобработкой и маской, а также
+# с массивами alpha matting (байт на пиксель копии)
+_DRAFT_BYTES_PER_PIXEL = 32
+_DRAFT_MATTING_BYTES_PER_PIXEL = 96
+
+
+class ImageHeader(NamedTuple):
+    """Сведения из заголовка изображения, от которых зависит расход памяти"""
+    size: Tuple[int, int]
+    mode: str
+    format: Optional[str]
+    # EXIF-ориентация требует поворота (поворот копирует изображение)
+    transposed: bool
+
+
+def probe_size(data) -> Tuple[int, int]:
+    """Размер изображения по заголовку, без декодирования (байты или открытый файл)"""
+    source = data if hasattr(data, 'read') else io.BytesIO(data)
+    # Переданный файл PIL не закрывает
+    with Image.open(source) as image:
+        return image.size
+
+
+def probe_header(data: bytes) -> ImageHeader:
+    """Размер, режим, формат и ориентация по заголовку, без декодирования"""
+    with Image.open(io.BytesIO(data)) as image:
+        orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+        return ImageHeader(image.size, image.mode, image.format, orientation in range(2, 9))
+
+
+def bytes_per_pixel(mode: str) -> int:
+    """Память на пиксель изображения PIL (RGB и другие режимы до 4 каналов хранятся по 4 байта)"""
+    if mode in ('1', 'L', 'P'):
+        return 1
+    if mode.startswith('I;16'):
+        return 2
+    return 4
+
+
+def is_large(size: Tuple[int, int], threshold: Optional[int] = LARGE_IMAGE_PIXELS) -> bool:
+    """Нужно ли обрабатывать изображение полосами"""
+    return threshold is not None and size[0] * size[1] >= threshold
+
+
+def strip_rows_for(header: ImageHeader, max_memory: Optional[int] = None, alpha_matting: bool = False,
+                   input_bytes: int = 0, encode_bytes_per_pixel: int = 0) -> int:
+    """
+    Высота полосы с учетом ограничения памяти
+
+    Полосами накладывается только маска: исходное изображение и результат
+    RGBA полного размера декодируются и кодируются целиком, поэтому
+    ограничение не может быть меньше памяти на них (около 8 байт на
+    пиксель для RGB) вместе с входным файлом и буферами кодеров.
+    Для форматов, кроме JPEG, уменьшенная копия тоже строится из
+    изображения, декодированного целиком.
+
+    Args:
+        header: Заголовок изображения (probe_header)
+        max_memory: Ограничение памяти в байтах (None - полосы по 512 строк)
+        alpha_matting: Учитывать память на alpha matting уменьшенной копии
+        input_bytes: Размер входного файла, который хранится в памяти все время обработки
+        encode_bytes_per_pixel: Память кодеров на пиксель результата
+            (VariantWriter.encode_bytes_per_pixel)
+
+    Returns:
+        int: Количество строк в полосе
+
+    Raises:
+        MemoryError: Изображение не помещается в ограничение даже с полосой в одну строку
+    """
+    width, height = header.size
+    if max_memory is None:
+        return min(512, height)
+
+    pixels = width * height
+    source = bytes_per_pixel(header.mode)
+    draft_bytes = DRAFT_MAX_SIDE ** 2 * (_DRAFT_MATTING_BYTES_PER_PIXEL if alpha_matting
+                                         else _DRAFT_BYTES_PER_PIXEL)
+    # Наложение маски: исходное изображение, результат RGBA и маска копии, сверху - полосы
+    compose = input_bytes + pixels * (source + 4) + DRAFT_MAX_SIDE ** 2
+    strip_bytes = width * (source + _STRIP_BYTES_PER_PIXEL)
+    # Остальные стадии выполняются без полос
+    stages = [
+        compose + strip_bytes,
+        # Уменьшенная копия: JPEG декодируется сразу уменьшенным, остальные форматы - целиком
+        input_bytes + draft_bytes + (0 if header.format == 'JPEG' else pixels * source),
+        # Поворот по EXIF на время копирует исходное изображение
+        input_bytes + pixels * source * (2 if header.transposed else 1),
+        # Кодирование: результат RGBA и буферы кодеров
+        input_bytes + pixels * (4 + encode_bytes_per_pixel),
+    ]
+    required = max(stages)
+    if required > max_memory:
+        raise MemoryError(
+            f"Изображение {width}x{height} требует не меньше {math.ceil(required / 2**20)} МБ, "
+            f"ограничение {max_memory // 2**20} МБ"
+        )
+    return int(min((max_memory - compose) // strip_bytes, height))
+
+
+def draft_decode(data: bytes, max_side: int = DRAFT_MAX_SIDE) -> Image.Image:
+    """
+    Декодирование уменьшенной копии с учетом EXIF-ориентации
+
+    JPEG декодируется сразу в уменьшенном масштабе (1/2, 1/4, 1/8), для
+    остальных форматов изображение уменьшается через Image.reduce
+    """
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    if image.format == 'JPEG':
+        image.draft('RGB', (max(width * max_side // max(width, height), 1),
+                            max(height * max_side // max(width, height), 1)))
+    image.load()
+    # Ориентация читается до уменьшения: reduce и thumbnail не сохраняют EXIF;
+    # без in_place exif_transpose копирует даже неповернутое изображение
+    ImageOps.exif_transpose(image, in_place=True)
+
+    factor = max(image.size) // max_side
+    if factor > 1:
+        image = image.reduce(factor)
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    return image
+
+
+def draft_mask(session, model_name: str, draft: Image.Image, alpha_matting: bool = False,
+               alpha_matting_foreground_threshold: int = 240,
+               alpha_matting_background_threshold: int = 10,
+               alpha_matting_erode_size: int = 10,
+               alpha_matting_fast: bool = False,
+               alpha_matting_scale: float = 0.5) -> Image.Image:
+    """
+    Маска (или альфа-канал после alpha matting) в разрешении уменьшенной копии
+
+    Returns:
+        Image.Image: Маска в режиме L
+    """
+    from batch_inference import cutout, predict_masks, supports_batching
+    from metrics import timer
+
+    with timer('inference'):
+        if supports_batching(model_name):
+            mask = predict_masks(session, [draft], model_name)[0]
+        else:
+            mask = session.predict(draft)[0]
+
+    if not alpha_matting:
+        return mask
+
+    # Alpha matting выполняется на уменьшенной копии, результат
+    # масштабируется вместе с маской
+    with timer('alpha_matting'):
+        matted = cutout(draft, mask, alpha_matting=True,
+                        alpha_matting_foreground_threshold=alpha_matting_foreground_threshold,
+                        alpha_matting_background_threshold=alpha_matting_background_threshold,
+                        alpha_matting_erode_size=alpha_matting_erode_size,
+                        alpha_matting_fast=alpha_matting_fast,
+                        alpha_matting_scale=alpha_matting_scale)
+    return matted.getchannel('A')
+
+
+def compose_strips(image: Image.Image, mask: Image.Image, strip_rows: int) -> Image.Image:
+    """
+    Наложение маски на изображение полосами
+
+    Маска масштабируется до полного размера по частям (resize с box),
+    результат совпадает с наложением маски полного размера, как в rembg.
+
+    Args:
+        image: Исходное изображение полного размера
+        mask: Маска меньшего размера в режиме L
+        strip_rows: Высота полосы
+
+    Returns:
+        Image.Image: Изображение RGBA
+    """
+    width, height = image.size
+    scale_y = mask.height / height
+    result = Image.new('RGBA', image.size, 0)
+
+    for y0 in range(0, height, strip_rows):
+        check_deadline()
+        y1 = min(y0 + strip_rows, height)
+        region = image.crop((0, y0, width, y1)).convert('RGBA')
+        strip_mask = mask.resize((width, y1 - y0), Image.Resampling.LANCZOS,
+                                 box=(0, y0 * scale_y, mask.width, y1 * scale_y))
+        result.paste(Image.composite(region, Image.new('RGBA', region.size, 0), strip_mask), (0, y0))
+        del region, strip_mask
+
+    return result
+
+
+def remove_large(session, model_name: str, data: bytes, output_file: str,
+                 max_memory: Optional[int] = None,
+                 encode: Optional[Callable[[Image.Image, str], None]] = None,
+                 encode_bytes_per_pixel: int = 0, **kwargs) -> Image.Image:
+    """
+    Удаление фона с большого изображения с записью результата в файл
+
+    Args:
+        session: Сессия rembg
+        model_name: Название модели
+        data: Байты входного файла
+        output_file: Выходной файл
+        max_memory: Ограничение памяти в байтах (None - без ограничения)
+        encode: Кодирование результата в файл (None - PNG по умолчанию)
+        encode_bytes_per_pixel: Память кодеров на пиксель результата (см. strip_rows_for)
+        **kwargs: Параметры alpha matting
+
+    Returns:
+        Image.Image: Результат (уже записанный в output_file)
+    """
+    from metrics import timer
+
+    header = probe_header(data)
+    size = header.size
+    strip_rows = strip_rows_for(header, max_memory, kwargs.get('alpha_matting', False),
+                                input_bytes=len(data), encode_bytes_per_pixel=encode_bytes_per_pixel)
+
+    with timer('decode'):
+        draft = draft_decode(data)
+    logger.debug(f"Большое изображение {size[0]}x{size[1]}: маска по копии "
+                 f"{draft.width}x{draft.height}, полосы по {strip_rows} строк")
+
+    mask = draft_mask(session, model_name, draft, **kwargs)
+    del draft
+    check_deadline()
+
+    with timer('decode'):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        # Без in_place exif_transpose копирует даже неповернутое изображение
+        ImageOps.exif_transpose(image, in_place=True)
+
+    with timer('cutout'):
+        result = compose_strips(image, mask, strip_rows)
+    del image
+
+    from outputs import atomic_output
+
+    with atomic_output(output_file) as tmp_name:
+        if encode is not None:
+            encode(result, tmp_name)
+        else:
+            with timer('encode'):
+                result.save(tmp_name, 'PNG')
+    return result
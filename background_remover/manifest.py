@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Манифест инкрементальной обработки
+Хранит в выходной директории сведения об уже обработанных файлах (путь, mtime,
+размер, выходной файл, параметры), чтобы повторный или прерванный проход
+обрабатывал только новые и изменившиеся изображения
+"""
+
+import os
+import json
+import logging
+import tempfile
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = ".bg-remove-manifest.jsonl"
+
+
+class Manifest:
+    """Манифест в формате JSON Lines: одна строка на обработанный файл"""
+
+    def __init__(self, output_dir: str, params: dict):
+        """
+        Инициализация манифеста
+
+        Args:
+            output_dir: Выходная директория, в которой хранится манифест
+            params: Параметры обработки; записи с другими параметрами
+                считаются устаревшими
+        """
+        self.path = Path(output_dir) / MANIFEST_NAME
+        self.params = params
+        self.skipped = 0
+        self._fd = None
+        self._entries: Optional[Dict[str, dict]] = None
+
+    def __getstate__(self):
+        # Дескриптор файла не передается в другие процессы, каждый
+        # процесс открывает манифест на дозапись сам
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_entries'] = None
+        return state
+
+    def load(self) -> Dict[str, dict]:
+        """Чтение манифеста: последняя запись для каждого входного файла"""
+        entries: Dict[str, dict] = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Строка могла оборваться при аварийном завершении
+                        continue
+                    entries[entry['input']] = entry
+        except FileNotFoundError:
+            pass
+        self._entries = entries
+        return entries
+
+    def is_current(self, input_file: str, output_file: str) -> bool:
+        """
+        Проверка, что файл уже обработан с теми же параметрами и не менялся
+
+        Args:
+            input_file: Входной файл
+            output_file: Ожидаемый выходной файл
+        """
+        if self._entries is None:
+            self.load()
+
+        entry = self._entries.get(os.path.abspath(input_file))
+        if entry is None:
+            return False
+        if entry['output'] != os.path.abspath(output_file) or entry['params'] != self.params:
+            return False
+
+        try:
+            input_stat = os.stat(input_file)
+            output_stat = os.stat(output_file)
+        except FileNotFoundError:
+            return False
+
+        return (input_stat.st_mtime_ns == entry['mtime_ns']
+                and input_stat.st_size == entry['size']
+                and output_stat.st_mtime_ns >= input_stat.st_mtime_ns)
+
+    def iter_pending(self, tasks: Iterable[Tuple[str, str]],
+                     on_skip: Optional[Callable[[], None]] = None) -> Iterator[Tuple[str, str]]:
+        """
+        Отбор задач, которые еще нужно выполнить; количество пропущенных
+        задач накапливается в атрибуте skipped
+
+        Args:
+            tasks: Пары (входной файл, выходной файл)
+            on_skip: Вызывается для каждой пропущенной задачи
+        """
+        for input_file, output_file in tasks:
+            if self.is_current(input_file, output_file):
+                self.skipped += 1
+                if on_skip is not None:
+                    on_skip()
+            else:
+                yield input_file, output_file
+
+    def record(self, input_file: str, output_file: str) -> None:
+        """Запись об успешно обработанном файле"""
+        try:
+            stat = os.stat(input_file)
+        except OSError as e:
+            logger.warning(f"Не удалось записать в манифест {input_file}: {e}")
+            return
+        entry = {
+            'input': os.path.abspath(input_file),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'output': os.path.abspath(output_file),
+            'params': self.params,
+        }
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+
+        # Одна запись O_APPEND на строку: строки от нескольких процессов
+        # не перемешиваются, а прерванный проход теряет не больше одной строки
+        if self._fd is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._fd = os.open(str(self.path), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, line)
+
+    def compact(self) -> None:
+        """Перезапись манифеста без устаревших дубликатов"""
+        self.close()
+        entries = self.load()
+        if not entries:
+            return
+
+        fd, tmp_name = tempfile.mkstemp(dir=str(self.path.parent), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                for entry in entries.values():
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_name, self.path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+    def close(self) -> None:
+        """Закрытие файла манифеста"""
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Метрики обработки: длительность стадий и счетчики
+Стадии (чтение, декодирование, получение сессии, инференс, alpha matting,
+кодирование, запись) замеряются в горячем пути и накапливаются в гистограммах.
+Наружу метрики отдаются через подключаемые приемники (файл JSON Lines) или
+в текстовом формате Prometheus (эндпоинт /metrics в режиме сервера)
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в секундах
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Префикс имен метрик в формате Prometheus
+PROMETHEUS_PREFIX = "bg_remove"
+
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами"""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class JsonLinesSink:
+    """Приемник, записывающий каждое событие строкой JSON в файл"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Файл для дозаписи; несколько процессов могут писать в один файл
+        """
+        self.path = path
+        self._fd = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        return state
+
+    def handle(self, event: dict) -> None:
+        line = (json.dumps(event, ensure_ascii=False) + "\n").encode('utf-8')
+        # Одна запись O_APPEND на событие, как в манифесте: строки от
+        # нескольких процессов и потоков не перемешиваются
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, line)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Metrics:
+    """Реестр метрик процесса"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Histogram] = {}
+        self._counters: Dict[str, float] = {}
+        self._sinks: List = []
+
+    @property
+    def sinks(self) -> List:
+        """Подключенные приемники"""
+        return list(self._sinks)
+
+    def add_sink(self, sink) -> None:
+        """Подключение приемника событий (объект с методами handle и close)"""
+        with self._lock:
+            self._sinks.append(sink)
+
+    def close_sinks(self) -> None:
+        """Запись итоговой сводки и отключение приемников"""
+        if not self._sinks:
+            return
+        self._emit({"type": "summary", **self.snapshot()})
+        with self._lock:
+            sinks, self._sinks = self._sinks, []
+        for sink in sinks:
+            sink.close()
+
+    def _emit(self, event: dict) -> None:
+        if not self._sinks:
+            return
+        event = dict(event, ts=time.time(), pid=os.getpid())
+        for sink in list(self._sinks):
+            try:
+                sink.handle(event)
+            except Exception as e:
+                # Сбой выгрузки метрик не должен прерывать обработку
+                logger.warning(f"Не удалось записать метрику: {e}")
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Запись длительности стадии"""
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+        self._emit({"type": "timing", "stage": stage, "seconds": round(seconds, 6)})
+
+    def inc(self, name: str, value: float = 1) -> None:
+        """Увеличение счетчика"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        self._emit({"type": "counter", "name": name, "value": value})
+
+    @contextmanager
+    def timer(self, stage: str) -> Iterator[None]:
+        """Замер длительности блока кода как стадии stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def snapshot(self) -> dict:
+        """Текущие значения: для стадий - количество, сумма и среднее в секундах"""
+        with self._lock:
+            return {
+                "stages": {
+                    stage: {
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "mean": round(h.sum / h.count, 6) if h.count else 0.0,
+                    }
+                    for stage, h in self._histograms.items()
+                },
+                "counters": dict(self._counters),
+            }
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus"""
+        name = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        lines = [
+            f"# HELP {name} Длительность стадий обработки",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {h.count}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {h.count}')
+
+            for counter, value in sorted(self._counters.items()):
+                counter_name = f"{PROMETHEUS_PREFIX}_{counter}_total"
+                lines.append(f"# TYPE {counter_name} counter")
+                lines.append(f"{counter_name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        """Сброс накопленных значений"""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+# Реестр метрик процесса
+metrics = Metrics()
+
+
+def timer(stage: str):
+    """Замер стадии в реестре процесса"""
+    return metrics.timer(stage)
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Увеличение счетчика в реестре процесса"""
+    metrics.inc(name, value)
+
+
+@contextmanager
+def profiling(path: Optional[str]) -> Iterator[None]:
+    """
+    Профилирование блока через cProfile с сохранением статистики в path
+
+    Профилируется только текущий поток; для пулов потоков и процессов
+    удобнее подключиться к работающему процессу через py-spy.
+
+    Args:
+        path: Файл для статистики (None - без профилирования)
+    """
+    if path is None:
+        yield
+        return
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        logger.info(f"Профиль сохранен: {path} (просмотр: python -m pstats {path})")
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Локальный кэш моделей для работы без сети
+Модели скачиваются заранее (bg-remove models prefetch, при сборке
+Docker-образа), проверяются (bg-remove models verify), а в офлайн-режиме
+отсутствующая модель сразу дает понятную ошибку вместо попытки скачивания
+"""
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Корень кэша: модели rembg и варианты пониженной точности лежат в models/<модель>/
+HOME_ENV = "BG_REMOVE_HOME"
+DEFAULT_HOME = "~/.bg-remove"
+
+# Запрет скачивания моделей
+OFFLINE_ENV = "BG_REMOVE_OFFLINE"
+
+# Контрольные суммы, записанные при prefetch
+CHECKSUMS_FILE = "checksums.json"
+
+
+def configure(model_dir: Optional[str] = None, offline: Optional[bool] = None) -> None:
+    """
+    Настройка кэша для процесса и его дочерних процессов (через окружение)
+
+    Args:
+        model_dir: Директория кэша; rembg тоже читает и скачивает модели туда
+        offline: Запретить скачивание моделей
+    """
+    if model_dir:
+        model_dir = os.path.abspath(os.path.expanduser(model_dir))
+        os.environ[HOME_ENV] = model_dir
+        # rembg хранит модели в REMBG_HOME/models/<модель>/ - та же раскладка
+        os.environ["REMBG_HOME"] = model_dir
+        os.environ.pop("U2NET_HOME", None)
+    if offline is not None:
+        if offline:
+            os.environ[OFFLINE_ENV] = "1"
+        else:
+            os.environ.pop(OFFLINE_ENV, None)
+
+
+def is_offline() -> bool:
+    """Включен ли офлайн-режим"""
+    return os.getenv(OFFLINE_ENV, "").lower() in ("1", "true", "yes")
+
+
+def models_home() -> Path:
+    """Директория моделей в кэше"""
+    return Path(os.path.expanduser(os.getenv(HOME_ENV, DEFAULT_HOME))) / "models"
+
+
+def model_path(model_name: str) -> Path:
+    """
+    Путь к файлу модели (u2net или вариант u2net:int8), даже если файла еще нет
+
+    Для моделей rembg сначала ищется уже скачанная копия, в том числе
+    в старой раскладке ~/.u2net
+    """
+    from quantization import split_model_name, variant_path
+
+    base, precision = split_model_name(model_name)
+    if precision is not None:
+        return variant_path(base, precision)
+
+    model_class = session_class(base)
+    fname = f"{base}.onnx"
+    if not hasattr(model_class, 'resolve_existing'):
+        # Версии rembg без раскладки по моделям хранят все файлы в u2net_home
+        return Path(model_class.u2net_home()) / fname
+    existing = model_class.resolve_existing(fname)
+    return Path(existing) if existing else Path(model_class.model_dir()) / fname
+
+
+def session_class(base: str):
+    """Класс сессии rembg для модели"""
+    from rembg.sessions import sessions_class
+
+    for model_class in sessions_class:
+        if model_class.name() == base:
+            return model_class
+    raise ValueError(f"Неизвестная модель: {base}")
+
+
+def ensure_local(model_name: str) -> None:
+    """
+    Проверка, что модель уже есть локально (вызывается в офлайн-режиме)
+
+    Raises:
+        FileNotFoundError: Модели нет в кэше
+    """
+    path = model_path(model_name)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Модель {model_name} не найдена в кэше ({path}), а скачивание запрещено "
+            f"({OFFLINE_ENV}); выполните bg-remove models prefetch -m {model_name}"
+        )
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _checksums_file() -> Path:
+    return models_home() / CHECKSUMS_FILE
+
+
+def _load_checksums() -> dict:
+    try:
+        return json.loads(_checksums_file().read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def recorded_models() -> List[str]:
+    """Модели, скачанные через prefetch"""
+    return sorted(_load_checksums())
+
+
+def prefetch(model_names: Iterable[str]) -> List[dict]:
+    """
+    Скачивание моделей rembg в кэш и запись контрольных сумм
+
+    Варианты пониженной точности не скачиваются, а создаются командой
+    bg-remove quantize; здесь для них только записывается контрольная сумма.
+
+    Returns:
+        List[dict]: Для каждой модели - путь, размер или ошибка
+    """
+    if is_offline():
+        raise RuntimeError(f"Скачивание моделей запрещено ({OFFLINE_ENV})")
+
+    checksums = _load_checksums()
+    report = []
+    for model_name in model_names:
+        entry = {"model": model_name}
+        try:
+            if ':' in model_name:
+                path = model_path(model_name)
+                ensure_local(model_name)
+            else:
+                path = Path(session_class(model_name).download_models())
+            checksums[model_name] = _sha256(path)
+            entry.update(path=str(path), size_mb=round(path.stat().st_size / 2**20, 2))
+            logger.info(f"Модель в кэше: {model_name} ({path})")
+        except Exception as e:
+            logger.error(f"Не удалось скачать {model_name}: {e}")
+            entry["error"] = str(e)
+        report.append(entry)
+
+    models_home().mkdir(parents=True, exist_ok=True)
+    _checksums_file().write_text(json.dumps(checksums, indent=2, sort_keys=True) + "\n", encoding='utf-8')
+    return report
+
+
+def verify(model_names: Iterable[str]) -> List[dict]:
+    """
+    Проверка моделей в кэше: файл на месте, контрольная сумма совпадает
+    с записанной при prefetch, модель загружается в onnxruntime
+
+    Returns:
+        List[dict]: Для каждой модели - путь, результат проверки (ok) и ошибка
+    """
+    import onnxruntime as ort
+
+    checksums = _load_checksums()
+    report = []
+    for model_name in model_names:
+        entry = {"model": model_name, "ok": False}
+        try:
+            path = model_path(model_name)
+            entry["path"] = str(path)
+            if not path.exists():
+                raise FileNotFoundError("файл модели отсутствует")
+            expected = checksums.get(model_name)
+            if expected is not None and _sha256(path) != expected:
+                raise ValueError("контрольная сумма не совпадает с записанной при prefetch")
+            entry["checksum"] = "ok" if expected is not None else "not recorded"
+
+            # Без оптимизации графа загрузка быстрее, поврежденный файл все равно не загрузится
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+            entry["ok"] = True
+        except Exception as e:
+            entry["error"] = str(e)
+        report.append(entry)
+    return report
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Общий для процесса реестр ONNX-сессий rembg
+Сессия загружается один раз на ключ (модель + параметры провайдеров и
+сессии) и переиспользуется всеми вызовами в пределах процесса
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Уровни оптимизации графа onnxruntime
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL',
+}
+
+# Короткие названия execution providers
+PROVIDER_NAMES = {
+    'cpu': 'CPUExecutionProvider',
+    'openvino': 'OpenVINOExecutionProvider',
+    'dnnl': 'DnnlExecutionProvider',
+    'cuda': 'CUDAExecutionProvider',
+    'coreml': 'CoreMLExecutionProvider',
+}
+
+
+def available_cores() -> int:
+    """Количество ядер, доступных процессу (с учетом привязки к ядрам)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # macOS и Windows
+        return os.cpu_count() or 1
+
+
+class SessionConfig(NamedTuple):
+    """
+    Параметры ONNX-сессии
+
+    По умолчанию совпадают с настройками onnxruntime: каждая сессия
+    создает потоки на все ядра, поэтому при нескольких воркерах потоки
+    конкурируют за процессор. auto_threads делит ядра между сессиями
+    """
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    graph_optimization: str = 'all'
+    memory_arena: bool = True
+    providers: Tuple[str, ...] = ()
+    auto_threads: bool = False
+
+    def for_workers(self, workers: int = 1, sessions: int = 1) -> "SessionConfig":
+        """
+        Параметры с конкретным числом потоков для auto_threads
+
+        Args:
+            workers: Количество процессов, в каждом из которых будет сессия
+            sessions: Количество сессий, работающих одновременно в одном процессе
+
+        Returns:
+            SessionConfig: Параметры, в которых ядра поровну поделены между
+            сессиями (без auto_threads возвращаются как есть)
+        """
+        if not self.auto_threads:
+            return self
+        threads = max(available_cores() // max(workers * sessions, 1), 1)
+        return self._replace(intra_op_threads=threads, inter_op_threads=1, auto_threads=False)
+
+    def session_options(self):
+        """Объект onnxruntime.SessionOptions"""
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        if self.inter_op_threads > 1:
+            # Потоки между операторами используются только в параллельном режиме
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel, GRAPH_OPTIMIZATION_LEVELS[self.graph_optimization])
+        options.enable_cpu_mem_arena = self.memory_arena
+        return options
+
+    def resolve_providers(self) -> Optional[List[str]]:
+        """
+        Execution providers в порядке предпочтения из установленных
+
+        Returns:
+            Optional[List[str]]: Полные названия провайдеров (CPU всегда
+            последний запасной вариант) или None - выбор rembg
+        """
+        if not self.providers:
+            return None
+
+        import onnxruntime as ort
+
+        available = set(ort.get_available_providers())
+        resolved = []
+        for name in self.providers:
+            provider = PROVIDER_NAMES.get(name, name)
+            if provider in available:
+                resolved.append(provider)
+            else:
+                logger.warning(f"Execution provider недоступен и пропущен: {name}")
+        if PROVIDER_NAMES['cpu'] not in resolved:
+            resolved.append(PROVIDER_NAMES['cpu'])
+        return resolved
+
+    def describe(self) -> dict:
+        """Параметры для отчетов"""
+        return {
+            "intra_op_threads": self.intra_op_threads,
+            "inter_op_threads": self.inter_op_threads,
+            "graph_optimization": self.graph_optimization,
+            "memory_arena": self.memory_arena,
+            "providers": self.resolve_providers() or "default",
+        }
+
+
+def _freeze(value: Any) -> Any:
+    """Приведение параметров провайдеров к хешируемому виду"""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+class SessionRegistry:
+    """Реестр сессий, ключ - название модели и параметры провайдеров"""
+
+    def __init__(self, max_sessions: Optional[int] = None):
+        """
+        Инициализация реестра
+
+        Args:
+            max_sessions: Максимальное число одновременно загруженных сессий
+                (None - без ограничения, при превышении вытесняется самая давняя)
+        """
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name: str, providers: Optional[List[Any]] = None,
+                 config: Optional[SessionConfig] = None) -> Tuple:
+        """Построение ключа реестра"""
+        return (model_name, _freeze(providers), config)
+
+    def get(self, model_name: str = "u2net", providers: Optional[List[Any]] = None,
+            config: Optional[SessionConfig] = None):
+        """
+        Получение сессии, при отсутствии в реестре она создается
+
+        Args:
+            model_name: Название модели
+            providers: Список execution providers onnxruntime, элементы -
+                названия или пары (название, словарь параметров)
+            config: Параметры сессии (потоки, оптимизация графа, арена памяти,
+                провайдеры); None - настройки onnxruntime по умолчанию
+
+        Returns:
+            Сессия rembg
+        """
+        if config is not None:
+            config = config.for_workers()
+        key = self.make_key(model_name, providers, config)
+
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None:
+                self._sessions.move_to_end(key)
+                return session
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Загрузка модели идет вне общей блокировки, чтобы не задерживать
+        # потоки, которым нужны другие, уже загруженные модели
+        with key_lock:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is not None:
+                    return session
+
+            kwargs: Dict[str, Any] = {}
+            if config is not None:
+                kwargs["sess_opts"] = config.session_options()
+                if providers is None:
+                    providers = config.resolve_providers()
+            if providers is not None:
+                kwargs["providers"] = list(providers)
+
+            logger.debug(f"Загрузка модели: {model_name} ({config or 'параметры по умолчанию'})")
+            from model_cache import ensure_local, is_offline
+            if is_offline():
+                # Без сети отсутствующая модель - сразу ошибка, а не зависшее скачивание
+                ensure_local(model_name)
+
+            if ':' in model_name:
+                # Вариант пониженной точности из локального кэша (u2net:int8)
+                from quantization import load_variant_session
+                session = load_variant_session(model_name, kwargs.get("sess_opts"), kwargs.get("providers"))
+            else:
+                # rembg импортируется только при первой загрузке модели: сам
+                # импорт (pymatting, numba, scipy) занимает секунды
+                try:
+                    from rembg import new_session
+                except ImportError as e:
+                    raise ImportError(f"{e}. Установите зависимости: pip install -r requirements.txt")
+                session = new_session(model_name, **kwargs)
+
+            with self._lock:
+                self._sessions[key] = session
+                self._evict_overflow()
+
+        return session
+
+    def _evict_overflow(self):
+        """Вытеснение самых давних сессий при превышении лимита"""
+        if self.max_sessions is None:
+            return
+        while len(self._sessions) > self.max_sessions:
+            key, _ = self._sessions.popitem(last=False)
+            self._key_locks.pop(key, None)
+            logger.debug(f"Сессия вытеснена: {key[0]}")
+
+    def warmup(self, model_names: Iterable[str], run_inference: bool = True, **kwargs) -> None:
+        """
+        Предварительная загрузка моделей
+
+        Args:
+            model_names: Названия моделей
+            run_inference: Выполнить пробный прогон, чтобы onnxruntime
+                выделил буферы до обработки первого изображения
+            **kwargs: Параметры провайдеров и сессии для get
+        """
+        for model_name in model_names:
+            session = self.get(model_name, **kwargs)
+            if run_inference:
+                from PIL import Image
+                session.predict(Image.new("RGB", (64, 64)))
+            logger.info(f"Модель загружена: {model_name}")
+
+    def evict(self, model_name: Optional[str] = None) -> int:
+        """
+        Удаление сессий из реестра
+
+        Args:
+            model_name: Название модели (None - удалить все сессии)
+
+        Returns:
+            int: Количество удаленных сессий
+        """
+        with self._lock:
+            keys = [key for key in self._sessions
+                    if model_name is None or key[0] == model_name]
+            for key in keys:
+                del self._sessions[key]
+                self._key_locks.pop(key, None)
+        return len(keys)
+
+    def loaded_models(self) -> List[str]:
+        """Названия моделей, сессии которых сейчас загружены"""
+        with self._lock:
+            return [key[0] for key in self._sessions]
+
+
+# Реестр по умолчанию, общий для всего процесса
+registry = SessionRegistry()
+
+
+def import_runtime() -> None:
+    """
+    Импорт rembg в текущем потоке
+
+    Если rembg впервые импортируется в потоке пула (при загрузке модели
+    через run_in_executor), процесс зависает при завершении. Сервисы,
+    загружающие модели в пуле потоков, вызывают это заранее в главном потоке.
+    """
+    try:
+        import rembg  # noqa: F401
+    except ImportError as e:
+        raise ImportError(f"{e}. Установите зависимости: pip install -r requirements.txt")
+
+
+def get_session(model_name: str = "u2net", **kwargs):
+    """Получение сессии из реестра процесса"""
+    return registry.get(model_name, **kwargs)
+
+
+def warmup(model_names: Iterable[str], **kwargs) -> None:
+    """Предварительная загрузка моделей в реестр процесса"""
+    registry.warmup(model_names, **kwargs)
+
+
+def evict(model_name: Optional[str] = None) -> int:
+    """Удаление сессий из реестра процесса"""
+    return registry.evict(model_name)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+Кодирование выходных файлов и дополнительные файлы из одного результата
+Уровень сжатия PNG/WEBP, WEBP с потерями или без и палитра задаются
+параметрами кодирования; время кодирования и размер файлов считаются по
+форматам. Маска, вырезанный объект в других форматах и уменьшенные копии
+строятся из уже готового результата в памяти, без повторного инференса и
+без повторного декодирования исходного файла, и кодируются параллельно
+"""
+
+import io
+import os
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from preflight import check_deadline
+
+logger = logging.getLogger(__name__)
+
+# Формат: (формат PIL, расширение)
+VARIANT_FORMATS = {
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp'),
+    'jpg': ('JPEG', '.jpg'),
+}
+
+VARIANT_KINDS = ('cutout', 'mask')
+
+# Параметры PIL для уровней сжатия; для WEBP без потерь quality задает
+# усилие кодера, а не качество
+COMPRESSION_LEVELS = {
+    'fast': {'PNG': {'compress_level': 1}, 'WEBP': {'method': 0, 'quality': 0}, 'JPEG': {}},
+    'default': {'PNG': {}, 'WEBP': {'method': 4, 'quality': 80}, 'JPEG': {}},
+    'best': {'PNG': {'optimize': True}, 'WEBP': {'method': 6, 'quality': 100}, 'JPEG': {'optimize': True}},
+}
+
+
+class EncodeOptions(NamedTuple):
+    """Параметры кодирования выходных файлов"""
+    compression: str = 'default'
+    # Качество WEBP и JPEG с потерями (None - WEBP без потерь, JPEG по умолчанию PIL)
+    quality: Optional[int] = None
+    # Количество цветов палитры (None - полноцветное изображение)
+    palette: Optional[int] = None
+
+    def save_params(self, pil_format: str) -> dict:
+        """Параметры image.save для формата"""
+        params = dict(COMPRESSION_LEVELS[self.compression].get(pil_format, {}))
+        if pil_format == 'WEBP':
+            if self.quality is None:
+                params['lossless'] = True
+            else:
+                # Альфа-канал кодируется без потерь: края объекта не размываются
+                params.update(quality=self.quality, alpha_quality=100)
+        elif pil_format == 'JPEG' and self.quality is not None:
+            params['quality'] = self.quality
+        return params
+
+    def describe(self) -> dict:
+        """Параметры, от которых зависят байты результата (только отличные от умолчания)"""
+        return {name: value for name, value in self._asdict().items()
+                if value != self._field_defaults[name]}
+
+
+class EncodeStats:
+    """Количество файлов, время кодирования и размер результата по форматам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._formats: Dict[str, List[float]] = {}
+
+    def add(self, pil_format: str, seconds: float, size: int, files: int = 1) -> None:
+        with self._lock:
+            entry = self._formats.setdefault(pil_format.lower(), [0, 0.0, 0])
+            entry[0] += files
+            entry[1] += seconds
+            entry[2] += size
+
+    def take(self) -> Dict[str, List[float]]:
+        """Накопленные значения со сбросом (для передачи из воркера)"""
+        with self._lock:
+            formats, self._formats = self._formats, {}
+        return formats
+
+    def merge(self, formats: Dict[str, List[float]]) -> None:
+        for pil_format, (files, seconds, size) in formats.items():
+            self.add(pil_format, seconds, size, files)
+
+    def reset(self) -> None:
+        self.take()
+
+    def report(self) -> Dict[str, dict]:
+        """Сводка: файлов, суммарное и среднее время, суммарный и средний размер"""
+        with self._lock:
+            return {
+                pil_format: {
+                    "files": int(files),
+                    "seconds": round(seconds, 3),
+                    "mean_ms": round(seconds / files * 1000, 2) if files else 0.0,
+                    "bytes": int(size),
+                    "mean_kb": round(size / files / 1024, 1) if files else 0.0,
+                }
+                for pil_format, (files, seconds, size) in sorted(self._formats.items())
+            }
+
+
+# Статистика кодирования процесса
+encode_stats = EncodeStats()
+
+
+@contextmanager
+def atomic_output(output_file: Union[str, Path]) -> Iterator[str]:
+    """
+    Временный файл рядом с выходным, который заменяет его после успешной записи
+
+    Выходной файл либо остается прежним, либо целиком заменяется новым:
+    прерванная запись и одновременная запись из нескольких процессов
+    (повторно выданное задание очереди) не оставляют перемешанный файл.
+    Запись, не успевшая к сроку блока deadline, отменяется.
+
+    Yields:
+        str: Путь временного файла для записи
+    """
+    output_file = Path(output_file)
+    fd, tmp_name = tempfile.mkstemp(dir=str(output_file.parent), prefix=f".{output_file.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_name
+        # Файл, не успевший к сроку (см. preflight.deadline), не заменяет выходной:
+        # обработка уже считается неудачной
+        check_deadline()
+        os.replace(tmp_name, output_file)
+    except BaseException:
+        try:
+            os.unlink(tmp_name)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_file(output_file: Union[str, Path], data: bytes) -> None:
+    """Запись байтов в выходной файл через временный файл (см. atomic_output)"""
+    with atomic_output(output_file) as tmp_name:
+        with open(tmp_name, 'wb') as f:
+            f.write(data)
+
+
+def encode_image(image: Image.Image, pil_format: str, options: Optional[EncodeOptions] = None,
+                 fp: Union[str, BinaryIO, None] = None) -> Optional[bytes]:
+    """
+    Кодирование изображения с учетом параметров сжатия
+
+    Args:
+        image: Изображение (RGBA, L)
+        pil_format: Формат PIL: PNG, WEBP или JPEG
+        options: Параметры кодирования (None - по умолчанию)
+        fp: Файл или файловый объект, в который изображение кодируется
+            напрямую (None - результат возвращается в виде байтов)
+
+    Returns:
+        Optional[bytes]: Закодированное изображение, если fp не задан
+    """
+    from metrics import inc, metrics
+
+    options = options or EncodeOptions()
+    started = time.perf_counter()
+
+    if options.palette and image.mode in ('RGB', 'RGBA'):
+        # FASTOCTREE - единственный встроенный метод, сохраняющий альфа-канал в палитре
+        image = image.quantize(options.palette, method=Image.Quantize.FASTOCTREE)
+        if pil_format != 'PNG':
+            # WEBP и JPEG не хранят палитру, но меньше цветов сжимается лучше
+            image = image.convert('RGBA')
+    if pil_format == 'JPEG' and image.mode in ('RGBA', 'P'):
+        # В JPEG нет прозрачности, объект кладется на белый фон
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    target = io.BytesIO() if fp is None else fp
+    image.save(target, pil_format, **options.save_params(pil_format))
+
+    if fp is None:
+        data = target.getvalue()
+        size = len(data)
+    else:
+        data = None
+        size = os.path.getsize(fp) if isinstance(fp, (str, os.PathLike)) else fp.tell()
+    seconds = time.perf_counter() - started
+
+    metrics.observe('encode', seconds)
+    metrics.observe(f"encode_{pil_format.lower()}", seconds)
+    inc(f"encoded_bytes_{pil_format.lower()}", size)
+    encode_stats.add(pil_format, seconds, size)
+    return data
+
+
+def encode_bytes_per_pixel(pil_format: str, options: Optional[EncodeOptions] = None, mode: str = 'RGBA') -> int:
+    """
+    Память кодирования на пиксель изображения сверх самого изображения
+
+    PNG кодируется потоком прямо из изображения, для WEBP строится копия
+    для libwebp, для JPEG - копия RGBA и белый фон RGB; палитра добавляет
+    квантованную копию (см. encode_image).
+    """
+    options = options or EncodeOptions()
+    extra = 0
+    if options.palette and mode in ('RGB', 'RGBA'):
+        extra += 1 if pil_format == 'PNG' else 1 + 4
+        mode = 'P' if pil_format == 'PNG' else 'RGBA'
+    if pil_format == 'WEBP':
+        # Режимы, кроме RGB и RGBA, перед кодированием переводятся в RGB
+        extra += 4 if mode in ('RGB', 'RGBA') else 4 + 4
+    elif pil_format == 'JPEG' and mode in ('RGBA', 'P'):
+        extra += 4 + 4
+    return extra
+
+
+class OutputVariant(NamedTuple):
+    """Дополнительный выходной файл"""
+    kind: str = 'cutout'
+    format: str = 'png'
+    size: Optional[Tuple[int, int]] = None
+
+    @property
+    def suffix(self) -> str:
+        """Окончание имени файла: _mask, -256x256 и расширение"""
+        name = '_mask' if self.kind == 'mask' else ''
+        if self.size is not None:
+            name += f"-{self.size[0]}x{self.size[1]}"
+        return name + VARIANT_FORMATS[self.format][1]
+
+    def __str__(self) -> str:
+        parts = [self.kind, self.format]
+        if self.size is not None:
+            parts.append(f"{self.size[0]}x{self.size[1]}")
+        return ':'.join(parts)
+
+
+def parse_variant(value: str) -> OutputVariant:
+    """
+    Разбор описания выходного файла
+
+    Части через двоеточие в любом порядке: вид (cutout, mask), формат
+    (png, webp, jpg) и размер ШИРИНАxВЫСОТА, например mask, webp,
+    cutout:png:256x256
+
+    Raises:
+        ValueError: Неизвестная часть описания
+    """
+    kind, output_format, size = 'cutout', 'png', None
+    for part in value.lower().split(':'):
+        if part in VARIANT_KINDS:
+            kind = part
+        elif part in VARIANT_FORMATS:
+            output_format = part
+        elif 'x' in part:
+            try:
+                width, height = (int(side) for side in part.split('x'))
+            except ValueError:
+                raise ValueError(f"Неверный размер в {value}: {part}")
+            if width <= 0 or height <= 0:
+                raise ValueError(f"Неверный размер в {value}: {part}")
+            size = (width, height)
+        else:
+            raise ValueError(f"Неизвестная часть описания выхода {value}: {part}")
+    return OutputVariant(kind, output_format, size)
+
+
+def variant_path(output_file: str, variant: OutputVariant) -> Path:
+    """Путь дополнительного файла рядом с основным результатом"""
+    output_path = Path(output_file)
+    return output_path.with_name(output_path.stem + variant.suffix)
+
+
+def render_variant(cutout: Image.Image, variant: OutputVariant,
+                   options: Optional[EncodeOptions] = None) -> bytes:
+    """
+    Построение и кодирование одного дополнительного файла
+
+    Args:
+        cutout: Результат удаления фона (RGBA)
+        variant: Описание файла
+        options: Параметры кодирования
+
+    Returns:
+        bytes: Закодированный файл
+    """
+    image = cutout.getchannel('A') if variant.kind == 'mask' else cutout
+    if variant.size is not None:
+        # Пропорции сохраняются, изображение вписывается в заданный размер
+        image = ImageOps.contain(image, variant.size, Image.Resampling.LANCZOS)
+
+    pil_format, _ = VARIANT_FORMATS[variant.format]
+    return encode_image(image, pil_format, options)
+
+
+class VariantWriter:
+    """Параллельное кодирование и запись основного и дополнительных файлов"""
+
+    def __init__(self, variants: Iterable[OutputVariant], threads: int = 4,
+                 output_format: str = 'png', options: Optional[EncodeOptions] = None):
+        """
+        Args:
+            variants: Дополнительные файлы для каждого результата
+            threads: Количество потоков кодирования
+            output_format: Формат основного файла (png, webp)
+            options: Параметры кодирования всех файлов
+        """
+        self.output_format = output_format
+        self.options = options or EncodeOptions()
+        # Вырезанный объект в формате основного файла без изменения размера - это и есть основной файл
+        self.variants: List[OutputVariant] = [
+            variant for variant in dict.fromkeys(variants) if variant != OutputVariant(format=output_format)
+        ]
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Пул создается при первой записи, в том числе из нескольких потоков сразу
+        self._executor_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_executor'] = None
+        del state['_executor_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._executor_lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.variants)
+
+    @property
+    def pil_format(self) -> str:
+        """Формат PIL основного файла"""
+        return VARIANT_FORMATS[self.output_format][0]
+
+    @property
+    def suffix(self) -> str:
+        """Расширение основного файла"""
+        return VARIANT_FORMATS[self.output_format][1]
+
+    def encode(self, image: Image.Image, fp=None) -> Optional[bytes]:
+        """Кодирование основного файла (в fp или в байты)"""
+        return encode_image(image, self.pil_format, self.options, fp)
+
+    def encode_bytes_per_pixel(self) -> int:
+        """
+        Память на пиксель результата при записи основного и дополнительных
+        файлов сверх самого результата (с запасом: файлы кодируются одновременно)
+        """
+        total = encode_bytes_per_pixel(self.pil_format, self.options)
+        for variant in self.variants:
+            pil_format = VARIANT_FORMATS[variant.format][0]
+            if variant.kind == 'mask':
+                # Альфа-канал полного размера; уменьшенная маска кодируется из маленькой копии
+                total += 1 + (encode_bytes_per_pixel(pil_format, self.options, 'L') if variant.size is None else 0)
+            elif variant.size is None:
+                total += encode_bytes_per_pixel(pil_format, self.options)
+        return total
+
+    def map(self, func, *iterables) -> Iterable:
+        """Выполнение func в пуле потоков кодирования"""
+        return self._pool().map(func, *iterables)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix="variant-encode")
+            return self._executor
+
+    def write(self, cutout: Image.Image, output_file: str, primary: bool = True) -> Optional[bytes]:
+        """
+        Запись основного результата и дополнительных файлов
+
+        Все файлы кодируются одновременно в пуле потоков (кодеры PIL
+        отпускают GIL).
+
+        Args:
+            cutout: Результат удаления фона (RGBA)
+            output_file: Основной выходной файл, рядом с ним пишутся остальные
+            primary: Кодировать основной файл (False - он уже записан)
+
+        Returns:
+            Optional[bytes]: Закодированный основной файл (для кэша)
+        """
+        from metrics import timer
+
+        pool = self._pool()
+        primary_future = pool.submit(self.encode, cutout) if primary else None
+        futures: Dict[OutputVariant, object] = {
+            variant: pool.submit(render_variant, cutout, variant, self.options) for variant in self.variants
+        }
+
+        primary_data = None
+        if primary_future is not None:
+            primary_data = primary_future.result()
+            with timer('write'):
+                write_file(output_file, primary_data)
+
+        for variant, future in futures.items():
+            data = future.result()
+            with timer('write'):
+                write_file(variant_path(output_file, variant), data)
+        return primary_data
+
+    def close(self) -> None:
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Параллельная обработка изображений в пуле процессов
+Каждый процесс держит собственную сессию модели, файлы раздаются пачками
+"""
+
+import logging
+import itertools
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List, Optional, Tuple
+
+from tqdm import tqdm
+
+from metrics import metrics
+from outputs import encode_stats
+
+logger = logging.getLogger(__name__)
+
+# Экземпляр BackgroundRemover, принадлежащий процессу-воркеру
+_worker_remover = None
+
+# Перезапусков сломанного пула подряд, после которых проход прерывается
+MAX_POOL_RESTARTS = 3
+
+
+def _init_worker(model_name: str, cache, remover_options: dict, metrics_sinks):
+    """Инициализация процесса-воркера: загрузка собственной сессии модели"""
+    global _worker_remover
+    from background_remover import BackgroundRemover
+    from metrics import metrics
+
+    # Метрики воркера пишутся в те же приемники, что и у главного процесса;
+    # сводка записывается при штатном завершении воркера
+    for sink in metrics_sinks:
+        metrics.add_sink(sink)
+    if metrics_sinks:
+        multiprocessing.util.Finalize(None, metrics.close_sinks, exitpriority=10)
+
+    _worker_remover = BackgroundRemover(model_name=model_name, cache=cache, **remover_options)
+    _worker_remover.warmup()
+
+
+def _process_chunk(chunk: List[Tuple[str, str]], batch_size: int, manifest,
+                   kwargs: dict) -> Tuple[int, int, dict]:
+    """
+    Обработка пачки файлов в процессе-воркере
+
+    Returns:
+        Tuple[int, int, dict]: Количество обработанных и неудачных файлов
+        и статистика кодирования пачки
+    """
+    processed, failed = _worker_remover.process_files(chunk, batch_size=batch_size, manifest=manifest, **kwargs)
+    return processed, failed, encode_stats.take()
+
+
+def default_chunk_size(batch_size: int = 1) -> int:
+    """Размер пачки: не меньше одного батча модели; общее число файлов
+    заранее неизвестно, поэтому пачки небольшие и раздаются по мере поиска
+    (от числа воркеров размер не зависит: свободный воркер просто берет следующую)"""
+    return max(batch_size, 8)
+
+
+def run_parallel(model_name: str, tasks: Iterable[Tuple[str, str]], workers: int,
+                 chunk_size: Optional[int] = None, batch_size: int = 1,
+                 cache=None, manifest=None, progress_bar: Optional[tqdm] = None,
+                 remover_options: Optional[dict] = None, **kwargs) -> Tuple[int, int]:
+    """
+    Обработка потока файлов в пуле процессов
+
+    Args:
+        model_name: Название модели
+        tasks: Пары (входной файл, выходной файл); читаются по мере
+            освобождения воркеров
+        workers: Количество процессов
+        chunk_size: Размер пачки файлов на одну задачу (None - автоматически)
+        batch_size: Количество изображений в одном вызове модели
+        cache: Кэш результатов (ResultCache), общий для всех воркеров
+        manifest: Манифест (Manifest), в который воркеры дописывают обработанные файлы
+        progress_bar: Прогресс-бар (None - создается внутри)
+        remover_options: Параметры BackgroundRemover в воркерах (см. worker_options)
+        **kwargs: Дополнительные параметры для remove_background
+
+    Returns:
+        Tuple[int, int]: Количество обработанных и неудачных файлов
+    """
+    if chunk_size is None:
+        chunk_size = default_chunk_size(batch_size)
+
+    tasks = iter(tasks)
+    logger.info(f"Запуск {workers} процессов, размер пачки: {chunk_size}")
+
+    processed = 0
+    failed = 0
+
+    own_progress_bar = progress_bar is None
+    if own_progress_bar:
+        progress_bar = tqdm(desc="Удаление фона")
+
+    # fork после импорта onnxruntime и numba наследует их пулы потоков и может
+    # зависнуть при завершении, поэтому воркеры запускаются через spawn
+    context = multiprocessing.get_context("spawn")
+
+    def start_pool() -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                   initializer=_init_worker,
+                                   initargs=(model_name, cache, remover_options or {},
+                                             metrics.sinks))
+
+    executor = start_pool()
+    # В работе держится не больше двух пачек на воркер, остальные
+    # файлы еще не прочитаны из генератора
+    max_in_flight = workers * 2
+    futures = {}
+    exhausted = False
+    # Пачка, которую не удалось отправить в сломанный пул
+    unsent = None
+    # Перезапуски пула подряд без единой завершенной пачки
+    restarts = 0
+
+    try:
+        while futures or unsent or not exhausted:
+            broken = False
+            while unsent or (not exhausted and len(futures) < max_in_flight):
+                chunk = unsent or list(itertools.islice(tasks, chunk_size))
+                unsent = None
+                if not chunk:
+                    exhausted = True
+                    break
+                try:
+                    futures[executor.submit(_process_chunk, chunk, batch_size, manifest, kwargs)] = chunk
+                except BrokenProcessPool:
+                    unsent = chunk
+                    broken = True
+                    break
+
+            if not broken:
+                if not futures:
+                    break
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = futures.pop(future)
+                    try:
+                        chunk_processed, chunk_failed, chunk_encoding = future.result()
+                        encode_stats.merge(chunk_encoding)
+                        restarts = 0
+                    except BrokenProcessPool as e:
+                        logger.error(f"Процесс-воркер аварийно завершился: {e}")
+                        broken = True
+                        chunk_processed, chunk_failed = 0, len(chunk)
+                    except Exception as e:
+                        # Падение воркера не прерывает проход, файлы пачки считаются неудачными
+                        logger.error(f"Ошибка воркера на пачке из {len(chunk)} файлов: {e}")
+                        chunk_processed, chunk_failed = 0, len(chunk)
+                    processed += chunk_processed
+                    failed += chunk_failed
+                    progress_bar.update(len(chunk))
+
+            if broken:
+                # Гибель процесса (OOM, segfault) ломает весь пул: пачки, которые
+                # в нем выполнялись, считаются неудачными, а проход продолжается
+                # в новом пуле
+                lost = sum(len(chunk) for chunk in futures.values())
+                if lost:
+                    logger.error(f"Пул процессов сломан, неудачными считаются еще {lost} файлов в работе")
+                failed += lost
+                progress_bar.update(lost)
+                futures.clear()
+                executor.shutdown(wait=True)
+                restarts += 1
+                if restarts > MAX_POOL_RESTARTS:
+                    # Воркеры падают сразу после запуска (например, при загрузке модели)
+                    raise RuntimeError(f"Пул процессов сломан {restarts} раз подряд без обработанных пачек")
+                logger.warning("Перезапуск пула процессов")
+                executor = start_pool()
+    finally:
+        executor.shutdown(wait=True)
+        if own_progress_bar:
+            progress_bar.close()
+
+    return processed, failed
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Конвейерная обработка изображений: чтение/декодирование -> инференс -> кодирование/запись
+Стадии ввода-вывода работают в пулах потоков (PIL и файловые операции
+отпускают GIL) и связаны ограниченными очередями, поэтому память не растет
+с размером директории, а сессия onnxruntime не простаивает
+"""
+
+import io
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import Iterable, Optional, Tuple
+
+from PIL import Image
+from tqdm import tqdm
+
+from metrics import inc, timer
+from preflight import FileTimeoutError, deadline
+
+logger = logging.getLogger(__name__)
+
+# Признак окончания входного потока
+_END = object()
+
+
+def _decode(remover, input_file: str, output_file: str, params: dict, cancel: threading.Event):
+    """
+    Чтение и декодирование изображения
+
+    Выполняется в потоке декодирования с ограничением file_timeout; если
+    конвейер перестал ждать файл раньше (cancel), запись результата
+    большого изображения или результата из кэша отменяется.
+
+    Returns:
+        Пара (изображение, ключ кэша); изображение равно None, если результат
+        уже записан (найден в кэше или большое изображение обработано полосами)
+    """
+    with deadline(remover.file_timeout, cancel):
+        with timer('read'), open(input_file, 'rb') as f:
+            data = f.read()
+
+        key = remover.cache_key(data, **params)
+        cached = remover._cached_result(key)
+        if cached is not None:
+            remover._write_cached(cached, output_file)
+            logger.info(f"Результат взят из кэша: {input_file}")
+            return None, key
+
+        if remover._is_large(data):
+            # Большое изображение обрабатывается полосами прямо в потоке
+            # декодирования и в батч не попадает; потоки декодирования
+            # обрабатывают большие изображения по очереди (см. _remove_large)
+            remover._remove_large(data, output_file, key, **params)
+            logger.info(f"Сохранено: {output_file}")
+            return None, key
+
+        with timer('decode'):
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        return image, key
+
+
+def _encode(remover, image: Image.Image, output_file: str, key: Optional[str]) -> None:
+    """Кодирование результата в PNG (и дополнительные файлы), запись на диск и в кэш"""
+    with deadline(remover.file_timeout):
+        remover._write_result(image, output_file, key)
+
+
+def run_pipeline(remover, tasks: Iterable[Tuple[str, str]], io_threads: int = 4,
+                 queue_size: Optional[int] = None, batch_size: int = 1,
+                 progress_bar: Optional[tqdm] = None, manifest=None, **kwargs) -> Tuple[int, int]:
+    """
+    Конвейерная обработка списка файлов
+
+    Args:
+        remover: Экземпляр BackgroundRemover, выполняющий инференс
+        tasks: Пары (входной файл, выходной файл)
+        io_threads: Количество потоков в стадиях декодирования и кодирования
+        queue_size: Максимум изображений, ожидающих инференса или записи
+            (None - четыре на поток, но не меньше двух батчей)
+        batch_size: Количество изображений в одном вызове модели
+        progress_bar: Прогресс-бар (None - создается внутри)
+        manifest: Манифест (Manifest) для записи обработанных файлов
+        **kwargs: Дополнительные параметры для remove
+
+    Returns:
+        Tuple[int, int]: Количество обработанных и неудачных файлов
+    """
+    if queue_size is None:
+        queue_size = max(io_threads * 4, batch_size * 2)
+
+    decoded: "queue.Queue" = queue.Queue(maxsize=queue_size)
+    encode_slots = threading.BoundedSemaphore(queue_size)
+    stop = threading.Event()
+    lock = threading.Lock()
+    counters = {"processed": 0, "failed": 0}
+
+    own_progress_bar = progress_bar is None
+    if own_progress_bar:
+        progress_bar = tqdm(desc="Удаление фона")
+
+    def finish(input_file: str, output_file: str, error: Optional[BaseException]):
+        with lock:
+            if error is None:
+                counters["processed"] += 1
+                if manifest is not None:
+                    manifest.record(input_file, output_file)
+            else:
+                counters["failed"] += 1
+                logger.error(f"Ошибка при обработке {input_file}: {error}")
+        inc('images_processed' if error is None else 'images_failed')
+        progress_bar.update(1)
+
+    def feed(decode_pool: ThreadPoolExecutor):
+        # Очередь хранит futures в исходном порядке, ее размер ограничивает
+        # число изображений, декодированных впрок
+        try:
+            for input_file, output_file in tasks:
+                if stop.is_set():
+                    break
+                cancel = threading.Event()
+                future = decode_pool.submit(_decode, remover, input_file, output_file, kwargs, cancel)
+                decoded.put((input_file, output_file, future, cancel))
+        finally:
+            decoded.put(_END)
+
+    def infer(batch):
+        if batch_size > 1:
+            return remover.remove_backgrounds([image for _, _, image, _ in batch], **kwargs)
+        return [remover.remove(image, **kwargs) for _, _, image, _ in batch]
+
+    def on_encoded(input_file: str, output_file: str):
+        def callback(future):
+            encode_slots.release()
+            error = future.exception()
+            if error is None:
+                logger.info(f"Сохранено: {output_file}")
+            finish(input_file, output_file, error)
+        return callback
+
+    with ThreadPoolExecutor(io_threads, thread_name_prefix="decode") as decode_pool, \
+            ThreadPoolExecutor(io_threads, thread_name_prefix="encode") as encode_pool:
+        feeder = threading.Thread(target=feed, args=(decode_pool,), daemon=True)
+        feeder.start()
+
+        try:
+            exhausted = False
+            while not exhausted:
+                # Сбор батча из уже декодированных изображений
+                batch = []
+                while len(batch) < batch_size:
+                    item = decoded.get()
+                    if item is _END:
+                        exhausted = True
+                        break
+                    input_file, output_file, future, cancel = item
+                    try:
+                        # Зависший файл не задерживает конвейер: поток декодирования
+                        # доработает в фоне без записи результата, а файл считается неудачным
+                        image, key = future.result(timeout=remover.file_timeout)
+                    except FuturesTimeoutError:
+                        future.cancel()
+                        cancel.set()
+                        finish(input_file, output_file,
+                               FileTimeoutError(f"превышено время декодирования ({remover.file_timeout:g} с)"))
+                        continue
+                    except Exception as e:
+                        finish(input_file, output_file, e)
+                        continue
+                    if image is None:
+                        finish(input_file, output_file, None)
+                        continue
+                    logger.info(f"Обработка: {input_file}")
+                    batch.append((input_file, output_file, image, key))
+
+                if not batch:
+                    continue
+
+                try:
+                    with deadline(remover.file_timeout and remover.file_timeout * len(batch)):
+                        results = infer(batch)
+                except Exception as e:
+                    for input_file, output_file, _, _ in batch:
+                        finish(input_file, output_file, e)
+                    continue
+
+                for (input_file, output_file, _, key), result in zip(batch, results):
+                    encode_slots.acquire()
+                    encode_pool.submit(_encode, remover, result, output_file, key).add_done_callback(
+                        on_encoded(input_file, output_file))
+        finally:
+            stop.set()
+            # Освобождение очереди, если инференс прерван исключением
+            while feeder.is_alive():
+                try:
+                    decoded.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            feeder.join()
+
+    if own_progress_bar:
+        progress_bar.close()
+    return counters["processed"], counters["failed"]
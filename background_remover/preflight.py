@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Предварительная проверка файлов перед инференсом
+Заголовки изображений читаются параллельно без декодирования пикселей:
+размер, режим и формат берутся из заголовка, поэтому испорченные,
+обрезанные и слишком большие файлы (decompression bomb) отбрасываются
+с причиной до того, как на них потрачены чтение и инференс
+"""
+
+import os
+import time
+import signal
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# Лимит по умолчанию совпадает с лимитом PIL: больше него PIL сам
+# отказывается декодировать изображение
+DEFAULT_MAX_PIXELS = Image.MAX_IMAGE_PIXELS
+
+# Сколько файлов проверяется впрок, если результаты не сортируются
+PROBE_WINDOW = 256
+
+# Причины отказа
+REJECT_EMPTY = 'empty'
+REJECT_UNREADABLE = 'unreadable'
+REJECT_NOT_IMAGE = 'not_an_image'
+REJECT_CORRUPT = 'corrupt'
+REJECT_BAD_SIZE = 'bad_dimensions'
+REJECT_TOO_LARGE = 'too_large'
+
+
+class FileTimeoutError(Exception):
+    """
+    Превышено время обработки файла
+
+    Не наследуется от TimeoutError (подкласс OSError): PIL перехватывает
+    OSError при чтении файла, и прерывание было бы потеряно
+    """
+
+
+class ProbeResult(NamedTuple):
+    """Результат проверки заголовка файла"""
+    input_file: str
+    output_file: str
+    size: Optional[Tuple[int, int]] = None
+    mode: Optional[str] = None
+    format: Optional[str] = None
+    reason: Optional[str] = None
+    detail: str = ''
+
+    @property
+    def pixels(self) -> int:
+        return self.size[0] * self.size[1] if self.size else 0
+
+
+def probe_file(input_file: str, output_file: str = '',
+               max_pixels: Optional[int] = DEFAULT_MAX_PIXELS) -> ProbeResult:
+    """
+    Проверка файла по заголовку
+
+    Пиксели не декодируются; Image.verify дополнительно проверяет
+    структуру файла там, где это дешево (для PNG - контрольные суммы
+    чанков и наличие конца файла).
+
+    Args:
+        input_file: Входной файл
+        output_file: Выходной файл (передается дальше вместе с результатом)
+        max_pixels: Максимум пикселей (None - без ограничения)
+
+    Returns:
+        ProbeResult: Размер, режим и формат или причина отказа
+    """
+    def reject(reason: str, detail: str = '') -> ProbeResult:
+        return ProbeResult(input_file, output_file, reason=reason, detail=detail)
+
+    try:
+        if os.path.getsize(input_file) == 0:
+            return reject(REJECT_EMPTY)
+        with Image.open(input_file) as image:
+            size, mode, image_format = image.size, image.mode, image.format
+            if size[0] <= 0 or size[1] <= 0:
+                return reject(REJECT_BAD_SIZE, f"{size[0]}x{size[1]}")
+            if max_pixels is not None and size[0] * size[1] > max_pixels:
+                return reject(REJECT_TOO_LARGE, f"{size[0]}x{size[1]}")
+            image.verify()
+    except Image.DecompressionBombError as e:
+        return reject(REJECT_TOO_LARGE, str(e))
+    except UnidentifiedImageError as e:
+        return reject(REJECT_NOT_IMAGE, str(e))
+    except OSError as e:
+        # Ошибки файловой системы несут errno, ошибки PIL (обрезанный файл) - нет
+        return reject(REJECT_UNREADABLE if e.errno is not None else REJECT_CORRUPT, str(e))
+    except Exception as e:
+        # Ошибки разбора заголовка (SyntaxError, ValueError, struct.error) - испорченный файл
+        return reject(REJECT_CORRUPT, str(e) or type(e).__name__)
+    return ProbeResult(input_file, output_file, size, mode, image_format)
+
+
+class Preflight:
+    """Параллельная проверка потока файлов с подсчетом отказов по причинам"""
+
+    def __init__(self, threads: int = 4, max_pixels: Optional[int] = DEFAULT_MAX_PIXELS,
+                 sort_by_size: bool = False, window: int = PROBE_WINDOW):
+        """
+        Args:
+            threads: Количество потоков чтения заголовков
+            max_pixels: Максимум пикселей в изображении (None - без ограничения)
+            sort_by_size: Отдавать файлы от больших к меньшим: крупные файлы
+                не достаются последнему воркеру, а соседние файлы близки по
+                размеру для батчей. Требует проверить все файлы до начала обработки
+            window: Сколько файлов проверяется впрок без сортировки
+        """
+        self.threads = threads
+        self.max_pixels = max_pixels
+        self.sort_by_size = sort_by_size
+        self.window = window
+        self.reasons: Counter = Counter()
+
+    @property
+    def rejected(self) -> int:
+        return sum(self.reasons.values())
+
+    def _check(self, result: ProbeResult, on_reject: Optional[Callable[[], None]]) -> bool:
+        if result.reason is None:
+            return True
+        self.reasons[result.reason] += 1
+        detail = f": {result.detail}" if result.detail else ''
+        logger.warning(f"Файл отклонен ({result.reason}{detail}): {result.input_file}")
+        if on_reject is not None:
+            on_reject()
+        return False
+
+    def probe(self, tasks: Iterable[Tuple[str, str]],
+              on_reject: Optional[Callable[[], None]] = None) -> Iterator[ProbeResult]:
+        """
+        Проверка файлов
+
+        Args:
+            tasks: Пары (входной файл, выходной файл)
+            on_reject: Вызывается для каждого отклоненного файла
+
+        Returns:
+            Iterator[ProbeResult]: Принятые файлы в исходном порядке
+            (или от больших к меньшим при sort_by_size)
+        """
+        with ThreadPoolExecutor(self.threads, thread_name_prefix="preflight") as pool:
+            if self.sort_by_size:
+                accepted = [result for result in pool.map(lambda task: probe_file(*task, self.max_pixels), tasks)
+                            if self._check(result, on_reject)]
+                accepted.sort(key=lambda result: result.pixels, reverse=True)
+                yield from accepted
+                return
+
+            # Ограниченное окно: файлы проверяются впрок, но список всех файлов не строится
+            pending = deque()
+            tasks = iter(tasks)
+            while True:
+                while len(pending) < self.window:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    pending.append(pool.submit(probe_file, *task, self.max_pixels))
+                if not pending:
+                    return
+                result = pending.popleft().result()
+                if self._check(result, on_reject):
+                    yield result
+
+    def filter(self, tasks: Iterable[Tuple[str, str]],
+               on_reject: Optional[Callable[[], None]] = None) -> Iterator[Tuple[str, str]]:
+        """Принятые файлы в виде пар (входной файл, выходной файл)"""
+        for result in self.probe(tasks, on_reject):
+            yield result.input_file, result.output_file
+
+
+# Срок блока deadline в текущем потоке: (момент истечения, секунды, событие отмены)
+_deadline = threading.local()
+
+
+def check_deadline() -> None:
+    """
+    Проверка срока блока deadline в текущем потоке
+
+    Вне главного потока SIGALRM недоступен, и срок соблюдается в точках
+    проверки: перед заменой выходного файла, между полосами большого
+    изображения и между стадиями инференса. Работа, не успевшая к сроку,
+    не оставляет после себя выходного файла и записи в кэше.
+
+    Raises:
+        FileTimeoutError: Время истекло или блок отменен
+    """
+    state = getattr(_deadline, 'state', None)
+    if state is None:
+        return
+    expires, seconds, cancel = state
+    if cancel is not None and cancel.is_set():
+        raise FileTimeoutError("обработка отменена по истечении времени")
+    if expires is not None and time.monotonic() >= expires:
+        raise FileTimeoutError(f"превышено время обработки ({seconds:g} с)")
+
+
+@contextmanager
+def deadline(seconds: Optional[float], cancel: Optional[threading.Event] = None):
+    """
+    Ограничение времени выполнения блока
+
+    В главном потоке на POSIX блок прерывается через SIGALRM: прерывается
+    код на Python, в том числе между блоками декодирования PIL; вызов
+    onnxruntime прерывается после возврата из него. В остальных потоках
+    срок проверяется в точках check_deadline.
+
+    Args:
+        seconds: Ограничение в секундах (None - без ограничения)
+        cancel: Событие, при установке которого блок прерывается в
+            ближайшей точке проверки (время истекло у ожидающей стороны)
+
+    Raises:
+        FileTimeoutError: Время истекло
+    """
+    if not seconds and cancel is None:
+        yield
+        return
+
+    previous = getattr(_deadline, 'state', None)
+    expires = time.monotonic() + seconds if seconds else None
+    if previous is not None:
+        # Вложенный блок не продлевает срок внешнего
+        if previous[0] is not None and (expires is None or previous[0] < expires):
+            expires, seconds = previous[0], previous[1]
+        cancel = cancel or previous[2]
+    _deadline.state = (expires, seconds, cancel)
+    try:
+        if not seconds or not hasattr(signal, 'setitimer') \
+                or threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def on_alarm(signum, frame):
+            raise FileTimeoutError(f"превышено время обработки ({seconds:g} с)")
+
+        previous_handler = signal.signal(signal.SIGALRM, on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, max(expires - time.monotonic(), 1e-3))
+        try:
+            yield
+        finally:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+            if previous is not None and previous[0] is not None:
+                # Таймер внешнего блока продолжает отсчет
+                signal.setitimer(signal.ITIMER_REAL, max(previous[0] - time.monotonic(), 1e-3))
+    finally:
+        _deadline.state = previous
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Варианты моделей пониженной точности: INT8 (динамическое и статическое
+квантование) и FP16
+Варианты создаются из исходной FP32-модели rembg в локальном кэше моделей
+и выбираются по имени вида u2net:int8. Точность варианта проверяется
+сравнением масок с FP32-моделью (IoU и MAE) на наборе изображений
+"""
+
+import os
+import time
+import logging
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from model_cache import models_home, session_class
+
+logger = logging.getLogger(__name__)
+
+# Точность варианта: int8 - динамическое квантование весов, int8-static -
+# квантование весов и активаций с калибровкой, fp16 - половинная точность
+PRECISIONS = ('int8', 'int8-static', 'fp16')
+
+# Сколько изображений используется для калибровки статического квантования
+DEFAULT_CALIBRATION_SIZE = 32
+
+# Порог бинаризации масок при подсчете IoU
+IOU_THRESHOLD = 128
+
+
+def split_model_name(model_name: str) -> Tuple[str, Optional[str]]:
+    """
+    Разбор имени модели вида u2net:int8
+
+    Returns:
+        Tuple[str, Optional[str]]: Исходная модель и точность (None - FP32)
+
+    Raises:
+        ValueError: Неизвестная точность
+    """
+    base, _, precision = model_name.partition(':')
+    if not precision:
+        return base, None
+    if precision not in PRECISIONS:
+        raise ValueError(f"Неизвестная точность {precision} в {model_name} "
+                         f"(доступны: {', '.join(PRECISIONS)})")
+    return base, precision
+
+
+def variant_path(base: str, precision: str) -> Path:
+    """Путь к файлу варианта модели в кэше"""
+    return models_home() / base / f"{base}-{precision}.onnx"
+
+
+def base_model_path(base: str) -> Path:
+    """Путь к исходной FP32-модели rembg (при отсутствии она скачивается)"""
+    return Path(session_class(base).download_models())
+
+
+def load_variant_session(model_name: str, sess_opts=None, providers: Optional[List] = None):
+    """
+    Сессия rembg, работающая на варианте модели пониженной точности
+
+    Предобработка и постобработка берутся из класса сессии исходной модели,
+    меняется только файл модели.
+
+    Raises:
+        FileNotFoundError: Вариант еще не создан
+    """
+    import onnxruntime as ort
+
+    base, precision = split_model_name(model_name)
+    path = variant_path(base, precision)
+    if not path.exists():
+        raise FileNotFoundError(
+            f"Вариант {model_name} не найден ({path}), создайте его: bg-remove quantize -m {base} -p {precision}"
+        )
+
+    model_class = session_class(base)
+    session = model_class.__new__(model_class)
+    session.model_name = base
+    session.inner_session = ort.InferenceSession(
+        str(path),
+        sess_options=sess_opts,
+        providers=providers or ["CPUExecutionProvider"]
+    )
+    return session
+
+
+class _CalibrationReader:
+    """Источник калибровочных данных для quantize_static"""
+
+    def __init__(self, input_name: str, tensors: Iterable[np.ndarray]):
+        self.input_name = input_name
+        self._tensors = iter(tensors)
+
+    def get_next(self) -> Optional[dict]:
+        tensor = next(self._tensors, None)
+        return None if tensor is None else {self.input_name: tensor[None]}
+
+
+def quantize_model(base: str, precision: str, calibration_images: Sequence[Image.Image] = (),
+                   force: bool = False) -> Path:
+    """
+    Создание варианта модели в локальном кэше
+
+    Args:
+        base: Исходная модель rembg
+        precision: Точность (int8, int8-static, fp16)
+        calibration_images: Изображения для калибровки int8-static
+        force: Пересоздать вариант, если он уже есть
+
+    Returns:
+        Path: Файл варианта
+
+    Raises:
+        ValueError: Статическое квантование без изображений или для модели
+            без описания входа
+    """
+    try:
+        import onnx
+    except ImportError:
+        raise ImportError("Для создания вариантов нужен пакет onnx: pip install onnx")
+    from onnxruntime.quantization import QuantFormat, QuantType, quantize_dynamic, quantize_static
+
+    output = variant_path(base, precision)
+    if output.exists() and not force:
+        logger.info(f"Вариант уже есть: {output}")
+        return output
+    output.parent.mkdir(parents=True, exist_ok=True)
+
+    source = base_model_path(base)
+    # Файл пишется под временным именем, чтобы прерванное квантование
+    # не оставило в кэше недописанную модель
+    partial = output.with_suffix('.onnx.partial')
+    started = time.perf_counter()
+
+    try:
+        if precision == 'int8':
+            quantize_dynamic(str(source), str(partial), weight_type=QuantType.QUInt8)
+        elif precision == 'int8-static':
+            from batch_inference import MODEL_INPUT_SPECS, preprocess
+
+            if base not in MODEL_INPUT_SPECS:
+                raise ValueError(f"Статическое квантование недоступно для {base}: нет описания входа модели")
+            if not calibration_images:
+                raise ValueError("Для статического квантования нужны калибровочные изображения")
+            spec = MODEL_INPUT_SPECS[base]
+            input_name = onnx.load(str(source), load_external_data=False).graph.input[0].name
+            # Тензоры готовятся по одному: для моделей 1024x1024 весь набор занял бы сотни МБ
+            reader = _CalibrationReader(input_name, (preprocess(image, spec) for image in calibration_images))
+            quantize_static(str(source), str(partial), reader, quant_format=QuantFormat.QDQ,
+                            per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        elif precision == 'fp16':
+            from onnxruntime.transformers.float16 import convert_float_to_float16
+
+            # Вход и выход остаются FP32, поэтому предобработка не меняется
+            model = convert_float_to_float16(onnx.load(str(source)), keep_io_types=True)
+            onnx.save(model, str(partial))
+        else:
+            raise ValueError(f"Неизвестная точность: {precision}")
+
+        os.replace(partial, output)
+    except BaseException:
+        # Ошибка конвертации или прерывание не оставляют недописанный файл
+        partial.unlink(missing_ok=True)
+        raise
+    logger.info(f"Создан вариант {base}:{precision} за {time.perf_counter() - started:.1f} с: {output} "
+                f"({source.stat().st_size / 2**20:.1f} МБ -> {output.stat().st_size / 2**20:.1f} МБ)")
+    return output
+
+
+def _predict_mask(session, model_name: str, image: Image.Image) -> np.ndarray:
+    """Маска модели в виде массива uint8"""
+    from batch_inference import predict_masks, supports_batching
+
+    if supports_batching(model_name):
+        return np.asarray(predict_masks(session, [image], model_name)[0])
+    return np.asarray(session.predict(image)[0])
+
+
+def _timed_masks(session, model_name: str, images: Sequence[Image.Image]) -> Iterator[Tuple[np.ndarray, float]]:
+    for image in images:
+        start = time.perf_counter()
+        mask = _predict_mask(session, model_name, image)
+        yield mask, time.perf_counter() - start
+
+
+def compare_accuracy(model_name: str, images: Sequence[Image.Image], sess_opts=None) -> dict:
+    """
+    Сравнение масок варианта с исходной FP32-моделью
+
+    Args:
+        model_name: Вариант модели, например u2net:int8
+        images: Изображения для сравнения
+        sess_opts: onnxruntime.SessionOptions для обеих сессий
+
+    Returns:
+        dict: IoU масок (порог 128) - среднее и минимум, средняя абсолютная
+        ошибка маски в долях от 255, время инференса и ускорение
+    """
+    from rembg import new_session
+
+    base, _ = split_model_name(model_name)
+    reference = new_session(base, sess_opts=sess_opts, providers=["CPUExecutionProvider"])
+    variant = load_variant_session(model_name, sess_opts)
+
+    # Прогрев, чтобы в замер не попало выделение буферов
+    _predict_mask(reference, base, images[0])
+    _predict_mask(variant, base, images[0])
+
+    ious, errors = [], []
+    reference_seconds = variant_seconds = 0.0
+    for (expected, t_ref), (actual, t_var) in zip(_timed_masks(reference, base, images),
+                                                  _timed_masks(variant, base, images)):
+        reference_seconds += t_ref
+        variant_seconds += t_var
+        expected_fg = expected >= IOU_THRESHOLD
+        actual_fg = actual >= IOU_THRESHOLD
+        union = np.logical_or(expected_fg, actual_fg).sum()
+        ious.append(np.logical_and(expected_fg, actual_fg).sum() / union if union else 1.0)
+        errors.append(np.abs(expected.astype(np.int16) - actual.astype(np.int16)).mean() / 255)
+
+    return {
+        "model": model_name,
+        "images": len(ious),
+        "iou_mean": round(float(np.mean(ious)), 5),
+        "iou_min": round(float(np.min(ious)), 5),
+        "mae": round(float(np.mean(errors)), 5),
+        "reference_seconds": round(reference_seconds, 3),
+        "variant_seconds": round(variant_seconds, 3),
+        "speedup": round(reference_seconds / variant_seconds, 2) if variant_seconds > 0 else None,
+        "size_mb": round(variant_path(*split_model_name(model_name)).stat().st_size / 2**20, 2),
+    }
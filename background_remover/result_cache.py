@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Кэш результатов удаления фона на диске
+Ключ - хеш содержимого входного файла вместе с моделью и параметрами обработки,
+поэтому повторные проходы по неизменившимся изображениям не запускают инференс
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Доля лимита, до которой кэш сокращается при вытеснении
+_EVICT_TARGET = 0.9
+
+
+def content_key(data: bytes, **params) -> str:
+    """
+    Ключ кэша: хеш содержимого и параметров обработки
+
+    Args:
+        data: Байты входного файла
+        **params: Модель и параметры, влияющие на результат
+
+    Returns:
+        str: Шестнадцатеричный ключ
+    """
+    digest = hashlib.blake2b(data, digest_size=20)
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Кэш результатов с LRU-вытеснением по суммарному размеру"""
+
+    def __init__(self, cache_dir: str, max_bytes: Optional[int] = None,
+                 use_sqlite: bool = False):
+        """
+        Инициализация кэша
+
+        Args:
+            cache_dir: Директория кэша
+            max_bytes: Максимальный суммарный размер записей (None - без ограничения)
+            use_sqlite: Вести индекс записей в sqlite, чтобы вытеснение не
+                требовало обхода директории
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.use_sqlite = use_sqlite
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._init_state()
+
+    def _init_state(self):
+        self._lock = threading.Lock()
+        self._conn = None
+        self._total_bytes = None
+
+    def __getstate__(self):
+        # Соединение sqlite и блокировки не передаются в другие процессы,
+        # каждый процесс открывает их заново
+        state = self.__dict__.copy()
+        for name in ('_lock', '_conn', '_total_bytes'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.bin"
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.cache_dir / "index.sqlite"), timeout=30,
+                                         check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Получение записи
+
+        Returns:
+            bytes: Сохраненный результат или None, если записи нет
+        """
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        # Время доступа обновляется явно: atime часто отключен на уровне ФС
+        now = time.time()
+        with self._lock:
+            if self.use_sqlite:
+                db = self._db()
+                db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                db.commit()
+            else:
+                try:
+                    os.utime(path, (now, now))
+                except FileNotFoundError:
+                    pass
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Сохранение записи"""
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Запись через временный файл, чтобы параллельные процессы
+        # не прочитали частично записанный результат
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            # Перезапись существующей записи меняет размер кэша только на разницу
+            try:
+                old_size = path.stat().st_size
+            except FileNotFoundError:
+                old_size = 0
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+
+        with self._lock:
+            if self.use_sqlite:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO entries (key, size, last_access) VALUES (?, ?, ?)",
+                           (key, len(data), time.time()))
+                db.commit()
+            elif self._total_bytes is not None:
+                self._total_bytes += len(data) - old_size
+
+        if self.max_bytes is not None and self.size() > self.max_bytes:
+            self.evict()
+
+    def size(self) -> int:
+        """Суммарный размер записей в байтах"""
+        with self._lock:
+            if self.use_sqlite:
+                row = self._db().execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+                return row[0]
+            if self._total_bytes is None:
+                self._total_bytes = sum(path.stat().st_size for path in self.cache_dir.glob("*/*.bin"))
+            return self._total_bytes
+
+    def evict(self, target_bytes: Optional[int] = None) -> int:
+        """
+        Удаление давно использованных записей
+
+        Args:
+            target_bytes: Размер, до которого сокращается кэш
+                (None - 90% от max_bytes)
+
+        Returns:
+            int: Количество удаленных записей
+        """
+        if target_bytes is None:
+            if self.max_bytes is None:
+                return 0
+            target_bytes = int(self.max_bytes * _EVICT_TARGET)
+
+        removed = 0
+        with self._lock:
+            if self.use_sqlite:
+                db = self._db()
+                total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                rows = db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+                for key, size in rows:
+                    if total <= target_bytes:
+                        break
+                    self._path(key).unlink(missing_ok=True)
+                    db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    total -= size
+                    removed += 1
+                db.commit()
+            else:
+                entries = []
+                for path in self.cache_dir.glob("*/*.bin"):
+                    try:
+                        stat = path.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                entries.sort()
+                total = sum(size for _, size, _ in entries)
+                for _, size, path in entries:
+                    if total <= target_bytes:
+                        break
+                    path.unlink(missing_ok=True)
+                    total -= size
+                    removed += 1
+                self._total_bytes = total
+
+        if removed:
+            logger.debug(f"Удалено из кэша записей: {removed}")
+        return removed
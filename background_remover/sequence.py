@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Последовательности кадров и видео
+Нумерованные кадры (frame_0001.png, frame_0002.png, ...) обрабатываются
+по порядку: если кадр почти не отличается от последнего ключевого кадра,
+маска ключевого кадра переиспользуется без инференса, а вырезание (и alpha
+matting) выполняется уже по текущему кадру. Ключевые кадры обрабатываются
+батчами. Видео читается покадрово потоковым декодером PyAV
+"""
+
+import re
+import logging
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from metrics import inc
+
+logger = logging.getLogger(__name__)
+
+# Порог различия кадров: средняя разница яркости (0-255) в самом изменившемся
+# участке уменьшенной копии кадра; шум сжатия JPEG дает около 0.3, сдвиг
+# объекта на 1% ширины кадра - около 1
+DEFAULT_DIFF_THRESHOLD = 1.0
+
+# Максимум кадров подряд с маской ключевого кадра: ограничивает накопление
+# медленных изменений, которые не превышают порог между соседними кадрами
+DEFAULT_KEYFRAME_INTERVAL = 30
+
+# Меньше кадров с общим именем - не последовательность, а отдельные файлы
+MIN_SEQUENCE_LENGTH = 3
+
+# Уменьшенная копия для сравнения кадров и размер участка на ней
+THUMBNAIL_SIZE = (64, 64)
+TILE_SIZE = 8
+
+# Форматы видео, которые читаются покадрово
+VIDEO_FORMATS = {'.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v'}
+
+# Имя кадра: общий префикс и номер в конце
+_FRAME_NAME = re.compile(r'^(.*?)(\d+)$')
+
+
+class SequenceOptions(NamedTuple):
+    """Параметры обработки последовательностей"""
+    diff_threshold: float = DEFAULT_DIFF_THRESHOLD
+    keyframe_interval: int = DEFAULT_KEYFRAME_INTERVAL
+    min_length: int = MIN_SEQUENCE_LENGTH
+
+    def describe(self) -> dict:
+        """Параметры, от которых зависит результат (для манифеста)"""
+        return {"diff_threshold": self.diff_threshold, "keyframe_interval": self.keyframe_interval}
+
+
+def group_sequences(tasks: Iterable[Tuple[str, str]],
+                    min_length: int = MIN_SEQUENCE_LENGTH) -> Tuple[List[List[Tuple[str, str]]], List[Tuple[str, str]]]:
+    """
+    Разделение файлов на последовательности кадров и отдельные файлы
+
+    Кадры одной последовательности лежат в одной директории, имеют общий
+    префикс имени, номер в конце имени и одно расширение.
+
+    Args:
+        tasks: Пары (входной файл, выходной файл)
+        min_length: Минимальное количество кадров в последовательности
+
+    Returns:
+        Tuple: Последовательности (кадры по возрастанию номера) и отдельные
+        файлы в исходном порядке
+    """
+    groups: Dict[tuple, List[Tuple[int, Tuple[str, str]]]] = {}
+    singles = []
+    for task in tasks:
+        path = Path(task[0])
+        match = _FRAME_NAME.match(path.stem)
+        if match is None:
+            singles.append(task)
+            continue
+        key = (str(path.parent), match.group(1), path.suffix.lower())
+        groups.setdefault(key, []).append((int(match.group(2)), task))
+
+    sequences = []
+    for frames in groups.values():
+        if len(frames) < min_length:
+            singles.extend(task for _, task in frames)
+        else:
+            frames.sort(key=lambda frame: frame[0])
+            sequences.append([task for _, task in frames])
+    return sequences, singles
+
+
+def thumbnail(image: Image.Image) -> np.ndarray:
+    """Уменьшенная копия кадра в оттенках серого для сравнения"""
+    small = image.convert('L').resize(THUMBNAIL_SIZE, Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return np.asarray(small, dtype=np.float32)
+
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """
+    Различие кадров: средняя разница яркости в самом изменившемся участке
+
+    Небольшой движущийся объект на неподвижном фоне почти не меняет
+    среднюю разницу по всему кадру, но заметен в своем участке.
+    """
+    height, width = a.shape
+    diff = np.abs(a - b).reshape(height // TILE_SIZE, TILE_SIZE, width // TILE_SIZE, TILE_SIZE)
+    return float(diff.mean(axis=(1, 3)).max())
+
+
+def _import_av():
+    try:
+        import av
+    except ImportError:
+        raise ImportError("Для чтения видео нужен пакет av: pip install av")
+    return av
+
+
+def iter_video_frames(path: str) -> Iterator[Image.Image]:
+    """
+    Кадры видео по одному, без чтения файла целиком
+
+    Raises:
+        ImportError: Не установлен пакет av
+    """
+    with _import_av().open(str(path)) as container:
+        stream = container.streams.video[0]
+        # Декодирование в нескольких потоках, пока идет инференс
+        stream.thread_type = 'AUTO'
+        for frame in container.decode(stream):
+            yield frame.to_image()
+
+
+def video_frame_count(path: str) -> Optional[int]:
+    """
+    Количество кадров из заголовка видео (None, если неизвестно)
+
+    Raises:
+        ImportError: Не установлен пакет av
+    """
+    with _import_av().open(str(path)) as container:
+        return container.streams.video[0].frames or None
+
+
+class SequenceProcessor:
+    """Обработка кадров по порядку с переиспользованием масок ключевых кадров"""
+
+    def __init__(self, options: Optional[SequenceOptions] = None):
+        self.options = options or SequenceOptions()
+        self.frames = 0
+        self.keyframes = 0
+        self.reused = 0
+        self.reset()
+
+    def reset(self) -> None:
+        """Начало новой последовательности: следующий кадр будет ключевым"""
+        self._key_thumbnail = None
+        self._key_size = None
+        self._since_key = 0
+
+    def is_keyframe(self, image: Image.Image) -> bool:
+        """
+        Нужен ли инференс для кадра
+
+        Кадр сравнивается с последним ключевым, а не с предыдущим кадром,
+        чтобы медленные изменения не накапливались незамеченными.
+        """
+        self.frames += 1
+        current = thumbnail(image)
+        if (self._key_thumbnail is not None and image.size == self._key_size
+                and self._since_key < self.options.keyframe_interval
+                and frame_difference(current, self._key_thumbnail) <= self.options.diff_threshold):
+            self._since_key += 1
+            self.reused += 1
+            inc('frames_reused')
+            return False
+        self._key_thumbnail = current
+        self._key_size = image.size
+        self._since_key = 0
+        self.keyframes += 1
+        inc('keyframes')
+        return True
+
+    def run(self, frames: Iterable[Tuple[str, str, Optional[Image.Image]]],
+            predict: Callable[[List[Image.Image]], List[Image.Image]],
+            write: Callable[[Image.Image, Image.Image, str], bool],
+            batch_size: int = 1, map_func=map) -> Iterator[Tuple[str, str, bool]]:
+        """
+        Обработка одной последовательности
+
+        Args:
+            frames: Кадры по порядку: (имя, выходной файл, изображение или
+                None, если кадр не удалось прочитать)
+            predict: Маски для списка ключевых кадров
+            write: Вырезание по маске и запись: (кадр, маска, выходной файл) -> успех
+            batch_size: Количество ключевых кадров в одном вызове модели
+            map_func: map для параллельной записи кадров
+
+        Returns:
+            Iterator[Tuple[str, str, bool]]: Имя, выходной файл и результат
+            для каждого кадра в исходном порядке
+        """
+        self.reset()
+        # Кадры ждут, пока не будут готовы маски их ключевых кадров; индекс -1 -
+        # маска последнего ключевого кадра предыдущей пачки
+        keyframes: List[Image.Image] = []
+        pending: List[Tuple[str, str, Image.Image, int]] = []
+        max_pending = max(batch_size * 4, 8)
+        carry = None
+
+        def flush() -> Iterator[Tuple[str, str, bool]]:
+            nonlocal carry
+            masks = []
+            if keyframes:
+                try:
+                    masks = predict(keyframes)
+                except Exception as e:
+                    logger.error(f"Ошибка при обработке пачки из {len(keyframes)} ключевых кадров: {e}")
+                    masks = None
+                    # Маски нет - следующий кадр снова будет ключевым
+                    self.reset()
+            entries = [(name, output_file, image, carry if index < 0 else (masks[index] if masks else None))
+                       for name, output_file, image, index in pending]
+            if masks is None:
+                carry = None
+            elif masks:
+                carry = masks[-1]
+            keyframes.clear()
+            pending.clear()
+
+            def write_entry(entry) -> bool:
+                name, output_file, image, mask = entry
+                return mask is not None and write(image, mask, output_file)
+
+            for (name, output_file, _, _), success in zip(entries, map_func(write_entry, entries)):
+                yield name, output_file, success
+
+        for name, output_file, image in frames:
+            if image is None:
+                yield name, output_file, False
+                continue
+            if self.is_keyframe(image):
+                keyframes.append(image)
+            pending.append((name, output_file, image, len(keyframes) - 1))
+            if len(keyframes) >= batch_size or len(pending) >= max_pending:
+                yield from flush()
+        yield from flush()
+
+    def report(self) -> dict:
+        """Количество кадров, ключевых кадров и кадров с переиспользованной маской"""
+        return {"frames": self.frames, "keyframes": self.keyframes, "reused": self.reused}
@@ -32,8 +32,14 @@ setup(
     author_email="",
     url="",
     packages=find_packages(),
-    py_modules=["background_remover"],
+    py_modules=["background_remover", "model_sessions", "parallel_engine", "pipeline", "batch_inference", "result_cache", "manifest", "inference_server", "file_scanner", "benchmark", "metrics", "fast_matting", "large_image", "outputs", "quantization", "model_cache", "preflight", "job_queue", "sequence", "async_remover"],
     install_requires=read_requirements(),
+    extras_require={
+        # bg-remove quantize
+        'quantize': ['onnx>=1.14.0'],
+        # Обработка видео: bg-remove clip.mp4 frames/
+        'video': ['av>=10.0'],
+    },
     entry_points={
         'console_scripts': [
             'bg-remove=background_remover:main',
@@ -47,15 +53,12 @@ setup(
         "License :: OSI Approved :: MIT License",
         "Operating System :: OS Independent",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.7",
-        "Programming Language :: Python :: 3.8",
-        "Programming Language :: Python :: 3.9",
-        "Programming Language :: Python :: 3.10",
         "Programming Language :: Python :: 3.11",
         "Topic :: Multimedia :: Graphics :: Graphics Conversion",
         "Topic :: Scientific/Engineering :: Image Processing",
     ],
-    python_requires=">=3.7",
+    # Не ниже, чем у закрепленной версии rembg (requirements.txt)
+    python_requires=">=3.11",
     keywords="background removal, image processing, AI, CLI, rembg",
     project_urls={
         "Bug Reports": "",
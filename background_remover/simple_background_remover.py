@@ -8,9 +8,13 @@ import os
 import sys
 import argparse
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Tuple
 import logging
 
+from model_sessions import get_session, warmup
+from manifest import Manifest
+from file_scanner import ImageScanner
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -18,28 +22,44 @@ logger = logging.getLogger(__name__)
 # Поддерживаемые форматы
 SUPPORTED_FORMATS = {'.png', '.jpg', '.jpeg', '.webp', '.tiff', '.tif', '.bmp'}
 
-def check_dependencies():
-    """Проверка и установка зависимостей"""
-    try:
-        import PIL
-        print("✅ Pillow установлен")
-    except ImportError:
-        print("❌ Pillow не установлен. Устанавливаем...")
-        os.system("pip install Pillow")
+def check_dependencies() -> bool:
+    """
+    Проверка зависимостей без их импорта и без установки
     
-    try:
-        import rembg
-        print("✅ rembg установлен")
-    except ImportError:
-        print("❌ rembg не установлен. Устанавливаем...")
-        os.system("pip install rembg")
+    Returns:
+        bool: True, если все зависимости установлены
+    """
+    import importlib.util
     
-    try:
-        import tqdm
-        print("✅ tqdm установлен")
-    except ImportError:
-        print("❌ tqdm не установлен. Устанавливаем...")
-        os.system("pip install tqdm")
+    missing = []
+    for module, package in (("PIL", "Pillow"), ("rembg", "rembg"), ("onnxruntime", "onnxruntime"), ("tqdm", "tqdm")):
+        if importlib.util.find_spec(module) is not None:
+            print(f"✅ {package} установлен")
+        else:
+            print(f"❌ {package} не установлен")
+            missing.append(package)
+    
+    if missing:
+        print(f"Установите зависимости: pip install {' '.join(missing)}")
+    return not missing
+
+def remove_background_data(data, model: str = "u2net", output_type: Optional[str] = None):
+    """
+    Удаление фона с изображения в памяти
+    
+    Args:
+        data: bytes, bytearray, memoryview, файловый объект, PIL.Image или массив numpy
+        model: Модель для удаления фона
+        output_type: Тип результата ('pil', 'numpy', 'bytes'); по умолчанию
+            тот же, что у data (для буферов и файловых объектов - PNG в bytes)
+        
+    Returns:
+        Результат запрошенного типа
+    """
+    from batch_inference import remove_batch
+    
+    # Сессия берется из общего реестра и загружается один раз на процесс
+    return remove_batch(get_session(model), model, [data], output_type=output_type)[0]
 
 def remove_background_simple(input_path: str, output_path: str, model: str = "u2net") -> bool:
     """
@@ -56,22 +76,10 @@ def remove_background_simple(input_path: str, output_path: str, model: str = "u2
     try:
         logger.info(f"Обработка: {input_path}")
         
-        # Импорт rembg только при необходимости
-        from rembg import remove, new_session
-        
-        # Создание сессии
-        session = new_session(model)
-        
-        # Чтение входного изображения
+        # Декодер читает файл напрямую, PNG кодируется сразу в выходной файл
         with open(input_path, 'rb') as input_file:
-            input_data = input_file.read()
-        
-        # Удаление фона
-        output_data = remove(input_data, session=session)
-        
-        # Сохранение результата
-        with open(output_path, 'wb') as output_file:
-            output_file.write(output_data)
+            result = remove_background_data(input_file, model, output_type='pil')
+        result.save(output_path, "PNG")
         
         logger.info(f"Сохранено: {output_path}")
         return True
@@ -80,8 +88,58 @@ def remove_background_simple(input_path: str, output_path: str, model: str = "u2
         logger.error(f"Ошибка при обработке {input_path}: {e}")
         return False
 
+def remove_background_batch_simple(tasks: List[Tuple[str, str]], model: str = "u2net") -> List[bool]:
+    """
+    Удаление фона с пачки изображений за один вызов модели
+    
+    Args:
+        tasks: Пары (входной файл, выходной файл)
+        model: Модель для удаления фона
+        
+    Returns:
+        List[bool]: Результат для каждого файла
+    """
+    from batch_inference import remove_batch, to_pil
+    
+    results = [False] * len(tasks)
+    
+    # Файлы декодируются по одному, чтобы испорченный файл не ронял всю пачку
+    images = []
+    indices = []
+    for i, (input_file, _) in enumerate(tasks):
+        try:
+            logger.info(f"Обработка: {input_file}")
+            image = to_pil(Path(input_file).read_bytes())
+            image.load()
+            images.append(image)
+            indices.append(i)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке {input_file}: {e}")
+    
+    if not images:
+        return results
+    
+    try:
+        cutouts = remove_batch(get_session(model), model, images)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке пачки из {len(images)} файлов: {e}")
+        return results
+    
+    for i, cutout in zip(indices, cutouts):
+        output_file = tasks[i][1]
+        try:
+            cutout.save(output_file, "PNG")
+            logger.info(f"Сохранено: {output_file}")
+            results[i] = True
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении {output_file}: {e}")
+    
+    return results
+
 def process_directory_simple(input_dir: str, output_dir: str, 
-                           recursive: bool = False, model: str = "u2net") -> dict:
+                           recursive: bool = False, model: str = "u2net",
+                           batch_size: int = 1, incremental: bool = False,
+                           preflight: bool = True) -> dict:
     """
     Обработка всех изображений в директории
     
@@ -90,6 +148,10 @@ def process_directory_simple(input_dir: str, output_dir: str,
         output_dir: Выходная директория
         recursive: Рекурсивный обход поддиректорий
         model: Модель для удаления фона
+        batch_size: Количество изображений в одном вызове модели
+        incremental: Пропускать файлы, уже обработанные с теми же параметрами
+        preflight: Проверить заголовки файлов перед обработкой и отклонить
+            испорченные и слишком большие файлы
         
     Returns:
         dict: Статистика обработки
@@ -103,50 +165,95 @@ def process_directory_simple(input_dir: str, output_dir: str,
     # Создание выходной директории
     output_path.mkdir(parents=True, exist_ok=True)
     
-    # Поиск всех изображений
-    image_files = []
-    if recursive:
-        pattern = "**/*"
-    else:
-        pattern = "*"
-        
-    for file_path in input_path.glob(pattern):
-        if file_path.is_file() and file_path.suffix.lower() in SUPPORTED_FORMATS:
-            image_files.append(file_path)
+    # Поиск всех изображений: тот же обход через os.scandir, что и у основного
+    # CLI (без stat на каждый файл, ссылки на директории не обходятся)
+    image_files = list(ImageScanner(input_path, SUPPORTED_FORMATS, recursive=recursive))
     
     if not image_files:
         logger.warning(f"Изображения не найдены в {input_dir}")
-        return {"processed": 0, "failed": 0, "total": 0}
+        return {"processed": 0, "failed": 0, "skipped": 0, "total": 0}
     
     logger.info(f"Найдено {len(image_files)} изображений для обработки")
     
+    tasks = []
+    for image_file in image_files:
+        # Определение относительного пути для сохранения структуры директорий
+        if recursive:
+            rel_path = image_file.relative_to(input_path)
+            output_file = output_path / rel_path.with_suffix('.png')
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+        else:
+            output_file = output_path / f"{image_file.stem}_nobg.png"
+        tasks.append((str(image_file), str(output_file)))
+    
+    manifest = None
+    skipped = 0
+    if incremental:
+        manifest = Manifest(output_dir, {"model": model, "alpha_matting": False})
+        tasks = list(manifest.iter_pending(tasks))
+        skipped = manifest.skipped
+        logger.info(f"Уже обработано ранее: {skipped}, осталось: {len(tasks)}")
+    
+    reject_reasons = {}
+    if preflight:
+        from preflight import Preflight
+        checker = Preflight(sort_by_size=True)
+        tasks = list(checker.filter(tasks))
+        reject_reasons = dict(checker.reasons)
+    
     # Обработка изображений
     processed = 0
     failed = 0
     
+    if not tasks:
+        return {
+            "processed": processed,
+            "failed": failed,
+            "skipped": skipped,
+            "rejected": sum(reject_reasons.values()),
+            "reject_reasons": reject_reasons,
+            "total": len(image_files)
+        }
+    
+    # Модель загружается один раз на весь проход
+    warmup([model])
+    
     try:
         from tqdm import tqdm
-        progress_bar = tqdm(image_files, desc="Удаление фона")
+        progress_bar = tqdm(total=len(tasks), desc="Удаление фона")
     except ImportError:
-        progress_bar = image_files
+        progress_bar = None
     
-    for image_file in progress_bar:
-        # Определение относительного пути для сохранения структуры директорий
-        if recursive:
-            rel_path = image_file.relative_to(input_path)
-            output_file = output_path / rel_path.with_suffix('.png')
-            output_file.parent.mkdir(parents=True, exist_ok=True)
-        else:
-            output_file = output_path / f"{image_file.stem}_nobg.png"
-        
-        if remove_background_simple(str(image_file), str(output_file), model):
-            processed += 1
-        else:
-            failed += 1
+    try:
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            if batch_size > 1:
+                results = remove_background_batch_simple(batch, model)
+            else:
+                results = [remove_background_simple(input_file, output_file, model)
+                           for input_file, output_file in batch]
+            
+            if manifest is not None:
+                for (input_file, output_file), success in zip(batch, results):
+                    if success:
+                        manifest.record(input_file, output_file)
+            
+            processed += sum(results)
+            failed += len(results) - sum(results)
+            if progress_bar is not None:
+                progress_bar.update(len(batch))
+    finally:
+        if progress_bar is not None:
+            progress_bar.close()
+        if manifest is not None:
+            manifest.compact()
     
     return {
         "processed": processed,
         "failed": failed,
+        "skipped": skipped,
+        "rejected": sum(reject_reasons.values()),
+        "reject_reasons": reject_reasons,
         "total": len(image_files)
     }
 
@@ -163,25 +270,52 @@ def main():
         """
     )
     
-    parser.add_argument('input_path', help='Путь к файлу или директории с изображениями')
-    parser.add_argument('output_path', help='Путь для сохранения результата')
+    parser.add_argument('input_path', nargs='?', help='Путь к файлу или директории с изображениями')
+    parser.add_argument('output_path', nargs='?', help='Путь для сохранения результата')
     parser.add_argument('-r', '--recursive', action='store_true', 
                        help='Рекурсивный обход поддиректорий')
     parser.add_argument('-m', '--model', default='u2net',
                        choices=['u2net', 'u2netp', 'u2net_human_seg', 'u2net_cloth_seg', 
                                'silueta', 'isnet-general-use', 'isnet-anime'],
                        help='Модель для удаления фона (по умолчанию: u2net)')
+    parser.add_argument('-b', '--batch-size', type=int, default=1,
+                       help='Количество изображений в одном вызове модели (по умолчанию: 1)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                       help='Обрабатывать только новые и изменившиеся файлы (манифест в выходной директории)')
+    parser.add_argument('--no-preflight', action='store_true',
+                       help='Не проверять заголовки файлов директории перед обработкой')
     parser.add_argument('-v', '--verbose', action='store_true', help='Подробный вывод')
-    parser.add_argument('--check-deps', action='store_true', help='Проверить и установить зависимости')
+    parser.add_argument('--check-deps', action='store_true', help='Проверить зависимости')
+    parser.add_argument('--prefetch', nargs='+', metavar='MODEL',
+                       help='Скачать модели в кэш (BG_REMOVE_HOME) и выйти, например при сборке Docker-образа')
+    parser.add_argument('--verify-models', nargs='*', metavar='MODEL',
+                       help='Проверить модели в кэше (по умолчанию все скачанные через --prefetch) и выйти')
     
     args = parser.parse_args()
     
+    if args.batch_size < 1:
+        parser.error("--batch-size должен быть не меньше 1")
+    
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
     if args.check_deps:
-        check_dependencies()
-        return
+        sys.exit(0 if check_dependencies() else 1)
+    
+    if args.prefetch or args.verify_models is not None:
+        import model_cache
+        model_cache.configure(model_dir=os.getenv(model_cache.HOME_ENV))
+        if args.prefetch:
+            report = model_cache.prefetch(args.prefetch)
+        else:
+            report = model_cache.verify(args.verify_models or model_cache.recorded_models())
+        for entry in report:
+            status = "❌" if entry.get('error') else "✅"
+            print(f"{status} {entry['model']}: {entry.get('error') or entry['path']}")
+        sys.exit(1 if not report or any(entry.get('error') for entry in report) else 0)
+    
+    if args.input_path is None or args.output_path is None:
+        parser.error("нужно указать input_path и output_path")
     
     input_path = Path(args.input_path)
     output_path = Path(args.output_path)
@@ -219,15 +353,23 @@ def main():
                 str(input_path),
                 str(output_path),
                 recursive=args.recursive,
-                model=args.model
+                model=args.model,
+                batch_size=args.batch_size,
+                incremental=args.incremental,
+                preflight=not args.no_preflight
             )
             
             print(f"\n📊 Статистика обработки:")
             print(f"   Всего файлов: {stats['total']}")
             print(f"   Обработано: {stats['processed']}")
+            if args.incremental:
+                print(f"   Пропущено (без изменений): {stats['skipped']}")
+            if stats['rejected']:
+                reasons = ', '.join(f"{reason}: {count}" for reason, count in sorted(stats['reject_reasons'].items()))
+                print(f"   Отклонено при проверке: {stats['rejected']} ({reasons})")
             print(f"   Ошибок: {stats['failed']}")
             
-            if stats['failed'] > 0:
+            if stats['failed'] > 0 or stats['rejected'] > 0:
                 sys.exit(1)
         else:
             print(f"❌ Путь не существует: {input_path}")
@@ -0,0 +1,68 @@
+"""
+Общие фикстуры тестов
+Вместо ONNX-модели используется заглушка внутренней сессии: ее "маска" -
+яркость входного тензора, поэтому результат детерминирован и не требует
+скачивания моделей
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+# Модули пакета лежат плоско рядом с setup.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeInnerSession:
+    """Заглушка onnxruntime.InferenceSession с динамическим батчем"""
+
+    def __init__(self, batch_dim='batch'):
+        self.batch_dim = batch_dim
+        self.calls = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name='input.1', shape=[self.batch_dim, 3, 320, 320])]
+
+    def run(self, output_names, feed):
+        batch = feed['input.1']
+        self.calls.append(batch.shape[0])
+        # Выход в форме u2net: N x 1 x H x W
+        return [batch.mean(axis=1, keepdims=True)]
+
+
+def make_session(model_name: str = 'u2netp', batch_dim='batch'):
+    """Сессия rembg нужного класса поверх заглушки, без загрузки модели"""
+    from rembg.sessions import sessions_class
+
+    session_class = next(cls for cls in sessions_class if cls.name() == model_name)
+    session = object.__new__(session_class)
+    session.model_name = model_name
+    session.inner_session = FakeInnerSession(batch_dim)
+    return session
+
+
+def make_image(size=(96, 72), seed: int = 0) -> Image.Image:
+    """Светлый эллипс на темном шумном фоне: у маски есть и объект, и фон"""
+    rng = np.random.default_rng(seed)
+    array = rng.integers(0, 40, (size[1], size[0], 3), dtype=np.uint8)
+    image = Image.fromarray(array, 'RGB')
+    draw = ImageDraw.Draw(image)
+    width, height = size
+    offset = seed % 7
+    draw.ellipse((width // 4 + offset, height // 4, width * 3 // 4 + offset, height * 3 // 4),
+                 fill=(230, 220 - seed, 210))
+    return image
+
+
+@pytest.fixture
+def session():
+    return make_session('u2netp')
+
+
+@pytest.fixture
+def images():
+    return [make_image(size, seed) for seed, size in enumerate([(96, 72), (64, 64), (120, 80)])]
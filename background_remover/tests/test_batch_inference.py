@@ -0,0 +1,35 @@
+"""
+Пакетный инференс дает те же маски, что session.predict для каждого
+изображения по отдельности
+"""
+
+import numpy as np
+import pytest
+
+from batch_inference import predict_masks
+from conftest import make_session
+
+
+@pytest.mark.parametrize('model_name', ['u2netp', 'u2net', 'isnet-general-use'])
+def test_batched_masks_match_per_image_predict(images, model_name):
+    session = make_session(model_name)
+    expected = [session.predict(image)[0] for image in images]
+
+    masks = predict_masks(session, images, model_name)
+
+    assert session.inner_session.calls[-1] == len(images)
+    for mask, reference in zip(masks, expected):
+        assert mask.size == reference.size
+        np.testing.assert_array_equal(np.asarray(mask), np.asarray(reference))
+
+
+def test_fixed_batch_model_runs_in_parts(images):
+    session = make_session('u2netp', batch_dim=1)
+    expected = [session.predict(image)[0] for image in images]
+    session.inner_session.calls.clear()
+
+    masks = predict_masks(session, images, 'u2netp')
+
+    assert session.inner_session.calls == [1] * len(images)
+    for mask, reference in zip(masks, expected):
+        np.testing.assert_array_equal(np.asarray(mask), np.asarray(reference))
@@ -0,0 +1,40 @@
+"""
+Вырезание по маске совпадает с rembg.remove закрепленной версии,
+в том числе когда alpha matting невозможен
+"""
+
+import numpy as np
+import pytest
+from PIL import Image
+from rembg import remove
+
+from batch_inference import cutout, remove_batch
+
+
+def _pixels(image: Image.Image) -> np.ndarray:
+    return np.asarray(image.convert('RGBA'))
+
+
+@pytest.mark.parametrize('alpha_matting', [False, True])
+def test_remove_batch_matches_rembg_remove(session, images, alpha_matting):
+    expected = [remove(image, session=session, alpha_matting=alpha_matting) for image in images]
+    results = remove_batch(session, 'u2netp', images, output_type='pil', alpha_matting=alpha_matting)
+    for result, reference in zip(results, expected):
+        np.testing.assert_array_equal(_pixels(result), _pixels(reference))
+
+
+@pytest.mark.parametrize('mask_value', [0, 128, 255])
+def test_matting_failure_falls_back_like_rembg(images, mask_value):
+    # В trimap однородной маски нет переднего плана или фона:
+    # alpha_matting_cutout бросает ValueError
+    image = images[0]
+    mask = Image.new('L', image.size, mask_value)
+
+    class MaskSession:
+        def predict(self, img, *args, **kwargs):
+            return [mask]
+
+    reference = remove(image, session=MaskSession(), alpha_matting=True)
+    result = cutout(image, mask, alpha_matting=True)
+    np.testing.assert_array_equal(_pixels(result), _pixels(reference))
+
@@ -0,0 +1,128 @@
+"""
+Разбор HTTP-запросов сервера: строка запроса, заголовки, тело и параметры
+"""
+
+import asyncio
+
+import pytest
+
+from inference_server import HTTPError, InferenceServer
+
+
+@pytest.fixture
+def server():
+    server = InferenceServer(['u2netp'], ['u2netp'], max_concurrency=1, max_body_bytes=1024)
+    yield server
+    server.executor.shutdown()
+
+
+def _read(server, raw: bytes):
+    async def read():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await server._read_request(reader)
+    return asyncio.run(read())
+
+
+def _status(server, raw: bytes) -> int:
+    with pytest.raises(HTTPError) as error:
+        _read(server, raw)
+    return error.value.status
+
+
+def test_request_with_body(server):
+    method, target, version, headers, body = _read(
+        server, b"post /remove?model=u2netp HTTP/1.1\r\nContent-Length: 5\r\nX-Test:  a:b \r\n\r\nhelloEXTRA")
+
+    assert (method, target, version) == ("POST", "/remove?model=u2netp", "HTTP/1.1")
+    assert headers['x-test'] == "a:b"
+    assert body == b"hello"
+
+
+def test_request_without_body(server):
+    assert _read(server, b"GET /health HTTP/1.1\r\n\r\n")[4] == b""
+
+
+def test_closed_connection(server):
+    assert _read(server, b"") is None
+
+
+@pytest.mark.parametrize('raw, status', [
+    (b"GARBAGE\r\n\r\n", 400),
+    (b"POST /remove HTTP/1.1\r\nContent-Length: -5\r\n\r\n", 400),
+    (b"POST /remove HTTP/1.1\r\nContent-Length: abc\r\n\r\n", 400),
+    ("POST /remove HTTP/1.1\r\nContent-Length: ²\r\n\r\n".encode('latin-1'), 400),
+    (b"POST /remove HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n", 411),
+    (b"POST /remove HTTP/1.1\r\nContent-Length: 2048\r\n\r\n", 413),
+])
+def test_invalid_requests(server, raw, status):
+    assert _status(server, raw) == status
+
+
+def test_truncated_body(server):
+    with pytest.raises(asyncio.IncompleteReadError):
+        _read(server, b"POST /remove HTTP/1.1\r\nContent-Length: 10\r\n\r\nabc")
+
+
+def test_matting_params():
+    params = InferenceServer._parse_params({'alpha_matting': ['true'], 'erode_size': ['5'],
+                                            'fast_matting': ['1'], 'matting_scale': ['0.25']})
+    assert params == {
+        'alpha_matting': True,
+        'alpha_matting_foreground_threshold': 240,
+        'alpha_matting_background_threshold': 10,
+        'alpha_matting_erode_size': 5,
+        'alpha_matting_fast': True,
+        'alpha_matting_scale': 0.25,
+    }
+    # Без alpha matting пороги не влияют на результат и не попадают в параметры
+    assert InferenceServer._parse_params({'erode_size': ['5']}) == {'alpha_matting': False}
+
+
+@pytest.mark.parametrize('query', [
+    {'alpha_matting': ['1'], 'erode_size': ['x']},
+    {'alpha_matting': ['1'], 'fast_matting': ['1'], 'matting_scale': ['2']},
+])
+def test_invalid_matting_params(query):
+    with pytest.raises(HTTPError) as error:
+        InferenceServer._parse_params(query)
+    assert error.value.status == 400
+
+
+def test_multipart_upload():
+    boundary = "XyZ"
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.png\"\r\n"
+            f"Content-Type: image/png\r\n\r\n").encode() + b"\x89PNGdata" + f"\r\n--{boundary}--\r\n".encode()
+    headers = {'content-type': f"multipart/form-data; boundary={boundary}"}
+    assert InferenceServer._extract_image(headers, body) == b"\x89PNGdata"
+
+
+def test_idle_batchers_are_evicted():
+    server = InferenceServer(['u2netp'], ['u2netp'], max_concurrency=1, max_batchers=2)
+    server._removers['u2netp'] = object()
+
+    async def run():
+        first = await server._get_batcher('u2netp', {'alpha_matting': False})
+        await server._get_batcher('u2netp', {'alpha_matting': True, 'alpha_matting_erode_size': 1})
+        # Использованный последним сборщик не вытесняется
+        assert await server._get_batcher('u2netp', {'alpha_matting': False}) is first
+        await server._get_batcher('u2netp', {'alpha_matting': True, 'alpha_matting_erode_size': 2})
+        await asyncio.sleep(0)
+
+        assert len(server._batchers) == 2
+        assert first in server._batchers.values()
+        assert sum(batcher._task.cancelled() for batcher in server._batchers.values()) == 0
+
+        # Сборщик с ожидающими запросами не останавливается
+        first.pending = 1
+        await server._get_batcher('u2netp', {'alpha_matting': True, 'alpha_matting_erode_size': 3})
+        assert first in server._batchers.values() and len(server._batchers) == 2
+        first.pending = 0
+        for batcher in server._batchers.values():
+            batcher.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.executor.shutdown()
@@ -0,0 +1,131 @@
+"""
+Аренда заданий, истечение аренды и повторные попытки в обоих хранилищах очереди
+"""
+
+import time
+
+import pytest
+
+from job_queue import DONE, FAILED, LEASED, PENDING, LeaseHeartbeat, SpoolQueue, SqliteQueue, make_job
+
+
+@pytest.fixture(params=['sqlite', 'spool'])
+def queue(request, tmp_path):
+    if request.param == 'sqlite':
+        queue = SqliteQueue(str(tmp_path / "queue.db"))
+    else:
+        queue = SpoolQueue(str(tmp_path / "spool"))
+        # Только что арендованные задания не считаются просроченными несколько
+        # секунд; в тестах аренда истекает сразу
+        queue._RECLAIM_GRACE = 0
+    yield queue
+    queue.close()
+
+
+def _submit(queue, count=1, max_attempts=3):
+    jobs = [make_job(f"/data/in/{index}.jpg", f"/data/out/{index}.png", {"model": "u2netp"},
+                     max_attempts=max_attempts)
+            for index in range(count)]
+    assert queue.submit(jobs) == count
+    return jobs
+
+
+def test_job_is_leased_once(queue):
+    _submit(queue, 2)
+
+    first = queue.lease("w1", 1)
+    second = queue.lease("w2", 5)
+
+    assert len(first) == 1 and len(second) == 1
+    assert first[0].id != second[0].id
+    assert queue.lease("w3", 5) == []
+    assert first[0].attempts == 1
+
+
+def test_resubmit_without_flag_does_not_duplicate(queue):
+    jobs = _submit(queue)
+    assert queue.submit(jobs) == 0
+    assert queue.counts().get(PENDING) == 1
+
+
+def test_expired_lease_is_reissued(queue):
+    _submit(queue)
+    (job,) = queue.lease("w1", 1, lease_seconds=-1)
+
+    (again,) = queue.lease("w2", 1)
+
+    assert again.id == job.id
+    assert again.attempts == 2
+    # Опоздавший воркер не может отметить неудачу чужой аренды
+    queue.fail(job, "w1", "late")
+    assert queue.counts().get(LEASED) == 1
+
+
+def test_renewed_lease_is_not_reissued(queue):
+    _submit(queue)
+    jobs = queue.lease("w1", 1, lease_seconds=-1)
+    queue.renew(jobs, "w1", lease_seconds=60)
+
+    assert queue.lease("w2", 1) == []
+
+
+def test_failed_attempts_are_retried_until_limit(queue):
+    _submit(queue, max_attempts=2)
+
+    (job,) = queue.lease("w1", 1)
+    queue.fail(job, "w1", "boom")
+    assert queue.counts().get(PENDING) == 1
+
+    (job,) = queue.lease("w1", 1)
+    queue.fail(job, "w1", "boom")
+    assert queue.counts().get(FAILED) == 1
+    assert queue.failures() == [(job.input_file, "boom")]
+    assert queue.lease("w1", 1) == []
+
+
+def test_expired_lease_on_last_attempt_fails(queue):
+    _submit(queue, max_attempts=1)
+    queue.lease("w1", 1, lease_seconds=-1)
+
+    assert queue.lease("w2", 1) == []
+    assert queue.counts().get(FAILED) == 1
+
+
+def test_complete(queue):
+    _submit(queue)
+    (job,) = queue.lease("w1", 1)
+    queue.complete(job, "w1")
+
+    counts = queue.counts()
+    assert counts.get(DONE) == 1
+    assert not counts.get(LEASED) and not counts.get(PENDING)
+
+
+def test_heartbeat_keeps_lease_of_slow_job(queue):
+    _submit(queue)
+    jobs = queue.lease("w1", 1, lease_seconds=0.3)
+
+    with LeaseHeartbeat(queue, "w1", lease_seconds=0.3) as heartbeat:
+        heartbeat.track(jobs)
+        time.sleep(1.0)
+        # Обработка длится дольше аренды, но задание не выдается другому воркеру
+        assert queue.lease("w2", 1) == []
+        heartbeat.complete(jobs[0])
+
+    assert queue.counts().get(DONE) == 1
+    assert not queue.counts().get(LEASED)
+
+
+def test_resubmit_returns_leased_job_once(queue):
+    jobs = _submit(queue)
+    (job,) = queue.lease("w1", 1)
+
+    assert queue.submit(jobs, resubmit=True) == 1
+
+    counts = queue.counts()
+    assert counts.get(PENDING) == 1 and not counts.get(LEASED)
+    (again,) = queue.lease("w2", 5)
+    assert again.id == job.id and again.attempts == 1
+    # Неудача прежней аренды не трогает заново отправленное задание
+    queue.fail(job, "w1", "late")
+    assert queue.counts().get(LEASED) == 1
@@ -0,0 +1,43 @@
+"""
+Оценка памяти на обработку большого изображения полосами
+"""
+
+import pytest
+
+from large_image import ImageHeader, strip_rows_for
+from outputs import EncodeOptions, OutputVariant, VariantWriter
+
+MB = 2 ** 20
+
+
+def _header(mode='RGB', image_format='PNG', transposed=False):
+    return ImageHeader((8000, 6000), mode, image_format, transposed)
+
+
+def test_limit_below_full_size_buffers_is_rejected():
+    # Исходное RGB (4 байта на пиксель в PIL) и результат RGBA полного размера
+    with pytest.raises(MemoryError):
+        strip_rows_for(_header(), 8000 * 6000 * 8 - 1)
+
+
+def test_strip_rows_grow_with_limit():
+    small = strip_rows_for(_header(), 600 * MB)
+    large = strip_rows_for(_header(), 900 * MB)
+    assert 1 <= small < large <= 6000
+
+
+def test_input_and_encoders_raise_floor():
+    limit = 420 * MB
+    strip_rows_for(_header(), limit)
+    with pytest.raises(MemoryError):
+        strip_rows_for(_header(), limit, input_bytes=100 * MB)
+    with pytest.raises(MemoryError):
+        strip_rows_for(_header(), limit, encode_bytes_per_pixel=8)
+
+
+def test_encode_bytes_per_pixel():
+    assert VariantWriter([]).encode_bytes_per_pixel() == 0
+    assert VariantWriter([], output_format='webp').encode_bytes_per_pixel() == 4
+    assert VariantWriter([OutputVariant('mask'), OutputVariant(size=(256, 256))]).encode_bytes_per_pixel() == 1
+    assert VariantWriter([OutputVariant(format='jpg')], options=EncodeOptions(palette=64)).encode_bytes_per_pixel() \
+        == 1 + (1 + 4 + 4 + 4)
@@ -0,0 +1,80 @@
+"""
+Манифест пропускает обработанные файлы и перестает считать их
+обработанными при изменении файла, выхода или параметров
+"""
+
+import os
+
+import pytest
+
+from manifest import Manifest
+
+PARAMS = {"model": "u2netp", "alpha_matting": False}
+
+
+@pytest.fixture
+def processed(tmp_path):
+    """Входной файл, обработанный с PARAMS, и его выход"""
+    input_file = tmp_path / "in" / "a.jpg"
+    output_file = tmp_path / "out" / "a_nobg.png"
+    input_file.parent.mkdir()
+    output_file.parent.mkdir()
+    input_file.write_bytes(b"input")
+    output_file.write_bytes(b"output")
+
+    manifest = Manifest(str(output_file.parent), PARAMS)
+    manifest.record(str(input_file), str(output_file))
+    manifest.close()
+    return input_file, output_file
+
+
+def test_processed_file_is_skipped(processed):
+    input_file, output_file = processed
+    manifest = Manifest(str(output_file.parent), dict(PARAMS))
+
+    pending = list(manifest.iter_pending([(str(input_file), str(output_file))]))
+
+    assert pending == []
+    assert manifest.skipped == 1
+
+
+def test_changed_input_is_processed_again(processed):
+    input_file, output_file = processed
+    input_file.write_bytes(b"changed input")
+
+    manifest = Manifest(str(output_file.parent), PARAMS)
+    assert not manifest.is_current(str(input_file), str(output_file))
+
+
+def test_touched_input_is_processed_again(processed):
+    input_file, output_file = processed
+    stat = input_file.stat()
+    os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    manifest = Manifest(str(output_file.parent), PARAMS)
+    assert not manifest.is_current(str(input_file), str(output_file))
+
+
+def test_other_params_invalidate(processed):
+    input_file, output_file = processed
+    manifest = Manifest(str(output_file.parent), dict(PARAMS, alpha_matting=True))
+    assert not manifest.is_current(str(input_file), str(output_file))
+
+
+def test_missing_output_invalidates(processed):
+    input_file, output_file = processed
+    output_file.unlink()
+
+    manifest = Manifest(str(output_file.parent), PARAMS)
+    assert not manifest.is_current(str(input_file), str(output_file))
+
+
+def test_compact_keeps_last_entry(processed):
+    input_file, output_file = processed
+    manifest = Manifest(str(output_file.parent), PARAMS)
+    for _ in range(3):
+        manifest.record(str(input_file), str(output_file))
+    manifest.compact()
+
+    assert len(manifest.path.read_text(encoding='utf-8').splitlines()) == 1
+    assert Manifest(str(output_file.parent), PARAMS).is_current(str(input_file), str(output_file))
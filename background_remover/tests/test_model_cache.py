@@ -0,0 +1,27 @@
+"""
+Путь к файлу модели в раскладках разных версий rembg
+"""
+
+from pathlib import Path
+
+import model_cache
+
+
+class LegacySession:
+    """Сессия rembg без model_dir и resolve_existing"""
+
+    @classmethod
+    def u2net_home(cls):
+        return "/legacy/.u2net"
+
+
+def test_model_path_falls_back_to_u2net_home(monkeypatch):
+    monkeypatch.setattr(model_cache, 'session_class', lambda base: LegacySession)
+    assert model_cache.model_path('u2netp') == Path("/legacy/.u2net/u2netp.onnx")
+
+
+def test_model_path_uses_model_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("REMBG_HOME", str(tmp_path))
+    monkeypatch.delenv("U2NET_HOME", raising=False)
+    path = model_cache.model_path('u2netp')
+    assert path.name == "u2netp.onnx" and tmp_path in path.parents
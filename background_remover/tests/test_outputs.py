@@ -0,0 +1,57 @@
+"""
+Атомарная запись выходных файлов и пул кодирования дополнительных файлов
+"""
+
+import pickle
+import threading
+
+import pytest
+
+from outputs import OutputVariant, VariantWriter, atomic_output, write_file
+
+
+def test_write_replaces_file(tmp_path):
+    output_file = tmp_path / "a.png"
+    output_file.write_bytes(b"old")
+
+    write_file(output_file, b"new")
+
+    assert output_file.read_bytes() == b"new"
+    assert [path.name for path in tmp_path.iterdir()] == ["a.png"]
+
+
+def test_failed_write_keeps_previous_output(tmp_path):
+    output_file = tmp_path / "a.png"
+    output_file.write_bytes(b"old")
+
+    with pytest.raises(RuntimeError):
+        with atomic_output(output_file) as tmp_name:
+            with open(tmp_name, 'wb') as f:
+                f.write(b"partial")
+            raise RuntimeError("encoder failed")
+
+    assert output_file.read_bytes() == b"old"
+    assert [path.name for path in tmp_path.iterdir()] == ["a.png"]
+
+
+def test_variant_pool_is_created_once():
+    writer = VariantWriter([OutputVariant('mask')])
+    start = threading.Barrier(8)
+    pools = []
+
+    def pool():
+        start.wait()
+        pools.append(writer._pool())
+
+    threads = [threading.Thread(target=pool) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(pools) == 8 and len(set(pools)) == 1
+    # Копия для процесса-воркера получает свой пул
+    copy = pickle.loads(pickle.dumps(writer))
+    assert copy._executor is None and copy._pool() is not writer._pool()
+    copy.close()
+    writer.close()
@@ -0,0 +1,81 @@
+"""
+Срок обработки файла вне главного потока: точки проверки, отмена
+и отказ от записи результата, не успевшего к сроку
+"""
+
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from async_remover import AsyncBackgroundRemover
+from outputs import write_file
+from preflight import FileTimeoutError, check_deadline, deadline
+
+
+def _in_thread(func):
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(func).result()
+
+
+def test_deadline_is_checked_in_worker_thread():
+    def work():
+        with deadline(0.05):
+            check_deadline()
+            time.sleep(0.1)
+            with pytest.raises(FileTimeoutError):
+                check_deadline()
+        # После выхода из блока срок больше не действует
+        check_deadline()
+
+    _in_thread(work)
+
+
+def test_nested_deadline_keeps_outer_limit():
+    def work():
+        with deadline(0.05):
+            with deadline(60):
+                time.sleep(0.1)
+                with pytest.raises(FileTimeoutError):
+                    check_deadline()
+
+    _in_thread(work)
+
+
+def test_cancelled_write_keeps_previous_output(tmp_path):
+    output_file = tmp_path / "a.png"
+    output_file.write_bytes(b"old")
+    cancel = threading.Event()
+    cancel.set()
+
+    def work():
+        with deadline(60, cancel):
+            write_file(output_file, b"late")
+
+    with pytest.raises(FileTimeoutError):
+        _in_thread(work)
+    assert output_file.read_bytes() == b"old"
+    assert [path.name for path in tmp_path.iterdir()] == ["a.png"]
+
+
+class SlowRemover:
+    file_timeout = 0.1
+
+    def remove(self, data, **kwargs):
+        time.sleep(0.3)
+        check_deadline()
+        return data
+
+
+def test_async_remove_times_out():
+    async def run():
+        async with AsyncBackgroundRemover(remover=SlowRemover(), max_workers=1) as remover:
+            with pytest.raises(FileTimeoutError):
+                await remover.remove(b"data")
+            # Место освобождается, когда вызов в пуле действительно закончился
+            while remover.in_flight:
+                await asyncio.sleep(0.05)
+
+    asyncio.run(run())
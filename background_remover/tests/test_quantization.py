@@ -0,0 +1,28 @@
+"""
+Создание варианта модели не оставляет недописанных файлов при ошибке
+"""
+
+import onnxruntime.quantization
+import pytest
+
+import quantization
+from model_cache import HOME_ENV
+
+
+def test_failed_conversion_removes_partial_file(tmp_path, monkeypatch):
+    monkeypatch.setenv(HOME_ENV, str(tmp_path))
+    monkeypatch.setattr(quantization, 'base_model_path', lambda base: tmp_path / f"{base}.onnx")
+
+    def failing_quantize(source, output, **kwargs):
+        with open(output, 'wb') as f:
+            f.write(b"half-written model")
+        raise RuntimeError("quantization failed")
+
+    monkeypatch.setattr(onnxruntime.quantization, 'quantize_dynamic', failing_quantize)
+
+    with pytest.raises(RuntimeError):
+        quantization.quantize_model('u2netp', 'int8')
+
+    output = quantization.variant_path('u2netp', 'int8')
+    assert not output.exists()
+    assert list(output.parent.iterdir()) == []
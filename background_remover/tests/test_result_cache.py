@@ -0,0 +1,77 @@
+"""
+Учет размера кэша результатов и вытеснение давно использованных записей
+"""
+
+import os
+import time
+
+import pytest
+
+from result_cache import ResultCache, content_key
+
+
+def _key(name: str) -> str:
+    return content_key(name.encode('utf-8'), model="u2netp")
+
+
+@pytest.mark.parametrize('use_sqlite', [False, True])
+def test_overwrite_counts_size_once(tmp_path, use_sqlite):
+    cache = ResultCache(str(tmp_path), use_sqlite=use_sqlite)
+    cache.size()
+    for _ in range(5):
+        cache.put(_key("a"), b"x" * 1000)
+    assert cache.size() == 1000
+
+    cache.put(_key("a"), b"x" * 300)
+    cache.put(_key("b"), b"y" * 200)
+    assert cache.size() == 500
+
+
+@pytest.mark.parametrize('use_sqlite', [False, True])
+def test_size_matches_files_after_reopen(tmp_path, use_sqlite):
+    cache = ResultCache(str(tmp_path), use_sqlite=use_sqlite)
+    cache.put(_key("a"), b"x" * 100)
+    cache.put(_key("b"), b"y" * 50)
+
+    assert ResultCache(str(tmp_path), use_sqlite=use_sqlite).size() == 150
+
+
+def test_evict_removes_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    now = time.time()
+    for age, name in enumerate(["new", "middle", "old"]):
+        cache.put(_key(name), b"z" * 100)
+        os.utime(cache._path(_key(name)), (now - age * 100, now - age * 100))
+    # Чтение обновляет время доступа: "old" становится самой свежей записью
+    assert cache.get(_key("old")) == b"z" * 100
+
+    removed = cache.evict(target_bytes=200)
+
+    assert removed == 1
+    assert cache.get(_key("middle")) is None
+    assert cache.get(_key("new")) is not None
+    assert cache.get(_key("old")) is not None
+    assert cache.size() == 200
+
+
+@pytest.mark.parametrize('use_sqlite', [False, True])
+def test_put_evicts_over_limit(tmp_path, use_sqlite):
+    cache = ResultCache(str(tmp_path), max_bytes=1000, use_sqlite=use_sqlite)
+    for index in range(12):
+        cache.put(_key(str(index)), b"w" * 100)
+    assert cache.size() <= 1000
+    # Последняя запись только что записана и не вытесняется
+    assert cache.get(_key("11")) is not None
+
+
+def test_key_depends_on_large_image_threshold(tmp_path):
+    from background_remover import BackgroundRemover
+    from large_image import LARGE_IMAGE_PIXELS
+
+    cache = ResultCache(str(tmp_path))
+    keys = {BackgroundRemover(model_name="u2netp", cache=cache, large_image_pixels=threshold).cache_key(b"data")
+            for threshold in (LARGE_IMAGE_PIXELS, 1_000_000, None)}
+    assert len(keys) == 3
+    # Ключи при пороге по умолчанию не меняются
+    assert BackgroundRemover(model_name="u2netp", cache=cache).cache_key(b"data") == \
+        content_key(b"data", model="u2netp", alpha_matting=False)
@@ -0,0 +1,117 @@
+"""
+Переиспользование масок в SequenceProcessor.run: каждому кадру достается
+маска последнего ключевого кадра, в том числе через границу пачек
+"""
+
+import pytest
+from PIL import Image
+
+from conftest import make_image
+from sequence import SequenceOptions, SequenceProcessor, group_sequences
+
+
+def _frames(pattern):
+    """Кадры по шаблону: одинаковые буквы - одинаковые кадры"""
+    scenes = {}
+    frames = []
+    for index, scene in enumerate(pattern):
+        if scene not in scenes:
+            scenes[scene] = make_image((64, 64), seed=len(scenes) * 3)
+        frames.append((f"frame_{index:04d}.png", f"out_{index:04d}.png", scenes[scene].copy()))
+    return frames
+
+
+def _expected_keys(pattern, keyframe_interval):
+    """Номер ключевого кадра для каждого кадра"""
+    keys = []
+    key = None
+    since = 0
+    for index, scene in enumerate(pattern):
+        if key is not None and pattern[key] == scene and since < keyframe_interval:
+            since += 1
+        else:
+            key, since = index, 0
+        keys.append(key)
+    return keys
+
+
+class Recorder:
+    """Маска - номер ключевого кадра, запись запоминает, какая маска досталась кадру"""
+
+    def __init__(self, frames, fail_calls=()):
+        self.index_of = {id(image): index for index, (_, _, image) in enumerate(frames)}
+        self.written = {}
+        self.calls = 0
+        self.fail_calls = set(fail_calls)
+
+    def predict(self, images):
+        self.calls += 1
+        if self.calls in self.fail_calls:
+            raise RuntimeError("inference failed")
+        return [self.index_of[id(image)] for image in images]
+
+    def write(self, image, mask, output_file):
+        self.written[output_file] = mask
+        return True
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 5])
+def test_frames_get_mask_of_their_keyframe(batch_size):
+    pattern = "AAABBBBAACCCCCCCCC"
+    frames = _frames(pattern)
+    recorder = Recorder(frames)
+    processor = SequenceProcessor(SequenceOptions(diff_threshold=0.5, keyframe_interval=4))
+
+    results = list(processor.run(frames, recorder.predict, recorder.write, batch_size=batch_size))
+
+    assert [name for name, _, _ in results] == [name for name, _, _ in frames]
+    assert all(success for _, _, success in results)
+    expected = _expected_keys(pattern, keyframe_interval=4)
+    assert [recorder.written[output] for _, output, _ in frames] == expected
+    assert processor.report() == {"frames": len(pattern), "keyframes": len(set(expected)),
+                                  "reused": len(pattern) - len(set(expected))}
+
+
+def test_failed_prediction_fails_its_frames_and_restarts():
+    pattern = "AAAAAA"
+    frames = _frames(pattern)
+    # Первая пачка (ключевой кадр 0 и кадры с его маской) не получает масок
+    recorder = Recorder(frames, fail_calls={1})
+    processor = SequenceProcessor(SequenceOptions(diff_threshold=0.5, keyframe_interval=100))
+
+    results = list(processor.run(frames, recorder.predict, recorder.write, batch_size=1))
+
+    successes = [success for _, _, success in results]
+    assert successes[0] is False
+    # После неудачи следующий кадр снова ключевой, и кадры после него получают его маску
+    first_ok = successes.index(True)
+    assert all(successes[first_ok:])
+    assert set(recorder.written.values()) == {first_ok}
+
+
+def test_unreadable_frame_fails_alone():
+    frames = _frames("AAA")
+    frames[1] = (frames[1][0], frames[1][1], None)
+    recorder = Recorder(frames)
+
+    results = list(SequenceProcessor().run(frames, recorder.predict, recorder.write))
+
+    assert [success for _, _, success in results] == [True, False, True]
+
+
+def test_group_sequences():
+    tasks = [(f"/d/frame_{index}.png", f"/o/{index}.png") for index in (3, 1, 2, 10)]
+    tasks += [("/d/photo.jpg", "/o/photo.png"), ("/d/shot_1.png", "/o/s1.png")]
+
+    sequences, singles = group_sequences(tasks)
+
+    assert [[task[0] for task in sequence] for sequence in sequences] == [
+        ["/d/frame_1.png", "/d/frame_2.png", "/d/frame_3.png", "/d/frame_10.png"]]
+    assert singles == [("/d/photo.jpg", "/o/photo.png"), ("/d/shot_1.png", "/o/s1.png")]
+
+
+def test_different_size_is_keyframe():
+    processor = SequenceProcessor()
+    assert processor.is_keyframe(Image.new('RGB', (64, 64)))
+    assert not processor.is_keyframe(Image.new('RGB', (64, 64)))
+    assert processor.is_keyframe(Image.new('RGB', (64, 48)))